@@ -1,85 +1,2880 @@
+import time
+
+
+class StartupTimer:
+    """启动耗时统计"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.marks = []
+
+    def mark(self, name):
+        """记录从上一个标记到现在的耗时"""
+        now = time.perf_counter()
+        self.marks.append((name, now - self.last))
+        self.last = now
+
+    def measure(self, name, func, *args, **kwargs):
+        """单独计时一次调用（如按需构建页面），不影响阶段标记"""
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.marks.append((name, time.perf_counter() - t0))
+
+    def report(self):
+        lines = [f"  {name:<24}{elapsed * 1000:9.1f} ms" for name, elapsed in self.marks]
+        lines.append(f"  {'总计(至窗口可响应)':<24}{(self.last - self.start) * 1000:9.1f} ms")
+        return "启动耗时统计：\n" + "\n".join(lines)
+
+
+STARTUP_TIMER = StartupTimer()
+
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
 import sqlite3
 from datetime import datetime
 import json
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib.font_manager as fm
+import csv
+import numpy as np
 
 import traceback
 import os
+import io
+import bisect
+import cProfile
+import pstats
+from contextlib import contextmanager
+import threading
+import weakref
+import atexit
+import functools
+import itertools
+import queue
+import hashlib
+import ast
+import math
+import operator
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+STARTUP_TIMER.mark("导入基础模块")
+
+# 中文字体候选（按优先级）
+CHINESE_FONTS = ['Microsoft YaHei', 'SimHei', 'KaiTi', 'FangSong']
+
+
+@functools.lru_cache(maxsize=None)
+def load_matplotlib():
+    """首次显示图表时才加载 matplotlib，返回 (Figure, FigureCanvasTkAgg)"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    configure_fonts()
+    return Figure, FigureCanvasTkAgg
+
+
+@functools.lru_cache(maxsize=None)
+def configure_fonts():
+    """配置中文字体，只解析一次：优先使用本机已安装的候选字体"""
+    import matplotlib
+    import matplotlib.font_manager as fm
+    installed = {f.name for f in fm.fontManager.ttflist}
+    fonts = [name for name in CHINESE_FONTS if name in installed] or CHINESE_FONTS
+    matplotlib.rcParams['font.sans-serif'] = fonts + list(matplotlib.rcParams['font.sans-serif'])
+    matplotlib.rcParams['axes.unicode_minus'] = False
+    return tuple(fonts)
+
+@functools.lru_cache(maxsize=None)
+def load_pyarrow():
+    """首次读写归档时才加载 pyarrow，返回 (pyarrow, pyarrow.parquet)；未安装时抛出 ImportError"""
+    import pyarrow
+    import pyarrow.parquet
+    return pyarrow, pyarrow.parquet
+
+# 数据库配置
+DB_PATH = 'calc_history.db'
+
+# 写回(write-behind)模式：记录先进入内存缓冲，由后台线程每 N 条或每 T 毫秒合并为一个事务提交
+WRITE_BEHIND_ENABLED = False
+WRITE_BEHIND_BATCH_SIZE = 200
+WRITE_BEHIND_INTERVAL_MS = 500
+WRITE_BEHIND_SYNCHRONOUS = 'NORMAL'  # 持久化级别：OFF / NORMAL / FULL / EXTRA
+
+# 连接池：日志模式、等待其他连接释放锁的超时、只读连接数及每个连接的缓存设置
+DB_JOURNAL_MODE = 'WAL'
+DB_BUSY_TIMEOUT_MS = 5000
+DB_READ_POOL_SIZE = 8
+DB_CACHE_SIZE_KB = 16384
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_TEMP_STORE = 'MEMORY'
+
+# 数据库结构版本（PRAGMA user_version）：2 起参数以 float64 紧凑二进制存储，3 起时间戳为 UTC 微秒整数，
+# 4 起参数值另存于 param_values 表并建索引，供按参数范围筛选
+PARAMS_SCHEMA_VERSION = 2
+TIMESTAMP_SCHEMA_VERSION = 3
+SCHEMA_VERSION = 4
+
+# 参数值索引：向量参数按 1 起的序号命名，只索引前若干个；具名参数按名称索引
+PARAM_INDEX_LIMIT = 32
+# 参数条件匹配的索引行少于该数时由参数值索引驱动查询，否则按时间顺序扫描并逐条检查
+PARAM_FILTER_SELECTIVE_ROWS = 20_000
+
+# 归档：早于保留天数的记录按本地日期移入压缩的 Parquet 分区（需要 pyarrow），查询时与热数据合并
+ARCHIVE_DIR = 'calc_archive'
+ARCHIVE_RETENTION_DAYS = 180
+ARCHIVE_ON_STARTUP = False
+ARCHIVE_COMPRESSION = 'zstd'
+ARCHIVE_BATCH_ROWS = 50_000
+ARCHIVE_CACHE_PARTITIONS = 8  # 内存中保留最近读取的分区数
+VACUUM_STEP_PAGES = 2000      # 每步增量回收的空闲页数
+
+# 计算结果缓存：内存 LRU 容量；计算逻辑变化时递增对应页面的内核版本，旧缓存随之失效
+MEMO_CACHE_SIZE = 1024
+KERNEL_VERSIONS = {"参数求和": 1, "参数求积": 1, "综合计算": 1, "向量求和": 1, "向量求积": 1}
+# 参数去重：已有相同输入的记录时只保存对其参数的引用，不再重复存储参数二进制
+PARAM_DEDUP_ENABLED = False
+
+# 参数扫描：单块中间数组的元素上限；网格点数×样本数超过阈值时分到多个进程计算
+SWEEP_CHUNK_ELEMENTS = 4_000_000
+SWEEP_PARALLEL_THRESHOLD = 50_000_000
+SWEEP_WORKERS = None  # None 表示 CPU 核数
+
+# 批量导入：每块读取的行数，每块在一个事务内写入
+IMPORT_CHUNK_ROWS = 50_000
+
+# 变更订阅：轮询间隔；一次轮询到的变更超过该条数时通知订阅者整体重新加载；变更日志保留的条数
+CHANGE_POLL_MS = 250
+CHANGE_BATCH_LIMIT = 1000
+CHANGE_LOG_KEEP = 10_000
+# 变更日志的操作类型：新增 / 删除 / 整体变化（如批量导入，订阅者需重新加载）
+CHANGE_INSERT = 1
+CHANGE_DELETE = -1
+CHANGE_RESET = 0
+
+# 历史分析：统计摘要的分位数（百分比），滑动统计的默认窗口（条）
+SUMMARY_PERCENTILES = (5, 50, 95)
+ROLLING_WINDOW = 50
+
+INSERT_SQL = """
+    INSERT INTO calculations (timestamp, page, result, param_kind, param_blob, param_keys, param_hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?)"""
+# 去重写入：引用同一哈希的首条原始记录，找不到时照常保存参数
+INSERT_DEDUP_SQL = """
+    INSERT INTO calculations (timestamp, page, result, param_kind, param_blob, param_keys, param_hash, param_ref)
+    SELECT ?1, ?2, ?3, ?4, CASE WHEN ref IS NULL THEN ?5 ELSE x'' END, ?6, ?7, ref
+    FROM (SELECT (SELECT id FROM calculations WHERE param_hash = ?7 AND param_ref IS NULL LIMIT 1) AS ref)"""
+# 迁移完成前旧表仍有非空的 parameters 列，需要同时写入 JSON
+INSERT_LEGACY_SQL = """
+    INSERT INTO calculations (timestamp, page, result, param_kind, param_blob, param_keys, param_hash, parameters)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+# 读取参数二进制：引用记录取被引用记录的参数
+PARAM_BLOB_SQL = ("CASE WHEN param_ref IS NULL THEN param_blob ELSE "
+                  "(SELECT ref.param_blob FROM calculations AS ref WHERE ref.id = calculations.param_ref) END")
+
+# 汇总表粒度：(名称, 桶宽秒数)，按从粗到细排列
+ROLLUP_GRANULARITIES = (
+    ('day', 86400),
+    ('hour', 3600),
+    ('minute', 60),
+)
+
+# 时间戳以 UTC 微秒整数存储；查询参数仍可使用以下格式的本地时间字符串，附带该格式的精度（微秒）
+TIME_FORMATS = (
+    ("%Y-%m-%d %H:%M:%S.%f", 1),
+    ("%Y-%m-%d %H:%M:%S", 1_000_000),
+    ("%Y-%m-%d %H:%M", 60_000_000),
+    ("%Y-%m-%d", 86400_000_000),
+)
+DISPLAY_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# 本地标准时区相对 UTC 的偏移（微秒），汇总桶据此按本地整点、零点对齐
+LOCAL_UTC_OFFSET_US = -time.timezone * 1_000_000
+
+
+def now_epoch_us():
+    return time.time_ns() // 1000
+
+
+def to_epoch_us(value, end=False):
+    """将时间参数（本地时间字符串 / datetime / 微秒整数）转为 UTC 微秒时间戳
+
+    end=True 时字符串取其精度内的最后一微秒，如结束时间 "2024-01-01 12:00:00" 包含这一秒内的全部记录。
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, datetime):
+        return int(value.timestamp()) * 1_000_000 + value.microsecond
+    text = str(value).strip()
+    for fmt, precision in TIME_FORMATS:
+        try:
+            dt = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        us = int(dt.timestamp()) * 1_000_000 + dt.microsecond
+        return us + precision - 1 if end else us
+    raise ValueError(f"无法识别的时间：{value}")
+
+
+def format_timestamp(us):
+    """UTC 微秒时间戳 → 本地时间字符串（秒精度）"""
+    return datetime.fromtimestamp(us // 1_000_000).strftime(DISPLAY_TIME_FORMAT)
+
+
+def to_local_datetime64(us):
+    """UTC 微秒时间戳数组 → 本地时间 datetime64[us] 数组，供图表使用"""
+    us = np.asarray(us, dtype=np.int64)
+    if not time.daylight or us.size == 0:
+        return (us + LOCAL_UTC_OFFSET_US).astype('datetime64[us]')
+    # 有夏令时的时区按小时查一次偏移
+    hours = us // 3_600_000_000
+    unique_hours, inverse = np.unique(hours, return_inverse=True)
+    offsets = np.array([time.localtime(h * 3600).tm_gmtoff for h in unique_hours.tolist()], dtype=np.int64)
+    return (us + offsets[inverse] * 1_000_000).astype('datetime64[us]')
+
+
+def rollup_bucket(us, width):
+    """微秒时间戳所在汇总桶的起始时间"""
+    step = width * 1_000_000
+    return (us + LOCAL_UTC_OFFSET_US) // step * step - LOCAL_UTC_OFFSET_US
+
+
+def rollup_bucket_sql(ts, width):
+    """rollup_bucket 的 SQL 表达式（时间戳为正数，整数除法即向下取整）"""
+    step = width * 1_000_000
+    return f"(({ts} + {LOCAL_UTC_OFFSET_US}) / {step} * {step} - {LOCAL_UTC_OFFSET_US})"
+
+# 运行指标：默认关闭，可在诊断窗口随时开启；开启期间定期写出 Prometheus 文本格式文件供本地采集
+METRICS_ENABLED = False
+METRICS_FILE = 'calc_metrics.prom'
+METRICS_INTERVAL_MS = 15000
+# 延迟直方图各桶上限（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """计数器与延迟直方图，可跨线程记录；关闭时每次记录只多一次布尔判断"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}    # (名称, 标签) -> 累计值
+        self._histograms = {}  # (名称, 标签) -> [各桶计数..., 超出最大桶的计数, 总耗时, 最大耗时]
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0.0]
+            hist[index] += 1
+            hist[-2] += seconds
+            hist[-1] = max(hist[-1], seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def timed(self, name, **labels):
+        """装饰器：记录每次调用的耗时，抛出异常时另计 calc_errors_total"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                t0 = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    self.inc("calc_errors_total", **labels)
+                    raise
+                finally:
+                    self.observe(name, time.perf_counter() - t0, **labels)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
 
-# 配置中文字体
-plt.rcParams['font.sans-serif'] = ['Microsoft YaHei', 'SimHei', 'KaiTi', 'FangSong']
-plt.rcParams['axes.unicode_minus'] = False
+    def snapshot(self):
+        """诊断窗口用的摘要：[(名称, 标签, 次数, 平均毫秒, P95 毫秒, 最大毫秒)]，计数器的耗时列为 None"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(hist)) for key, hist in self._histograms.items())
+        rows = []
+        for (name, labels), hist in histograms:
+            counts = hist[:-2]
+            total = sum(counts)
+            # P95 取累计计数达到 95% 的桶上限，落在最大桶之外时取最大值
+            index = int(np.searchsorted(np.cumsum(counts), 0.95 * total))
+            p95 = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else hist[-1]
+            rows.append((name, self._format_labels(labels), total, hist[-2] / total * 1000,
+                         min(p95, hist[-1]) * 1000, hist[-1] * 1000))
+        for (name, labels), value in counters:
+            rows.append((name, self._format_labels(labels), value, None, None, None))
+        return rows
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ""
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in items)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+    def to_prometheus(self):
+        """Prometheus 文本格式（histogram 的桶为累计计数）"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(hist)) for key, hist in self._histograms.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+        for (name, labels), hist in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), hist[:-2]):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {hist[-2]:.6f}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        """先写临时文件再替换，采集程序不会读到写了一半的文件"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+METRICS = Metrics(METRICS_ENABLED)
+
+# 参数存储类型：浮点向量 / 具名浮点参数（如 alpha、beta）/ 其他（JSON 文本）
+PARAM_VECTOR = 0
+PARAM_NAMED = 1
+PARAM_JSON = 2
+
+
+def encode_params(params):
+    """将参数编码为 (类型, 二进制, 参数名)，数值以小端 float64 连续存放"""
+    if isinstance(params, dict):
+        values = list(params.values())
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values) \
+                and all(isinstance(k, str) and "," not in k for k in params):
+            return PARAM_NAMED, np.asarray(values, dtype='<f8').tobytes(), ",".join(params)
+        return PARAM_JSON, json.dumps(params).encode('utf-8'), None
+    try:
+        return PARAM_VECTOR, np.asarray(params, dtype='<f8').ravel().tobytes(), None
+    except (TypeError, ValueError):
+        return PARAM_JSON, json.dumps(params).encode('utf-8'), None
+
+
+def param_index_values(kind, blob, keys):
+    """参数值索引的 [(参数名, 值)]：向量取前 PARAM_INDEX_LIMIT 个，JSON 参数不索引"""
+    if blob is None or kind not in (PARAM_VECTOR, PARAM_NAMED):
+        return []
+    values = np.frombuffer(blob, dtype='<f8', count=min(len(blob) // 8, PARAM_INDEX_LIMIT)).tolist()
+    if kind == PARAM_NAMED:
+        return list(zip(keys.split(","), values))
+    return [(str(i), value) for i, value in enumerate(values, 1)]
+
+
+def param_filter_name(name):
+    """规范化筛选用的参数名，超出索引范围的向量序号报错"""
+    name = str(name).strip()
+    if not name:
+        raise ValueError("参数名为空")
+    if name.isdigit() and not 1 <= int(name) <= PARAM_INDEX_LIMIT:
+        raise ValueError(f"只能按第 1～{PARAM_INDEX_LIMIT} 个向量参数筛选")
+    return name
+
+
+def param_digest(page_name, params, version=None):
+    """结果缓存键：(页面, 内核版本, 规范化参数) 的 SHA-256 前 16 字节，具名参数按名称排序
+
+    version 默认取 KERNEL_VERSIONS，公式页面传入公式指纹。
+    """
+    if isinstance(params, dict):
+        params = dict(sorted(params.items()))
+    if version is None:
+        version = KERNEL_VERSIONS.get(page_name, 0)
+    kind, blob, keys = encode_params(params)
+    header = f"{page_name}\0{version}\0{kind}\0{keys or ''}\0".encode('utf-8')
+    return hashlib.sha256(header + blob).digest()[:16]
+
+
+def decode_params(kind, blob, keys, legacy_json=None):
+    """解码单条记录的参数：向量返回 list，具名参数返回 dict"""
+    if blob is None:
+        # 尚未迁移的旧记录
+        return json.loads(legacy_json)
+    if kind == PARAM_JSON:
+        return json.loads(blob)
+    values = np.frombuffer(blob, dtype='<f8').tolist()
+    if kind == PARAM_NAMED:
+        return dict(zip(keys.split(","), values))
+    return values
+
+
+def decode_param_matrix(blobs):
+    """将一批等长参数二进制一次性解码为 (N, k) 数组，不逐行解析"""
+    if not blobs:
+        return np.empty((0, 0))
+    width = len(blobs[0]) // 8
+    data = np.frombuffer(b"".join(blobs), dtype='<f8')
+    if data.size != width * len(blobs):
+        raise ValueError("参数长度不一致，无法组成矩阵")
+    return data.reshape(len(blobs), width)
+
+
+class ArchiveStore:
+    """归档分区文件：目录为 date=YYYY-MM-DD/part-<首条记录 id>.parquet，分区索引由 DataManager 存在数据库中
+
+    读取过的分区在内存中保留 ARCHIVE_CACHE_PARTITIONS 个，翻页和重复筛选不必重新解压。
+    """
+
+    COLUMNS = ('id', 'timestamp', 'page', 'result', 'param_kind', 'param_blob', 'param_keys', 'param_hash')
+
+    def __init__(self, directory=ARCHIVE_DIR, capacity=ARCHIVE_CACHE_PARTITIONS):
+        self.directory = directory
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def write(self, day, rows):
+        """将同一天的记录写为一个分区文件并落盘，返回相对路径"""
+        pa, pq = load_pyarrow()
+        date = datetime.fromtimestamp(day // 1_000_000).strftime("%Y-%m-%d")
+        path = f"date={date}/part-{rows[0][0]:012d}.parquet"
+        full_path = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        columns = list(zip(*rows))
+        table = pa.table({
+            'id': pa.array(columns[0], pa.int64()),
+            'timestamp': pa.array(columns[1], pa.int64()),
+            'page': pa.array(columns[2], pa.string()).dictionary_encode(),
+            'result': pa.array(columns[3], pa.float64()),
+            'param_kind': pa.array(columns[4], pa.int8()),
+            'param_blob': pa.array(columns[5], pa.binary()),
+            'param_keys': pa.array(columns[6], pa.string()),
+            'param_hash': pa.array(columns[7], pa.binary()),
+        })
+        tmp_path = full_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pq.write_table(table, f, compression=ARCHIVE_COMPRESSION)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, full_path)
+        return path
+
+    def remove(self, path):
+        try:
+            os.remove(os.path.join(self.directory, path))
+        except FileNotFoundError:
+            pass
+
+    def read(self, path):
+        """读取分区，返回 {列名: 数组或列表}"""
+        with self._lock:
+            columns = self._cache.get(path)
+            if columns is not None:
+                self._cache.move_to_end(path)
+                return columns
+        _, pq = load_pyarrow()
+        table = pq.read_table(os.path.join(self.directory, path), columns=list(self.COLUMNS))
+        columns = {
+            'id': table['id'].to_numpy(),
+            'timestamp': table['timestamp'].to_numpy(),
+            'page': np.array(table['page'].cast('string').to_pylist(), dtype=object),
+            'result': table['result'].to_numpy(),
+            'param_kind': table['param_kind'].to_pylist(),
+            'param_blob': table['param_blob'].to_pylist(),
+            'param_keys': table['param_keys'].to_pylist(),
+        }
+        with self._lock:
+            self._cache[path] = columns
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+        return columns
+
+
+class _ReaderLease:
+    """线程持有的读连接，存于线程局部存储；线程结束时随之释放，连接归还连接池"""
+    __slots__ = ('conn', '__weakref__')
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class ConnectionPool:
+    """SQLite 连接池：一个专用写连接（跨线程加锁串行），以及至多 size 个按线程分配的只读连接
+
+    使用 WAL 日志时读连接在写事务进行中照常读取；其他进程（多个站点、后台任务）持有锁时
+    等待至多 busy_timeout_ms 而不是立即报 database is locked。WAL 要求各进程在同一台机器上。
+    """
+
+    SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+    def __init__(self, db_path, size=DB_READ_POOL_SIZE, busy_timeout_ms=DB_BUSY_TIMEOUT_MS):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._write_lock = threading.RLock()
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._leased = {}  # 线程 id -> 读连接，用于中断
+        self._idle = []
+        self._opened = 0
+        self._closed = False
+        self.writer = self._connect()
+        # 新库使用增量回收（须在切换 WAL 前设置，对已有数据的库无效），归档删除记录后可分步归还空间
+        self.writer.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        mode = self.writer.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}").fetchone()[0]
+        if mode.upper() != DB_JOURNAL_MODE.upper():
+            print(f"WARN: 数据库未能切换到 {DB_JOURNAL_MODE} 日志模式，当前为 {mode}")
+
+    def _connect(self, readonly=False):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.execute(f"PRAGMA cache_size = {-DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA temp_store = {DB_TEMP_STORE}")
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def set_synchronous(self, level):
+        level = level.upper()
+        if level not in self.SYNCHRONOUS_LEVELS:
+            raise ValueError(f"不支持的持久化级别：{level}")
+        with self._write_lock:
+            self.writer.execute(f"PRAGMA synchronous = {level}")
+
+    @contextmanager
+    def write(self):
+        """写事务：持有写锁，with 结束时提交，异常时回滚"""
+        with self._write_lock, self.writer:
+            yield self.writer
+
+    def reader(self):
+        """当前线程的只读连接：首次调用时分配，线程结束后归还；全部占用时等待至多 busy_timeout_ms"""
+        lease = getattr(self._local, "lease", None)
+        if lease is not None:
+            return lease.conn
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._closed or self._idle or self._opened < self.size,
+                                       self.busy_timeout_ms / 1000):
+                raise sqlite3.OperationalError(f"读连接已全部占用（共 {self.size} 个）")
+            if self._closed:
+                raise sqlite3.ProgrammingError("连接池已关闭")
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                conn = self._connect(readonly=True)
+                self._opened += 1
+            self._leased[threading.get_ident()] = conn
+        self._local.lease = lease = _ReaderLease(conn)
+        weakref.finalize(lease, self._release, conn)
+        return conn
+
+    def _release(self, conn):
+        with self._cond:
+            for ident in [ident for ident, leased in self._leased.items() if leased is conn]:
+                del self._leased[ident]
+            if self._closed:
+                conn.close()
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def interrupt(self, thread_ident):
+        """中断指定线程上正在执行的查询"""
+        conn = self._leased.get(thread_ident)
+        if conn is not None:
+            conn.interrupt()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for conn in self._idle + list(self._leased.values()):
+                conn.close()
+            self._idle.clear()
+            self._leased.clear()
+            self._cond.notify_all()
+        with self._write_lock:
+            self.writer.close()
+
+
+class WriteBehindWriter(threading.Thread):
+    """后台批量写入线程，经连接池的写连接提交"""
+
+    def __init__(self, pool, batch_size, flush_interval_ms, insert_rows):
+        super().__init__(name="write-behind", daemon=True)
+        self.pool = pool
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000
+        self.insert_rows = insert_rows
+        self.error = None
+        self._buffer = []
+        self._inflight = []  # 正在提交的一批
+        self._queued = 0    # 累计入队条数
+        self._written = 0   # 累计已提交条数
+        self._force = False
+        self._stopping = False
+        self._cond = threading.Condition()
+        self.start()
+
+    @property
+    def pending(self):
+        with self._cond:
+            return self._queued - self._written
+
+    def put(self, row):
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("写入线程已停止")
+            self._buffer.append(row)
+            self._queued += 1
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+
+    def latest_row(self, page_name):
+        """缓冲中（含正在提交的一批）该页面最新的一行，没有时返回 None"""
+        with self._cond:
+            for row in itertools.chain(reversed(self._buffer), reversed(self._inflight)):
+                if row[1] == page_name:
+                    return row
+        return None
+
+    def flush(self, timeout=None):
+        """阻塞直到调用前入队的记录全部提交"""
+        with self._cond:
+            target = self._queued
+            self._force = True
+            self._cond.notify_all()
+            done = self._cond.wait_for(lambda: self._written >= target or self.error is not None, timeout)
+            if self._written < target and self.error is not None:
+                raise self.error
+            return done
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self.join(timeout)
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: len(self._buffer) >= self.batch_size or self._force or self._stopping,
+                    self.flush_interval)
+                batch, self._buffer = self._buffer, []
+                self._inflight = batch
+                self._force = False
+                stopping = self._stopping
+
+            if batch:
+                try:
+                    with self.pool.write() as conn:
+                        self.insert_rows(conn, batch)
+                except sqlite3.Error as e:
+                    # 提交失败时放回缓冲区，下个周期重试
+                    print(f"ERROR: 批量写入失败：{e}")
+                    with self._cond:
+                        self._buffer[:0] = batch
+                        self._inflight = []
+                        self.error = e
+                        self._cond.notify_all()
+                    if stopping:
+                        return
+                    threading.Event().wait(self.flush_interval)
+                    continue
+
+            with self._cond:
+                self._written += len(batch)
+                self._inflight = []
+                self.error = None
+                self._cond.notify_all()
+                if stopping and not self._buffer:
+                    return
 
 
 class DataManager:
     """数据库管理类"""
 
-    def __init__(self):
-        self.conn = sqlite3.connect('calc_history.db')
+    def __init__(self, db_path=DB_PATH, write_behind=False, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval_ms=WRITE_BEHIND_INTERVAL_MS, synchronous=WRITE_BEHIND_SYNCHRONOUS,
+                 dedup=PARAM_DEDUP_ENABLED, readers=DB_READ_POOL_SIZE, busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+                 archive_dir=ARCHIVE_DIR):
+        self.db_path = db_path
+        self.dedup = dedup
+        self.pool = ConnectionPool(db_path, readers, busy_timeout_ms)
+        self.archive = ArchiveStore(archive_dir)
+        self._archive_warned = False
+        self.conn = self.pool.writer  # 只在 _write() 内使用
+        self._writer = None
+        self._subscribers = []
+        self._change_seq = None
+        self._data_version = None
         self._create_table()
+        self._create_rollups()
+        self._create_formulas()
+        self._incremental_vacuum = self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        if write_behind:
+            self.pool.set_synchronous(synchronous)
+            self._writer = WriteBehindWriter(self.pool, batch_size, flush_interval_ms, self._insert_rows)
+            atexit.register(self.close)
+
+    @property
+    def write_behind(self):
+        return self._writer is not None
+
+    def _read_conn(self):
+        """当前线程的只读连接，由连接池按线程分配"""
+        return self.pool.reader()
+
+    def _write(self):
+        """写事务（with 语句）：各线程的写入经同一个写连接串行提交"""
+        return self.pool.write()
+
+    def interrupt(self, thread_ident):
+        """中断指定线程上正在执行的查询"""
+        self.pool.interrupt(thread_ident)
+
+    @property
+    def migration_pending(self):
+        """旧版数据库的参数是否仍需迁移，或参数值索引是否仍需补建"""
+        return self._schema_version < SCHEMA_VERSION
 
     def _create_table(self):
-        with self.conn:
+        with self._write():
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'calculations'").fetchone()
+            if not exists:
+                self.conn.execute("""
+                    CREATE TABLE calculations(
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        timestamp INTEGER NOT NULL,
+                        page TEXT NOT NULL,
+                        result REAL NOT NULL,
+                        param_kind INTEGER NOT NULL,
+                        param_blob BLOB NOT NULL,
+                        param_keys TEXT,
+                        param_hash BLOB,
+                        param_ref INTEGER
+                    )""")
+                self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(calculations)")}
+            if "param_blob" not in columns:
+                # 旧版数据库：先加紧凑参数列，旧记录由 migrate_step 分批在线回填
+                for column in ("param_kind INTEGER", "param_blob BLOB", "param_keys TEXT"):
+                    self.conn.execute(f"ALTER TABLE calculations ADD COLUMN {column}")
+            if "param_hash" not in columns:
+                # 结果缓存的参数哈希与去重引用，旧记录保持为空
+                self.conn.execute("ALTER TABLE calculations ADD COLUMN param_hash BLOB")
+                self.conn.execute("ALTER TABLE calculations ADD COLUMN param_ref INTEGER")
+            self._legacy_json = "parameters" in columns
+            self._schema_version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            self._migrate_cursor = 0
+            # 参数值索引表：每条记录每个参数一行，随记录写入，随记录删除
             self.conn.execute("""
-                CREATE TABLE IF NOT EXISTS calculations(
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp DATETIME NOT NULL,
+                CREATE TABLE IF NOT EXISTS param_values(
+                    record_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
                     page TEXT NOT NULL,
-                    result REAL NOT NULL,
-                    parameters TEXT NOT NULL
+                    value REAL,
+                    PRIMARY KEY (record_id, name)
+                ) WITHOUT ROWID""")
+            self.conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_param_values_delete AFTER DELETE ON calculations
+                BEGIN
+                    DELETE FROM param_values WHERE record_id = OLD.id;
+                END""")
+            # 变更日志：记录的每次插入和删除各记一行，本进程和其他进程的界面据此增量更新
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS change_log(
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    op INTEGER NOT NULL,
+                    record_id INTEGER,
+                    page TEXT,
+                    timestamp INTEGER
                 )""")
-            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON calculations(timestamp)")
+            self._create_change_triggers()
+            # 归档分区索引表（每个分区文件中每个页面一行）；须在 _create_rollups 之前创建，
+            # 旧库首次补建汇总表时 rebuild_rollups 会读取它
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS archive_partitions(
+                    path TEXT NOT NULL,
+                    page TEXT NOT NULL,
+                    day INTEGER NOT NULL,
+                    rows INTEGER NOT NULL,
+                    min_timestamp INTEGER NOT NULL,
+                    max_timestamp INTEGER NOT NULL,
+                    PRIMARY KEY (path, page)
+                ) WITHOUT ROWID""")
+
+        # 文本排在整数之后，MAX 借助时间索引即可判断是否还有旧版文本时间戳
+        if exists and self.conn.execute(
+                "SELECT typeof(MAX(timestamp)) FROM calculations").fetchone()[0] == 'text':
+            self._migrate_timestamps()
+
+        with self._write():
+            # 旧的单列索引由下面两个覆盖索引取代
+            self.conn.execute("DROP INDEX IF EXISTS idx_timestamp")
+            self.conn.execute("DROP INDEX IF EXISTS idx_page_timestamp")
+            self._create_indexes()
+            # 删除被引用的记录前，把参数复制回引用它的记录
+            self.conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS trg_param_ref_delete BEFORE DELETE ON calculations
+                WHEN OLD.param_ref IS NULL AND OLD.param_hash IS NOT NULL
+                BEGIN
+                    UPDATE calculations SET param_blob = OLD.param_blob, param_ref = NULL
+                    WHERE param_ref = OLD.id;
+                END""")
+
+    def _create_change_triggers(self):
+        self.conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_change_insert AFTER INSERT ON calculations
+            BEGIN
+                INSERT INTO change_log (op, record_id, page, timestamp)
+                VALUES ({CHANGE_INSERT}, NEW.id, NEW.page, NEW.timestamp);
+            END""")
+        self.conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_change_delete AFTER DELETE ON calculations
+            BEGIN
+                INSERT INTO change_log (op, record_id, page, timestamp)
+                VALUES ({CHANGE_DELETE}, OLD.id, OLD.page, OLD.timestamp);
+            END""")
+
+    def _create_indexes(self):
+        # 按页面取最新记录、按页面分页为 O(log n)；按页面读取时间序列只扫描索引
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_page_time ON calculations(page, timestamp, id, result)")
+        # 不限页面的时间范围查询同样只扫描索引
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_time ON calculations(timestamp, page, result)")
+        # 结果缓存按参数哈希查找；去重引用按被引用记录查找，两者都只索引非空行
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_param_hash ON calculations(param_hash) "
+                          "WHERE param_hash IS NOT NULL")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_param_ref ON calculations(param_ref) "
+                          "WHERE param_ref IS NOT NULL")
+        # 参数值范围筛选：按 (参数名, 值) 定位记录，页面与记录 id 都在索引内
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_param_value ON param_values(name, value, page)")
+        # 按页面的结果范围筛选
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_page_result ON calculations(page, result)")
+
+    def _migrate_timestamps(self):
+        """将旧版文本时间戳（本地时间，秒精度）一次性转换为 UTC 微秒整数"""
+        print("DEBUG: 正在将旧版时间戳转换为微秒整数...")
+        with self._write():
+            # 旧汇总表的桶同为文本时间，删除后由 _create_rollups 按整数时间戳重建
+            for name, _ in ROLLUP_GRANULARITIES:
+                self.conn.execute(f"DROP TRIGGER IF EXISTS trg_rollup_{name}_insert")
+                self.conn.execute(f"DROP TRIGGER IF EXISTS trg_rollup_{name}_delete")
+            self.conn.execute("DROP TABLE IF EXISTS rollups")
+            self.conn.execute("""
+                UPDATE calculations
+                SET timestamp = CAST(strftime('%s', timestamp, 'utc') AS INTEGER) * 1000000
+                WHERE typeof(timestamp) = 'text'""")
+            # 参数仍待迁移时保持原版本号，由 migrate_step 完成后一并更新
+            if self._schema_version >= PARAMS_SCHEMA_VERSION:
+                self.conn.execute(f"PRAGMA user_version = {TIMESTAMP_SCHEMA_VERSION}")
+                self._schema_version = TIMESTAMP_SCHEMA_VERSION
 
-    def save_record(self, page_name, result, params):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with self.conn:
+    def _create_rollups(self):
+        """创建按页面、分钟/小时/天汇总的 rollups 表，由触发器随插入和删除增量维护"""
+        with self._write():
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollups'").fetchone()
+            # 批量导入中途退出时插入触发器已删除，汇总表缺少导入的记录
+            interrupted = exists and not self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_rollup_day_insert'").fetchone()
             self.conn.execute("""
-                INSERT INTO calculations (timestamp, page, result, parameters)
-                VALUES (?, ?, ?, ?)""",
-                              (timestamp, page_name, result, json.dumps(params)))
+                CREATE TABLE IF NOT EXISTS rollups(
+                    granularity TEXT NOT NULL,
+                    page TEXT NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    total REAL NOT NULL,
+                    min_value REAL NOT NULL,
+                    max_value REAL NOT NULL,
+                    last_timestamp INTEGER NOT NULL,
+                    last_id INTEGER NOT NULL,
+                    last_value REAL NOT NULL,
+                    PRIMARY KEY (granularity, page, bucket)
+                ) WITHOUT ROWID""")
+            self._create_rollup_triggers()
+        if (not exists or interrupted) and self.conn.execute("SELECT 1 FROM calculations LIMIT 1").fetchone():
+            # 已有数据的旧库首次启用汇总表时补建一次
+            self.rebuild_rollups()
+
+    def _create_formulas(self):
+        """自定义公式页面表"""
+        with self._write():
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS formulas(
+                    title TEXT PRIMARY KEY,
+                    expression TEXT NOT NULL,
+                    created INTEGER NOT NULL
+                )""")
+
+    def get_formulas(self):
+        """按创建顺序返回 [(页面名称, 公式)]"""
+        return self._read_conn().execute("SELECT title, expression FROM formulas ORDER BY created").fetchall()
+
+    def save_formula(self, title, expression):
+        with self._write():
+            self.conn.execute("INSERT INTO formulas VALUES (?, ?, ?)", (title, expression, now_epoch_us()))
+
+    def delete_formula(self, title):
+        """删除公式页面，已保存的计算记录保留"""
+        with self._write():
+            self.conn.execute("DELETE FROM formulas WHERE title = ?", (title,))
+
+    def _create_rollup_triggers(self):
+        for name, width in ROLLUP_GRANULARITIES:
+            new_bucket = rollup_bucket_sql("NEW.timestamp", width)
+            old_bucket = rollup_bucket_sql("OLD.timestamp", width)
+            in_old_bucket = (f"page = OLD.page AND timestamp >= {old_bucket} "
+                             f"AND timestamp < {old_bucket} + {width * 1_000_000}")
+            key = f"granularity = '{name}' AND page = OLD.page AND bucket = {old_bucket}"
+            self.conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_rollup_{name}_insert AFTER INSERT ON calculations
+                BEGIN
+                    INSERT INTO rollups VALUES ('{name}', NEW.page, {new_bucket}, 1, NEW.result,
+                                                NEW.result, NEW.result, NEW.timestamp, NEW.id, NEW.result)
+                    ON CONFLICT (granularity, page, bucket) DO UPDATE SET
+                        count = count + 1,
+                        total = total + excluded.total,
+                        min_value = min(min_value, excluded.min_value),
+                        max_value = max(max_value, excluded.max_value),
+                        last_value = CASE WHEN (excluded.last_timestamp, excluded.last_id) >= (last_timestamp, last_id)
+                                          THEN excluded.last_value ELSE last_value END,
+                        last_id = CASE WHEN (excluded.last_timestamp, excluded.last_id) >= (last_timestamp, last_id)
+                                       THEN excluded.last_id ELSE last_id END,
+                        last_timestamp = max(last_timestamp, excluded.last_timestamp);
+                END""")
+            # 删除时先扣减计数与总和；只有删除的恰是最小/最大/最后一条时才在该桶内重新统计
+            self.conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_rollup_{name}_delete AFTER DELETE ON calculations
+                BEGIN
+                    UPDATE rollups SET count = count - 1, total = total - OLD.result WHERE {key};
+                    DELETE FROM rollups WHERE {key} AND count <= 0;
+                    UPDATE rollups SET
+                        min_value = (SELECT MIN(result) FROM calculations WHERE {in_old_bucket}),
+                        max_value = (SELECT MAX(result) FROM calculations WHERE {in_old_bucket}),
+                        (last_timestamp, last_id, last_value) = (
+                            SELECT timestamp, id, result FROM calculations WHERE {in_old_bucket}
+                            ORDER BY timestamp DESC, id DESC LIMIT 1)
+                    WHERE {key}
+                      AND (OLD.result <= min_value OR OLD.result >= max_value OR OLD.id = last_id);
+                END""")
+
+    @METRICS.timed("calc_db_seconds", op="rebuild_rollups")
+    def rebuild_rollups(self):
+        """根据原始记录重建全部汇总表，已归档的记录一并计入"""
+        self.flush()
+        source = "calculations"
+        with self._write():
+            if self._load_archive_temp():
+                source = ("(SELECT page, timestamp, id, result FROM calculations "
+                          "UNION ALL SELECT page, timestamp, id, result FROM temp.archived_rows)")
+            self.conn.execute("DELETE FROM rollups")
+            for name, width in ROLLUP_GRANULARITIES:
+                bucket = rollup_bucket_sql("timestamp", width)
+                self.conn.execute(f"""
+                    INSERT INTO rollups
+                    SELECT '{name}', page, bucket, COUNT(*), SUM(result), MIN(result), MAX(result),
+                           MAX(CASE WHEN rn = 1 THEN timestamp END),
+                           MAX(CASE WHEN rn = 1 THEN id END),
+                           MAX(CASE WHEN rn = 1 THEN result END)
+                    FROM (SELECT page, {bucket} AS bucket, timestamp, id, result,
+                                 ROW_NUMBER() OVER (PARTITION BY page, {bucket}
+                                                    ORDER BY timestamp DESC, id DESC) AS rn
+                          FROM {source})
+                    GROUP BY page, bucket""")
+            self.conn.execute("DROP TABLE IF EXISTS temp.archived_rows")
+
+    def _load_archive_temp(self):
+        """写事务内：把全部归档记录的 (页面, 时间, id, 结果) 载入临时表，没有归档时返回 False"""
+        if not self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archive_partitions'").fetchone():
+            return False
+        paths = [row[0] for row in self.conn.execute("SELECT DISTINCT path FROM archive_partitions")]
+        if not paths:
+            return False
+        try:
+            load_pyarrow()
+        except ImportError:
+            raise ImportError("已有归档分区，重建汇总表需要安装 pyarrow") from None
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS archived_rows(page, timestamp, id, result)")
+        self.conn.execute("DELETE FROM temp.archived_rows")
+        for path in paths:
+            columns = self.archive.read(path)
+            self.conn.executemany("INSERT INTO temp.archived_rows VALUES (?, ?, ?, ?)", zip(
+                columns['page'].tolist(), columns['timestamp'].tolist(), columns['id'].tolist(),
+                columns['result'].tolist()))
+        return True
+
+    @METRICS.timed("calc_db_seconds", op="archive_step")
+    def archive_step(self, retention_days=ARCHIVE_RETENTION_DAYS, batch_rows=ARCHIVE_BATCH_ROWS):
+        """将一批早于保留天数（按本地零点）的记录移入 Parquet 分区，返回移动的条数，0 表示已无可归档记录
+
+        先写入分区文件并落盘，再在一个写事务中登记分区并删除原记录，中途失败既不丢失也不重复。
+        归档记录继续计入汇总表：删除期间暂停汇总表的删除触发器。
+        """
+        if self._schema_version < PARAMS_SCHEMA_VERSION:
+            raise RuntimeError("参数存储迁移完成后才能归档")
+        load_pyarrow()
+        self.flush()
+        cutoff = rollup_bucket(now_epoch_us(), 86400) - retention_days * 86400 * 1_000_000
+        rows = self._read_conn().execute(
+            f"SELECT id, timestamp, page, result, param_kind, {PARAM_BLOB_SQL}, param_keys, param_hash "
+            "FROM calculations WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?", (cutoff, batch_rows)).fetchall()
+        if not rows:
+            return 0
+
+        days = {}
+        for row in rows:
+            days.setdefault(rollup_bucket(row[1], 86400), []).append(row)
+        written = []
+        try:
+            partitions = []
+            for day, day_rows in days.items():
+                path = self.archive.write(day, day_rows)
+                written.append(path)
+                pages = {}
+                for row in day_rows:
+                    pages.setdefault(row[2], []).append(row[1])
+                partitions.extend((path, page, day, len(ts), min(ts), max(ts)) for page, ts in pages.items())
 
-    def get_records(self, start_time=None, end_time=None, page_filter=None, limit=None):
-        query = "SELECT id, timestamp, page, result, parameters FROM calculations"
+            with self._write():
+                # 归档的记录仍可查询，不计入汇总表的删除，也不作为删除事件通知界面
+                for name, _ in ROLLUP_GRANULARITIES:
+                    self.conn.execute(f"DROP TRIGGER IF EXISTS trg_rollup_{name}_delete")
+                self.conn.execute("DROP TRIGGER IF EXISTS trg_change_delete")
+                self.conn.executemany("INSERT INTO archive_partitions VALUES (?, ?, ?, ?, ?, ?)", partitions)
+                self.conn.executemany("DELETE FROM calculations WHERE id = ?", ((row[0],) for row in rows))
+                self._create_rollup_triggers()
+                self._create_change_triggers()
+        except BaseException:
+            for path in written:
+                self.archive.remove(path)
+            raise
+        METRICS.inc("calc_records_archived_total", len(rows))
+        return len(rows)
+
+    def archive_old_records(self, retention_days=ARCHIVE_RETENTION_DAYS, batch_rows=ARCHIVE_BATCH_ROWS):
+        """归档全部早于保留天数的记录，返回归档条数
+
+        释放的空间由 vacuum_step 分步回收；旧库须先由用户确认执行一次 enable_incremental_vacuum。
+        """
+        total = 0
+        while moved := self.archive_step(retention_days, batch_rows):
+            total += moved
+        return total
+
+    @property
+    def incremental_vacuum(self):
+        """数据库是否为增量回收模式（新库默认；旧库执行 enable_incremental_vacuum 之后）
+
+        启动时由写连接读取并在切换后更新：读连接不在事务中时 PRAGMA auto_vacuum 返回的是缓存的旧值。
+        """
+        return self._incremental_vacuum
+
+    @METRICS.timed("calc_db_seconds", op="enable_incremental_vacuum")
+    def enable_incremental_vacuum(self):
+        """一次性维护：将旧库切换为增量回收模式，之后归档释放的空间由 vacuum_step 分步回收
+
+        需要一次完整 VACUUM 重写整个数据库文件，期间持有写锁，所有保存都会等待，只应在用户确认后执行。
+        """
+        self.flush()
+        with self.pool.write() as conn:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            self._incremental_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    @METRICS.timed("calc_db_seconds", op="vacuum_step")
+    def vacuum_step(self, pages=VACUUM_STEP_PAGES):
+        """增量回收至多 pages 个空闲页，返回剩余空闲页数；全部回收后截断 WAL 文件"""
+        with self._write():
+            if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return 0
+            self.conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            remaining = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not remaining:
+            with self.pool.write() as conn:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return remaining
+
+    def _archived_rows(self, start_us=None, end_us=None, page_filter=None, after=None, where=None):
+        """读取归档中符合条件的记录，行格式与热表查询相同，按 (timestamp, id) 倒序
+
+        先按分区索引裁剪出时间范围和页面相符的分区，再在分区内筛选；where 为逐条记录的附加条件。
+        未安装 pyarrow 时只提示一次并跳过归档。
+        """
         conditions = []
         params = []
+        if start_us is not None:
+            conditions.append("max_timestamp >= ?")
+            params.append(start_us)
+        if end_us is not None:
+            conditions.append("min_timestamp <= ?")
+            params.append(end_us)
+        if after is not None:
+            conditions.append("min_timestamp <= ?")
+            params.append(after[0])
+        if page_filter:
+            conditions.append("page = ?")
+            params.append(page_filter)
+        query = "SELECT DISTINCT path FROM archive_partitions"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        paths = [row[0] for row in self._read_conn().execute(query, params)]
+        if not paths:
+            return []
+        try:
+            load_pyarrow()
+        except ImportError:
+            if not self._archive_warned:
+                print("WARN: 未安装 pyarrow，查询结果不包含已归档的记录")
+                self._archive_warned = True
+            return []
+
+        extra = (None,) if self._legacy_json else ()
+        rows = []
+        for path in paths:
+            columns = self.archive.read(path)
+            ids, timestamps = columns['id'], columns['timestamp']
+            mask = np.ones(len(ids), dtype=bool)
+            if start_us is not None:
+                mask &= timestamps >= start_us
+            if end_us is not None:
+                mask &= timestamps <= end_us
+            if after is not None:
+                mask &= (timestamps < after[0]) | ((timestamps == after[0]) & (ids < after[1]))
+            if page_filter:
+                mask &= columns['page'] == page_filter
+            for i in np.flatnonzero(mask).tolist():
+                rows.append((int(ids[i]), int(timestamps[i]), columns['page'][i], float(columns['result'][i]),
+                             columns['param_kind'][i], columns['param_blob'][i], columns['param_keys'][i]) + extra)
+        if where is not None:
+            rows = [row for row in rows if where(row)]
+        rows.sort(key=lambda r: (r[1], r[0]), reverse=True)
+        return rows
+
+    def _with_archive(self, rows, limit=None, start_us=None, end_us=None, page_filter=None, after=None,
+                      where=None):
+        """将归档记录并入按时间倒序的热表查询结果
+
+        热表已取满 limit 条时，只有比其中最后一条更新的归档记录才可能进入结果，据此裁剪分区。
+        """
+        if limit is not None and len(rows) >= limit:
+            start_us = rows[-1][1] if start_us is None else max(start_us, rows[-1][1])
+        archived = self._archived_rows(start_us, end_us, page_filter, after, where)
+        if not archived:
+            return rows
+        merged = sorted(rows + archived, key=lambda r: (r[1], r[0]), reverse=True)
+        return merged[:limit] if limit is not None else merged
+
+    def choose_rollup(self, start_time, end_time, points):
+        """为时间范围和期望点数选出最粗且分辨率足够的汇总粒度，原始记录更合适时返回 None"""
+        start_us, end_us = to_epoch_us(start_time), to_epoch_us(end_time, end=True)
+        if start_us is None or end_us is None:
+            low, high = self.get_time_bounds()
+            start_us = low if start_us is None else start_us
+            end_us = high if end_us is None else end_us
+        if start_us is None or end_us is None:
+            return None
+        span = (end_us - start_us) / 1_000_000
+        resolution = span / max(points, 1)
+        for name, width in ROLLUP_GRANULARITIES:
+            if width <= resolution:
+                return name
+        return None
+
+    @METRICS.timed("calc_db_seconds", op="get_rollups")
+    def get_rollups(self, granularity, start_time=None, end_time=None, page_filter=None):
+        """读取汇总行 (page, bucket, count, total, min, max, last_value)，按页面和时间排序
+
+        边界桶只要与时间范围相交即返回。
+        """
+        width = dict(ROLLUP_GRANULARITIES)[granularity]
+        self.flush()
+        query = ("SELECT page, bucket, count, total, min_value, max_value, last_value "
+                 "FROM rollups WHERE granularity = ?")
+        params = [granularity]
+        start_us, end_us = to_epoch_us(start_time), to_epoch_us(end_time, end=True)
+        if start_us is not None:
+            query += " AND bucket >= ?"
+            params.append(rollup_bucket(start_us, width))
+        if end_us is not None:
+            query += " AND bucket <= ?"
+            params.append(end_us)
+        if page_filter:
+            query += " AND page = ?"
+            params.append(page_filter)
+        return self._read_conn().execute(query + " ORDER BY page, bucket", params).fetchall()
+
+    def get_rollup_series(self, granularity, start_time=None, end_time=None):
+        """按页面返回汇总序列 [(页面, 桶时间, 均值, 最小值, 最大值)]"""
+        rows = self.get_rollups(granularity, start_time, end_time)
+        if not rows:
+            return []
+        pages, buckets, counts, totals, mins, maxs, _ = zip(*rows)
+        means = np.array(totals, dtype=float) / np.array(counts, dtype=float)
+        return split_by_page(pages, to_local_datetime64(buckets), means,
+                             np.array(mins, dtype=float), np.array(maxs, dtype=float))
+
+    def _encode_row(self, timestamp, page_name, result, params, param_hash=None):
+        kind, blob, keys = encode_params(params)
+        legacy_json = None
+        if self._legacy_json:
+            legacy_json = json.dumps(params.tolist() if isinstance(params, np.ndarray) else params)
+        return timestamp, page_name, float(result), kind, blob, keys, param_hash, legacy_json
+
+    @METRICS.timed("calc_db_seconds", op="insert")
+    def _insert_rows(self, conn, rows, share_params=True):
+        # share_params=False：没有参数哈希的行（如批量导入）无从引用，直接插入
+        METRICS.inc("calc_records_written_total", len(rows))
+        if self._legacy_json:
+            conn.executemany(INSERT_LEGACY_SQL, rows)
+        else:
+            conn.executemany(INSERT_DEDUP_SQL if self.dedup and share_params else INSERT_SQL,
+                             (row[:7] for row in rows))
+        if not rows:
+            return
+        # 同一写连接上自增 id 连续分配，由最后一条的 id 倒推本批各条的 id
+        first_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0] - len(rows) + 1
+        conn.executemany("INSERT INTO param_values VALUES (?, ?, ?, ?)",
+                         [(first_id + i, name, row[1], value) for i, row in enumerate(rows)
+                          for name, value in param_index_values(row[3], row[4], row[5])])
+        self._prune_change_log(conn)
+
+    @staticmethod
+    def _prune_change_log(conn):
+        """写事务内：变更日志达到保留条数的两倍时删除较旧的一半；落后更多的订阅者会整体重新加载
+
+        只在写入方执行，轮询变更的界面线程不争用写锁。MIN/MAX(seq) 都是主键端点查找。
+        """
+        low, high = conn.execute(
+            "SELECT (SELECT MIN(seq) FROM change_log), (SELECT MAX(seq) FROM change_log)").fetchone()
+        if high is not None and high - low >= 2 * CHANGE_LOG_KEEP:
+            conn.execute("DELETE FROM change_log WHERE seq <= ?", (high - CHANGE_LOG_KEEP,))
 
-        if start_time:
+    def _param_columns(self):
+        return f"param_kind, {PARAM_BLOB_SQL}, param_keys" + (", parameters" if self._legacy_json else "")
+
+    @METRICS.timed("calc_db_seconds", op="save_record")
+    def save_record(self, page_name, result, params, param_hash=None):
+        """保存一条计算结果，param_hash 为结果缓存键（param_digest），用于之后的缓存查找和参数去重"""
+        timestamp = now_epoch_us()
+        row = self._encode_row(timestamp, page_name, result, params, param_hash)
+        if self._writer:
+            self._writer.put(row)
+            return
+        with self._write():
+            self._insert_rows(self.conn, [row])
+
+    @METRICS.timed("calc_db_seconds", op="save_records")
+    def save_records(self, page_name, results, params_list):
+        """批量保存同一页面的计算结果，单个事务内 executemany 写入"""
+        timestamp = now_epoch_us()
+        rows = [self._encode_row(timestamp, page_name, result, params)
+                for result, params in zip(results, params_list)]
+        # 先提交写回缓冲，保证批量记录排在之前的单条记录之后
+        self.flush()
+        with self._write():
+            self._insert_rows(self.conn, rows)
+
+    @METRICS.timed("calc_db_seconds", op="save_batch")
+    def save_batch(self, entries):
+        """在单个事务内保存不同页面的记录，entries 为 [(页面, 结果, 参数, 参数哈希)]，供服务端合并写入"""
+        timestamp = now_epoch_us()
+        rows = [self._encode_row(timestamp, page_name, result, params, param_hash)
+                for page_name, result, params, param_hash in entries]
+        self.flush()
+        with self._write():
+            self._insert_rows(self.conn, rows)
+
+    # 批量导入期间删除、结束后重建的索引；去重导入时保留 idx_page_time 用于查找重复记录
+    BULK_DEFERRED_INDEXES = ('idx_time', 'idx_param_hash', 'idx_param_ref', 'idx_param_value', 'idx_page_result')
+    # 去重时结果按相对误差比较：Excel 往返可能改变浮点数的最后一位
+    DEDUP_RESULT_TOLERANCE = 1e-12
+
+    @contextmanager
+    def bulk_import(self, dedup=False):
+        """批量导入（with 语句）：暂停汇总插入触发器并删除次要索引，结束后重建索引和汇总表
+
+        产出 insert(rows)，rows 为 [(时间戳, 页面, 结果, 参数, 时间戳精度)]，每次调用一个事务，返回写入的条数。
+        dedup=True 时跳过与已有记录（含归档和本次已导入的记录）页面、参数相同、结果在容差内且时间戳落在该行精度内的行。
+        """
+        self.flush()
+        deferred = self.BULK_DEFERRED_INDEXES + (() if dedup else ('idx_page_time',))
+        with self._write():
+            for name, _ in ROLLUP_GRANULARITIES:
+                self.conn.execute(f"DROP TRIGGER IF EXISTS trg_rollup_{name}_insert")
+            # 不逐条记录变更，结束时记一条整体变化
+            self.conn.execute("DROP TRIGGER IF EXISTS trg_change_insert")
+            for index in deferred:
+                self.conn.execute(f"DROP INDEX IF EXISTS {index}")
+
+        def insert(rows):
+            with self._write():
+                if dedup:
+                    rows = self._new_rows(rows)
+                self._insert_rows(self.conn, [self._encode_row(timestamp, page_name, result, params)
+                                              for timestamp, page_name, result, params, _ in rows],
+                                  share_params=False)
+            return len(rows)
+
+        try:
+            yield insert
+        finally:
+            with self._write():
+                self._create_indexes()
+                self._create_rollup_triggers()
+                self._create_change_triggers()
+                self.conn.execute("INSERT INTO change_log (op) VALUES (?)", (CHANGE_RESET,))
+            self.rebuild_rollups()
+
+    def _new_rows(self, rows):
+        """写事务内：去掉与已有记录或同批前面的行重复的导入行"""
+        if not rows:
+            return rows
+        keys = [(page_name, timestamp, timestamp + precision - 1, result, encode_params(params)[1])
+                for timestamp, page_name, result, params, precision in rows]
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS import_keys(idx INTEGER PRIMARY KEY, page, low, high, "
+                          "result, blob)")
+        self.conn.execute("DELETE FROM temp.import_keys")
+        self.conn.executemany("INSERT INTO temp.import_keys VALUES (?, ?, ?, ?, ?, ?)",
+                              ((i,) + key for i, key in enumerate(keys)))
+        # 每行按 idx_page_time 定位到 (页面, 时间范围)，再比较结果和参数
+        tolerance = self.DEDUP_RESULT_TOLERANCE
+        existing = {i for i, in self.conn.execute(f"""
+            SELECT idx FROM temp.import_keys AS k WHERE EXISTS (
+                SELECT 1 FROM calculations
+                WHERE page = k.page AND timestamp BETWEEN k.low AND k.high
+                  AND abs(result - k.result) <= {tolerance} * abs(k.result) AND {PARAM_BLOB_SQL} = k.blob)""")}
+        self.conn.execute("DELETE FROM temp.import_keys")
+
+        archived = {}
+        for record in self._archived_rows(min(key[1] for key in keys), max(key[2] for key in keys)):
+            archived.setdefault((record[2], bytes(record[5])), []).append((record[1], record[3]))
+        seen = set()
+        fresh = []
+        for i, (row, key) in enumerate(zip(rows, keys)):
+            page_name, low, high, result, blob = key
+            if i in existing or key in seen or any(
+                    low <= t <= high and abs(value - result) <= tolerance * abs(result)
+                    for t, value in archived.get((page_name, blob), ())):
+                continue
+            seen.add(key)
+            fresh.append(row)
+        return fresh
+
+    @METRICS.timed("calc_db_seconds", op="migrate_step")
+    def migrate_step(self, batch_size=2000):
+        """将一批旧记录的 JSON 参数回填为紧凑格式，返回是否仍有待迁移记录
+
+        全部回填后删除旧的 parameters 列，再逐批补建旧记录的参数值索引，各阶段完成时更新结构版本。
+        每批一个短事务，可在程序运行中逐步执行。
+        """
+        if not self.migration_pending:
+            return False
+        self.flush()
+        if self._schema_version >= PARAMS_SCHEMA_VERSION:
+            return self._index_params_step(batch_size)
+        rows = self._read_conn().execute(
+            "SELECT id, parameters FROM calculations WHERE id > ? AND param_blob IS NULL ORDER BY id LIMIT ?",
+            (self._migrate_cursor, batch_size)).fetchall()
+
+        updates = []
+        for record_id, param_json in rows:
+            try:
+                kind, blob, keys = encode_params(json.loads(param_json))
+            except json.JSONDecodeError:
+                kind, blob, keys = PARAM_JSON, param_json.encode('utf-8'), None
+            updates.append((kind, blob, keys, record_id))
+        with self._write():
+            self.conn.executemany(
+                "UPDATE calculations SET param_kind = ?, param_blob = ?, param_keys = ? WHERE id = ?", updates)
+        if rows:
+            self._migrate_cursor = rows[-1][0]
+        if len(rows) == batch_size:
+            return True
+
+        with self._write():
+            if sqlite3.sqlite_version_info >= (3, 35, 0):
+                self.conn.execute("ALTER TABLE calculations DROP COLUMN parameters")
+                self._legacy_json = False
+            # 更旧的 SQLite 不支持 DROP COLUMN：保留该列继续双写，读取只使用紧凑参数
+            self.conn.execute(f"PRAGMA user_version = {TIMESTAMP_SCHEMA_VERSION}")
+        self._schema_version = TIMESTAMP_SCHEMA_VERSION
+        self._migrate_cursor = 0
+        return True
+
+    def _index_params_step(self, batch_size):
+        """为一批旧记录补建参数值索引，已有索引行的记录（迁移期间新写入的）保持不变"""
+        rows = self._read_conn().execute(
+            f"SELECT id, page, param_kind, {PARAM_BLOB_SQL}, param_keys FROM calculations "
+            "WHERE id > ? ORDER BY id LIMIT ?", (self._migrate_cursor, batch_size)).fetchall()
+        with self._write():
+            self.conn.executemany("INSERT OR IGNORE INTO param_values VALUES (?, ?, ?, ?)",
+                                  [(record_id, name, page_name, value)
+                                   for record_id, page_name, kind, blob, keys in rows
+                                   for name, value in param_index_values(kind, blob, keys)])
+            if len(rows) < batch_size:
+                self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        if len(rows) == batch_size:
+            self._migrate_cursor = rows[-1][0]
+            return True
+        self._schema_version = SCHEMA_VERSION
+        return False
+
+    def migrate(self, batch_size=2000):
+        """一次性完成全部迁移"""
+        while self.migrate_step(batch_size):
+            pass
+
+    def flush(self, timeout=None):
+        """将写回缓冲中的记录立即提交"""
+        if self._writer:
+            # 只统计写回模式下真正等待后台提交的耗时
+            with METRICS.timer("calc_db_seconds", op="flush"):
+                return self._writer.flush(timeout)
+        return True
+
+    def close(self):
+        """提交缓冲记录并关闭数据库"""
+        if self._writer:
+            self._writer.stop()
+            self._writer = None
+        self.pool.close()
+
+    @staticmethod
+    def _time_conditions(start_time, end_time):
+        """时间范围条件：参数统一转换为微秒整数，结束时间包含其精度内的全部记录"""
+        conditions = []
+        params = []
+        start_us, end_us = to_epoch_us(start_time), to_epoch_us(end_time, end=True)
+        if start_us is not None:
             conditions.append("timestamp >= ?")
-            params.append(start_time)
-        if end_time:
+            params.append(start_us)
+        if end_us is not None:
             conditions.append("timestamp <= ?")
-            params.append(end_time)
+            params.append(end_us)
+        return conditions, params
+
+    def _filter_conditions(self, page_filter=None, param_filters=None, result_range=None):
+        """页面、参数值范围与结果范围条件
+
+        param_filters 为 {参数名: (下限, 上限)}，向量参数名为 1 起的序号，上下限为 None 表示不限。
+        先在 param_values 的 (参数名, 值) 索引上试探各参数条件的匹配数：有条件足够少时由它找出记录 id 再排序，
+        并屏蔽页面时间索引避免按页面整体扫描；否则按时间顺序扫描，每条记录按主键检查参数值，取满即停。
+        """
+        conditions = []
+        params = []
+        probes = []
+        for name, (low, high) in (param_filters or {}).items():
+            where = ["name = ?"]
+            values = [param_filter_name(name)]
+            if page_filter:
+                where.append("page = ?")
+                values.append(page_filter)
+            if low is not None:
+                where.append("value >= ?")
+                values.append(low)
+            if high is not None:
+                where.append("value <= ?")
+                values.append(high)
+            count = self._read_conn().execute(
+                f"SELECT COUNT(*) FROM (SELECT 1 FROM param_values WHERE {' AND '.join(where)} LIMIT ?)",
+                values + [PARAM_FILTER_SELECTIVE_ROWS]).fetchone()[0]
+            probes.append((count, where, values))
+        probes.sort(key=lambda probe: probe[0])
+
+        driven = bool(probes) and probes[0][0] < PARAM_FILTER_SELECTIVE_ROWS
         if page_filter:
-            conditions.append("page = ?")
+            # 一元 + 使该条件不能使用索引
+            conditions.append("+page = ?" if driven else "page = ?")
             params.append(page_filter)
+        for i, (_, where, values) in enumerate(probes):
+            if i == 0 and driven:
+                conditions.append(f"id IN (SELECT record_id FROM param_values WHERE {' AND '.join(where)})")
+            else:
+                conditions.append(f"EXISTS (SELECT 1 FROM param_values WHERE record_id = calculations.id "
+                                  f"AND {' AND '.join(where)})")
+            params.extend(values)
+        low, high = result_range or (None, None)
+        if low is not None:
+            conditions.append("result >= ?")
+            params.append(low)
+        if high is not None:
+            conditions.append("result <= ?")
+            params.append(high)
+        return conditions, params
+
+    @staticmethod
+    def record_filter(param_filters=None, result_range=None):
+        """与 _filter_conditions 相同的逐条筛选，用于归档记录和变更通知中的新记录；没有条件时返回 None"""
+        if not param_filters and not result_range:
+            return None
+        bounds = [(param_filter_name(name), low, high) for name, (low, high) in (param_filters or {}).items()]
+        result_low, result_high = result_range or (None, None)
+
+        def matches(record):
+            result = record[3]
+            if (result_low is not None and result < result_low) or (result_high is not None and result > result_high):
+                return False
+            if not bounds:
+                return True
+            values = dict(param_index_values(record[4], record[5], record[6]))
+            for name, low, high in bounds:
+                value = values.get(name)
+                if value is None or (low is not None and value < low) or (high is not None and value > high):
+                    return False
+            return True
+        return matches
+
+    @METRICS.timed("calc_db_seconds", op="get_records")
+    def get_records(self, start_time=None, end_time=None, page_filter=None, limit=None,
+                    param_filters=None, result_range=None):
+        """按时间倒序读取记录，时间戳列为 UTC 微秒整数（显示时用 format_timestamp 转换）
+
+        param_filters、result_range 按参数值和结果范围筛选，格式见 _filter_conditions。
+        """
+        self.flush()
+        query = f"SELECT id, timestamp, page, result, {self._param_columns()} FROM calculations"
+        conditions, params = self._time_conditions(start_time, end_time)
+        filters, filter_params = self._filter_conditions(page_filter, param_filters, result_range)
+        conditions += filters
+        params += filter_params
 
         if conditions:
             query += " WHERE " + " AND ".join(conditions)
 
-        query += " ORDER BY timestamp DESC"
+        query += " ORDER BY timestamp DESC, id DESC"
 
         if limit is not None:
             query += " LIMIT ?"
             params.append(limit)
 
-        cursor = self.conn.cursor()
+        cursor = self._read_conn().cursor()
         cursor.execute(query, params)
-        return cursor.fetchall()
+        return self._with_archive(cursor.fetchall(), limit, to_epoch_us(start_time), to_epoch_us(end_time, end=True),
+                                  page_filter, where=self.record_filter(param_filters, result_range))
+
+    @METRICS.timed("calc_db_seconds", op="get_records_page")
+    def get_records_page(self, page_filter=None, after=None, limit=200, param_filters=None, result_range=None):
+        """键集分页查询：按 (timestamp, id) 倒序返回 after 之后的至多 limit 条记录
+
+        after 为上一页最后一条记录的 (timestamp, id)，为 None 时从最新记录开始；筛选条件同 get_records。
+        """
+        self.flush()
+        query = f"SELECT id, timestamp, page, result, {self._param_columns()} FROM calculations"
+        conditions, params = self._filter_conditions(page_filter, param_filters, result_range)
+
+        if after is not None:
+            conditions.append("(timestamp, id) < (?, ?)")
+            params.extend(after)
+
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        params.append(limit)
+
+        cursor = self._read_conn().cursor()
+        cursor.execute(query, params)
+        return self._with_archive(cursor.fetchall(), limit, page_filter=page_filter, after=after,
+                                  where=self.record_filter(param_filters, result_range))
+
+    def param_names(self, page_name):
+        """页面最新一条记录中可用于筛选的参数名"""
+        row = self._read_conn().execute(
+            f"SELECT param_kind, {PARAM_BLOB_SQL}, param_keys FROM calculations WHERE page = ? "
+            "ORDER BY timestamp DESC, id DESC LIMIT 1", (page_name,)).fetchone()
+        return [name for name, _ in param_index_values(*row)] if row else []
+
+    @METRICS.timed("calc_db_seconds", op="count_records")
+    def count_records(self, page_filter=None):
+        """记录总数，含已归档的记录（归档部分取自分区索引）"""
+        self.flush()
+        if page_filter:
+            cursor = self._read_conn().execute(
+                "SELECT (SELECT COUNT(*) FROM calculations WHERE page = ?), "
+                "(SELECT TOTAL(rows) FROM archive_partitions WHERE page = ?)", (page_filter, page_filter))
+        else:
+            cursor = self._read_conn().execute(
+                "SELECT (SELECT COUNT(*) FROM calculations), (SELECT TOTAL(rows) FROM archive_partitions)")
+        hot, archived = cursor.fetchone()
+        return hot + int(archived)
+
+    def iter_records(self, chunk_size=5000, page_filter=None):
+        """按时间倒序逐块读取全部记录，每次产出至多 chunk_size 条，内存占用与表大小无关
+
+        热表记录之后按分区从新到旧产出已归档的记录；page_filter 只读取该页面（热表走 idx_page_time，归档按分区索引裁剪）。
+        """
+        self.flush()
+        where, params = (" WHERE page = ?", (page_filter,)) if page_filter else ("", ())
+        cursor = self._read_conn().cursor()
+        cursor.execute(f"SELECT id, timestamp, page, result, {self._param_columns()} FROM calculations"
+                       f"{where} ORDER BY timestamp DESC, id DESC", params)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+        days = [row[0] for row in self._read_conn().execute(
+            f"SELECT DISTINCT day FROM archive_partitions{where} ORDER BY day DESC", params)]
+        for day in days:
+            rows = self._archived_rows(day, day + 86400 * 1_000_000 - 1, page_filter)
+            for start in range(0, len(rows), chunk_size):
+                yield rows[start:start + chunk_size]
+
+    @METRICS.timed("calc_db_seconds", op="get_param_arrays")
+    def get_param_arrays(self, page_filter, start_time=None, end_time=None, width=None):
+        """按时间顺序读取某页面的 (ids, results, params)，params 为一次性解码的 (N, k) 参数矩阵
+
+        页面中参数个数不一时用 width 只取 k 个参数的记录。
+        """
+        self.flush()
+        query = (f"SELECT id, result, {PARAM_BLOB_SQL} AS blob FROM calculations "
+                 "WHERE page = ? AND param_kind IN (?, ?) AND blob IS NOT NULL")
+        params = [page_filter, PARAM_VECTOR, PARAM_NAMED]
+        if width is not None:
+            query += " AND length(blob) = ?"
+            params.append(width * 8)
+        conditions, time_params = self._time_conditions(start_time, end_time)
+        query += "".join(" AND " + condition for condition in conditions)
+        params.extend(time_params)
+        rows = self._read_conn().execute(query + " ORDER BY timestamp, id", params).fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty((0, 0))
+        ids, results, blobs = zip(*rows)
+        return np.array(ids, dtype=np.int64), np.array(results, dtype=float), decode_param_matrix(blobs)
+
+    @METRICS.timed("calc_db_seconds", op="get_result_array")
+    def get_result_array(self, page_filter, limit=None):
+        """按时间顺序返回某页面最近 limit 条记录的结果数组"""
+        self.flush()
+        query = "SELECT result FROM calculations WHERE page = ? ORDER BY timestamp DESC, id DESC"
+        params = [page_filter]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = self._read_conn().execute(query, params).fetchall()
+        return np.array([row[0] for row in reversed(rows)], dtype=float)
+
+    @METRICS.timed("calc_db_seconds", op="get_series")
+    def get_series(self, start_time=None, end_time=None, until_id=None):
+        """按页面返回时间序列 [(页面, 本地时间数组 datetime64[us], 结果数组)]，时间戳一次性向量化转换"""
+        self.flush()
+        query = "SELECT page, timestamp, result FROM calculations"
+        conditions, params = self._time_conditions(start_time, end_time)
+        if until_id is not None:
+            conditions.append("id <= ?")
+            params.append(until_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        rows = self._read_conn().execute(query + " ORDER BY page, timestamp, id", params).fetchall()
+        archived = self._archived_rows(to_epoch_us(start_time), to_epoch_us(end_time, end=True))
+        if archived:
+            rows = sorted(rows + [(r[2], r[1], r[3]) for r in archived])
+        if not rows:
+            return []
+
+        pages, timestamps, results = zip(*rows)
+        return split_by_page(pages, to_local_datetime64(timestamps), np.array(results, dtype=float))
+
+    def _archive_overlaps(self, start_us, end_us):
+        """时间范围内是否有已归档的记录（按分区索引判断）"""
+        return self._read_conn().execute(
+            "SELECT 1 FROM archive_partitions WHERE max_timestamp >= ? AND min_timestamp <= ? LIMIT 1",
+            (-2 ** 63 if start_us is None else start_us, 2 ** 63 - 1 if end_us is None else end_us)).fetchone() is not None
+
+    def _page_ranges(self, start_time, end_time, page_filter=None):
+        """按页面的查询条件 [(页面, 条件, 参数)]：每个页面单独查询，按 idx_page_time 的顺序读取，窗口函数无需排序"""
+        start_us, end_us = to_epoch_us(start_time), to_epoch_us(end_time, end=True)
+        if page_filter:
+            pages = [page_filter]
+        else:
+            # 页面列表取自按天汇总表，与记录数无关
+            query = "SELECT DISTINCT page FROM rollups WHERE granularity = 'day'"
+            params = []
+            if start_us is not None:
+                query += " AND bucket >= ?"
+                params.append(rollup_bucket(start_us, 86400))
+            if end_us is not None:
+                query += " AND bucket <= ?"
+                params.append(end_us)
+            pages = [row[0] for row in self._read_conn().execute(query + " ORDER BY page", params)]
+        conditions, params = self._time_conditions(start_time, end_time)
+        where = " AND ".join(["page = ?"] + conditions)
+        return [(page_name, where, [page_name] + params) for page_name in pages]
+
+    @METRICS.timed("calc_db_seconds", op="get_summary_stats")
+    def get_summary_stats(self, start_time=None, end_time=None, page_filter=None):
+        """按页面返回统计摘要 {页面: {条数、均值、标准差、最小/最大值、分位数、首末值、变化量、相邻变化}}
+
+        统计在 SQL 中完成，每个页面只返回几行：标准差在第二遍减去均值后计算，相邻变化用 LAG 窗口，
+        分位数按结果排名取相邻两条线性插值（与 numpy 一致）。范围内有归档记录时改为读取列数组用 numpy 计算。
+        """
+        self.flush()
+        if self._archive_overlaps(to_epoch_us(start_time), to_epoch_us(end_time, end=True)):
+            return {name: summary_stats(y) for name, _, y in self.get_series(start_time, end_time)
+                    if not page_filter or name == page_filter}
+
+        conn = self._read_conn()
+        summary = {}
+        for page_name, where, params in self._page_ranges(start_time, end_time, page_filter):
+            count, mean, low, high = conn.execute(
+                f"SELECT COUNT(*), AVG(result), MIN(result), MAX(result) FROM calculations WHERE {where}",
+                params).fetchone()
+            if not count:
+                continue
+            var, first, last, mean_delta, max_delta = conn.execute(f"""
+                SELECT AVG((result - ?) * (result - ?)), MAX(CASE WHEN seq = 1 THEN result END),
+                       MAX(CASE WHEN seq = ? THEN result END), AVG(ABS(delta)), MAX(ABS(delta))
+                FROM (SELECT result, result - LAG(result) OVER by_time AS delta, ROW_NUMBER() OVER by_time AS seq
+                      FROM calculations WHERE {where}
+                      WINDOW by_time AS (ORDER BY timestamp, id))""", [mean, mean, count] + params).fetchone()
+            stats = {'count': count, 'mean': mean, 'std': math.sqrt(max(var, 0.0)), 'min': low, 'max': high,
+                     'first': first, 'last': last, 'change': last - first,
+                     'mean_abs_delta': mean_delta, 'max_abs_delta': max_delta}
+
+            positions = [(count - 1) * (p / 100) for p in SUMMARY_PERCENTILES]
+            ranks = sorted({int(position) + k for position in positions for k in (1, 2) if int(position) + k <= count})
+            values = dict(conn.execute(f"""
+                SELECT rank, result FROM (
+                    SELECT result, ROW_NUMBER() OVER (ORDER BY result) AS rank FROM calculations WHERE {where})
+                WHERE rank IN ({", ".join("?" * len(ranks))})""", params + ranks).fetchall())
+            for p, position in zip(SUMMARY_PERCENTILES, positions):
+                below = values[int(position) + 1]
+                above = values.get(int(position) + 2, below)
+                stats[f'p{p}'] = below + (above - below) * (position - int(position))
+            summary[page_name] = stats
+        return summary
+
+    @METRICS.timed("calc_db_seconds", op="get_rolling_series")
+    def get_rolling_series(self, start_time=None, end_time=None, window=ROLLING_WINDOW, points=None):
+        """按页面返回滑动均值和标准差 [(页面, 本地时间数组, 均值数组, 标准差数组)]
+
+        窗口为按时间排序的前 window 条记录（开头不足时取已有的），在 SQL 窗口函数中逐条计算，先减去页面均值以保证精度；
+        points 给定时只返回约 points 个等间隔的点，数据库之外只传输绘图所需的点数。
+        范围内有归档记录时改为读取列数组用 numpy 计算。
+        """
+        self.flush()
+        window = max(int(window), 1)
+        if self._archive_overlaps(to_epoch_us(start_time), to_epoch_us(end_time, end=True)):
+            series = []
+            for name, x, y in self.get_series(start_time, end_time):
+                mean, std = rolling_stats(y, window)
+                step = max(len(y) // points, 1) if points else 1
+                keep = np.unique(np.r_[np.arange(0, len(y), step), len(y) - 1])
+                series.append((name, x[keep], mean[keep], std[keep]))
+            return series
+
+        conn = self._read_conn()
+        series = []
+        for page_name, where, params in self._page_ranges(start_time, end_time):
+            count, shift = conn.execute(f"SELECT COUNT(*), AVG(result) FROM calculations WHERE {where}",
+                                        params).fetchone()
+            if not count:
+                continue
+            step = max(count // points, 1) if points else 1
+            rows = conn.execute(f"""
+                SELECT timestamp, mean, mean_sq - mean * mean FROM (
+                    SELECT timestamp, AVG(result - ?) OVER rolling AS mean,
+                           AVG((result - ?) * (result - ?)) OVER rolling AS mean_sq,
+                           ROW_NUMBER() OVER rolling AS seq
+                    FROM calculations WHERE {where}
+                    WINDOW rolling AS (ORDER BY timestamp, id ROWS BETWEEN ? PRECEDING AND CURRENT ROW))
+                WHERE (seq - 1) % ? = 0 OR seq = ?""",
+                [shift, shift, shift] + params + [window - 1, step, count]).fetchall()
+            timestamps, means, variances = zip(*rows)
+            series.append((page_name, to_local_datetime64(timestamps), np.array(means, dtype=float) + shift,
+                           np.sqrt(np.maximum(np.array(variances, dtype=float), 0.0))))
+        return series
+
+    @METRICS.timed("calc_db_seconds", op="find_result")
+    def find_result(self, param_hash):
+        """按参数哈希查找已保存的计算结果，未找到时返回 None
+
+        写回缓冲中尚未提交的记录查不到，由 ResultCache 的内存 LRU 覆盖，这里不等待提交。
+        """
+        row = self._read_conn().execute(
+            "SELECT result FROM calculations WHERE param_hash = ? LIMIT 1", (param_hash,)).fetchone()
+        return row[0] if row else None
+
+    def max_record_id(self):
+        self.flush()
+        return self._read_conn().execute("SELECT MAX(id) FROM calculations").fetchone()[0] or 0
+
+    def pending_result(self, page_name):
+        """写回缓冲中该页面最新一条尚未提交的记录 (时间戳, 结果)，没有时返回 None"""
+        row = self._writer.latest_row(page_name) if self._writer else None
+        return None if row is None else (row[0], row[2])
 
     def delete_record(self, record_id):
-        with self.conn:
-            self.conn.execute("DELETE FROM calculations WHERE id = ?", (record_id,))
+        self.delete_records([record_id])
+
+    @METRICS.timed("calc_db_seconds", op="delete_records")
+    def delete_records(self, record_ids):
+        """在一个事务内删除多条记录，汇总表、参数值索引和变更日志由触发器随之更新
+
+        归档分区只读，其中的记录不能删除：只要有一条不在热表中就整体回滚并抛出 ValueError。
+        """
+        record_ids = list(dict.fromkeys(record_ids))
+        self.flush()
+        with self._write():
+            deleted = self.conn.executemany(
+                "DELETE FROM calculations WHERE id = ?", ((record_id,) for record_id in record_ids)).rowcount
+            if deleted != len(record_ids):
+                raise ValueError(f"选中的记录中有 {len(record_ids) - deleted} 条已归档或已被删除，"
+                                 "归档记录不能删除，本次未删除任何记录")
+            self._prune_change_log(self.conn)
+
+    def subscribe(self, callback):
+        """订阅记录变更：callback(新增记录, 删除记录, 是否需整体重新加载) 在调用 poll_changes 的线程执行
+
+        新增记录与 get_records 的行格式相同；删除记录为 [(id, 页面, 时间戳)]。
+        """
+        if self._change_seq is None:
+            self._change_seq = self._read_conn().execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    @METRICS.timed("calc_db_seconds", op="poll_changes")
+    def poll_changes(self):
+        """读取上次轮询之后的变更并分发给订阅者，返回变更条数
+
+        PRAGMA data_version 只在其他连接（本进程的写连接或其他进程）提交后变化，数据库未变化时只执行这一条语句；
+        变更按 change_log 的序号读取，开销与变更条数成正比。变更过多或所需日志已被清理时通知订阅者整体重新加载。
+        """
+        if not self._subscribers:
+            return 0
+        conn = self._read_conn()
+        version = (id(conn), conn.execute("PRAGMA data_version").fetchone()[0])
+        if version == self._data_version:
+            return 0
+        self._data_version = version
+        changes = conn.execute(
+            "SELECT seq, op, record_id, page, timestamp FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?",
+            (self._change_seq, CHANGE_BATCH_LIMIT + 1)).fetchall()
+        if not changes:
+            return 0
+
+        # 序号由 AUTOINCREMENT 连续分配，出现空缺说明中间的日志已被清理
+        reset = (len(changes) > CHANGE_BATCH_LIMIT or changes[0][0] != self._change_seq + 1
+                 or any(op == CHANGE_RESET for _, op, _, _, _ in changes))
+        inserted, deleted = [], []
+        if reset:
+            self._change_seq = conn.execute("SELECT MAX(seq) FROM change_log").fetchone()[0]
+        else:
+            self._change_seq = changes[-1][0]
+            ids = [record_id for _, op, record_id, _, _ in changes if op == CHANGE_INSERT]
+            if ids:
+                inserted = conn.execute(
+                    f"SELECT id, timestamp, page, result, {self._param_columns()} FROM calculations "
+                    f"WHERE id IN ({', '.join('?' * len(ids))}) ORDER BY timestamp DESC, id DESC", ids).fetchall()
+            deleted = [(record_id, page_name, timestamp)
+                       for _, op, record_id, page_name, timestamp in changes if op == CHANGE_DELETE]
+
+        for callback in list(self._subscribers):
+            try:
+                callback(inserted, deleted, reset)
+            except Exception:
+                print(f"ERROR: 变更通知处理失败：{traceback.format_exc()}")
+        return len(changes)
+
+    @METRICS.timed("calc_db_seconds", op="get_time_bounds")
+    def get_time_bounds(self):
+        """最早和最晚记录的时间戳 (微秒, 微秒)，含已归档的记录，无记录时为 (None, None)
+
+        两个子查询各自走时间索引的一端，为 O(log n)；归档部分取自分区索引。
+        """
+        self.flush()
+        return self._read_conn().execute(
+            "SELECT MIN(low), MAX(high) FROM ("
+            "SELECT (SELECT MIN(timestamp) FROM calculations) AS low, (SELECT MAX(timestamp) FROM calculations) AS high "
+            "UNION ALL SELECT MIN(min_timestamp), MAX(max_timestamp) FROM archive_partitions)").fetchone()
+
+    @METRICS.timed("calc_db_seconds", op="get_record_days")
+    def get_record_days(self):
+        """有记录的日期（本地零点的微秒时间戳），取自按天汇总表，与记录总数无关"""
+        self.flush()
+        rows = self._read_conn().execute(
+            "SELECT DISTINCT bucket FROM rollups WHERE granularity = 'day' ORDER BY bucket").fetchall()
+        return [row[0] for row in rows]
+
+
+def summary_stats(y):
+    """按时间排序的结果数组的统计摘要，字段与 DataManager.get_summary_stats 相同"""
+    y = np.asarray(y, dtype=float)
+    deltas = np.abs(np.diff(y))
+    stats = {'count': len(y), 'mean': float(y.mean()), 'std': float(y.std()),
+             'min': float(y.min()), 'max': float(y.max()),
+             'first': float(y[0]), 'last': float(y[-1]), 'change': float(y[-1] - y[0]),
+             'mean_abs_delta': float(deltas.mean()) if len(deltas) else None,
+             'max_abs_delta': float(deltas.max()) if len(deltas) else None}
+    for p, value in zip(SUMMARY_PERCENTILES, np.percentile(y, SUMMARY_PERCENTILES)):
+        stats[f'p{p}'] = float(value)
+    return stats
+
+
+def rolling_stats(y, window):
+    """滑动窗口（含当前点的前 window 条，开头不足时取已有的）均值和标准差，前缀和向量化计算
+
+    先减去整体均值再累加，避免大数值下方差相消失去精度。
+    """
+    y = np.asarray(y, dtype=float)
+    shift = y.mean()
+    centered = y - shift
+    sums = np.concatenate(([0.0], np.cumsum(centered)))
+    squares = np.concatenate(([0.0], np.cumsum(centered * centered)))
+    end = np.arange(1, len(y) + 1)
+    start = np.maximum(end - window, 0)
+    counts = end - start
+    mean = (sums[end] - sums[start]) / counts
+    var = (squares[end] - squares[start]) / counts - mean * mean
+    return mean + shift, np.sqrt(np.maximum(var, 0.0))
+
+
+# 向量输入的分隔符：空白、中英文逗号和分号、顿号
+VECTOR_SEPARATORS = re.compile(r"[\s,;，；、]+")
+PRODUCT_CHUNK = 1000  # 尾数在 [0.5, 1) 内，1000 个连乘不会下溢
+
+
+def parse_vector(text):
+    """解析粘贴或文件中的数值序列，返回 float64 数组"""
+    tokens = [token for token in VECTOR_SEPARATORS.split(text) if token]
+    if not tokens:
+        raise ValueError("没有找到数值")
+    try:
+        return np.array(tokens, dtype=float)
+    except ValueError:
+        for i, token in enumerate(tokens):
+            try:
+                float(token)
+            except ValueError:
+                raise ValueError(f"第 {i + 1} 个值无法解析：{token[:20]}") from None
+        raise
+
+
+@METRICS.timed("calc_kernel_seconds", kernel="vector_sum")
+def vector_sum(values):
+    """补偿求和（math.fsum）：结果为精确和的正确舍入，与元素顺序无关"""
+    try:
+        return math.fsum(np.asarray(values, dtype=float).tolist())
+    except OverflowError:
+        # 精确和超出 float 范围，普通求和同样溢出为带符号的 inf
+        with np.errstate(over='ignore'):
+            return float(np.sum(values, dtype=float))
+
+
+def frexp_product(values):
+    """溢出安全的连乘，返回 (尾数, 2 的指数)：尾数与指数分开累积，中间结果不会上溢或下溢"""
+    mantissas, exponents = np.frexp(np.asarray(values, dtype=float))
+    mantissa = 1.0
+    exponent = int(exponents.sum(dtype=np.int64))
+    for start in range(0, len(mantissas), PRODUCT_CHUNK):
+        chunk_mantissa, chunk_exponent = math.frexp(float(np.prod(mantissas[start:start + PRODUCT_CHUNK])))
+        mantissa, carry = math.frexp(mantissa * chunk_mantissa)
+        exponent += chunk_exponent + carry
+    return mantissa, exponent
+
+
+@METRICS.timed("calc_kernel_seconds", kernel="vector_product")
+def vector_product(values):
+    """向量连乘：超出 float 范围时返回 ±inf 或 0，数量级可由 describe_product 给出"""
+    mantissa, exponent = frexp_product(values)
+    try:
+        return math.ldexp(mantissa, exponent)
+    except OverflowError:
+        return math.copysign(math.inf, mantissa)
+
+
+def describe_product(values):
+    """以十进制科学计数法描述超出 float 范围的连乘结果，如 -1.234567e+5123"""
+    mantissa, exponent = frexp_product(values)
+    if mantissa == 0 or not math.isfinite(mantissa):
+        return str(mantissa)
+    log10 = math.log10(abs(mantissa)) + exponent * math.log10(2)
+    power = math.floor(log10)
+    return f"{math.copysign(10 ** (log10 - power), mantissa):.6f}e{power:+d}"
+
+
+class FormulaError(ValueError):
+    """公式有语法错误、使用了不允许的语法，或计算失败"""
+
+
+# 公式白名单：运算符、函数（名称 -> (NumPy 函数, 参数个数)）和常量，其余语法一律拒绝
+FORMULA_BINARY_OPS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+}
+FORMULA_UNARY_OPS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+FORMULA_COMPARE_OPS = {
+    ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+    ast.Eq: operator.eq, ast.NotEq: operator.ne,
+}
+FORMULA_FUNCTIONS = {
+    "sqrt": (np.sqrt, 1), "exp": (np.exp, 1), "log": (np.log, 1), "log10": (np.log10, 1),
+    "sin": (np.sin, 1), "cos": (np.cos, 1), "tan": (np.tan, 1), "abs": (np.abs, 1),
+    "min": (np.minimum, 2), "max": (np.maximum, 2), "where": (np.where, 3),
+}
+FORMULA_CONSTANTS = {"pi": math.pi, "e": math.e}
+FORMULA_MAX_LENGTH = 1000
+
+
+class Formula:
+    """编译后的公式：formula(*变量值) 按 variables 顺序传参，可传标量或等长数组（数组一次向量化计算）"""
+
+    def __init__(self, source, func, variables, fingerprint):
+        self.source = source
+        self.variables = variables
+        self.fingerprint = fingerprint
+        self._func = func
+
+    def __call__(self, *args):
+        return self._func(args)
+
+    def evaluate(self, values):
+        """按变量名取值计算：标量输入返回 float，数组输入返回 float 数组"""
+        try:
+            args = [values[name] for name in self.variables]
+        except KeyError as e:
+            raise FormulaError(f"缺少变量：{e.args[0]}") from None
+        try:
+            with np.errstate(all='ignore'):
+                result = self._func(args)
+        except (ArithmeticError, ValueError, TypeError) as e:
+            raise FormulaError(f"计算失败：{e}") from None
+        if isinstance(result, complex):
+            raise FormulaError("计算结果不是实数")
+        if np.ndim(result) == 0:
+            result = float(result)
+            if not math.isfinite(result):
+                raise FormulaError("计算结果不是有限数值")
+            return result
+        return np.asarray(result, dtype=float)
+
+
+def compile_formula(source):
+    """将公式解析为 AST、按白名单校验，并编译为闭包；常量子表达式在编译时折叠"""
+    source = source.strip()
+    if not source:
+        raise FormulaError("公式为空")
+    if len(source) > FORMULA_MAX_LENGTH:
+        raise FormulaError(f"公式长度不能超过 {FORMULA_MAX_LENGTH} 个字符")
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError as e:
+        raise FormulaError(f"公式语法错误：{e.msg}") from None
+
+    variables = []
+
+    def fold(func, *parts):
+        # parts 为 (闭包, 常量值或 None)；全部为常量时直接算出结果
+        if all(value is not None for _, value in parts):
+            try:
+                value = func(*(value for _, value in parts))
+            except (ArithmeticError, ValueError) as e:
+                raise FormulaError(f"常量计算失败：{e}") from None
+            return (lambda args: value), value
+        funcs = [part for part, _ in parts]
+        if len(funcs) == 1:
+            a, = funcs
+            return (lambda args: func(a(args))), None
+        if len(funcs) == 2:
+            a, b = funcs
+            return (lambda args: func(a(args), b(args))), None
+        return (lambda args: func(*(part(args) for part in funcs))), None
+
+    def build(node):
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise FormulaError(f"不支持的常量：{node.value!r}")
+            value = float(node.value)
+            return (lambda args: value), value
+        if isinstance(node, ast.Name):
+            if node.id in FORMULA_CONSTANTS:
+                value = FORMULA_CONSTANTS[node.id]
+                return (lambda args: value), value
+            if node.id in FORMULA_FUNCTIONS:
+                raise FormulaError(f"{node.id} 是函数，需要加括号调用")
+            if node.id not in variables:
+                variables.append(node.id)
+            index = variables.index(node.id)
+            return (lambda args: args[index]), None
+        if isinstance(node, ast.BinOp) and type(node.op) in FORMULA_BINARY_OPS:
+            return fold(FORMULA_BINARY_OPS[type(node.op)], build(node.left), build(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in FORMULA_UNARY_OPS:
+            return fold(FORMULA_UNARY_OPS[type(node.op)], build(node.operand))
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in FORMULA_COMPARE_OPS:
+            return fold(FORMULA_COMPARE_OPS[type(node.ops[0])], build(node.left), build(node.comparators[0]))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            if node.func.id not in FORMULA_FUNCTIONS:
+                raise FormulaError(f"不支持的函数：{node.func.id}")
+            func, arity = FORMULA_FUNCTIONS[node.func.id]
+            if len(node.args) != arity:
+                raise FormulaError(f"函数 {node.func.id} 需要 {arity} 个参数")
+            return fold(func, *(build(arg) for arg in node.args))
+        raise FormulaError(f"不支持的语法：{type(node).__name__}")
+
+    func, _ = build(tree.body)
+    fingerprint = hashlib.sha256(ast.dump(tree).encode('utf-8')).hexdigest()[:16]
+    return Formula(source, func, variables, fingerprint)
+
+
+# 扫描目标：名称 -> (逐样本取值函数, 取均值后的变换, 是否越大越好)，按名称传给工作进程
+SWEEP_OBJECTIVES = {
+    "均值最大": (lambda c, target: c, None, True),
+    "均值最小": (lambda c, target: c, None, False),
+    "接近目标值（RMSE）": (lambda c, target: (c - target) ** 2, np.sqrt, False),
+    "达标率（≥目标值）": (lambda c, target: c >= target, None, True),
+}
+
+_sweep_data = None  # 工作进程中的 (sums, products)，由 _sweep_init 设置
+
+
+def sweep_scores(alphas, betas, sums, products, objective, target=0.0):
+    """对 α×β 网格广播计算 α·和 + β·积，返回每个网格点在全部样本上的目标值 (len(alphas), len(betas))
+
+    样本维分块累加，中间数组不超过 SWEEP_CHUNK_ELEMENTS 个元素。
+    """
+    value_func, transform, _ = SWEEP_OBJECTIVES[objective]
+    alphas = np.asarray(alphas, dtype=float)[:, None, None]
+    betas = np.asarray(betas, dtype=float)[None, :, None]
+    total = np.zeros((alphas.shape[0], betas.shape[1]))
+    step = max(1, SWEEP_CHUNK_ELEMENTS // max(1, total.size))
+    with np.errstate(all='ignore'):
+        for start in range(0, len(sums), step):
+            composite = alphas * sums[start:start + step] + betas * products[start:start + step]
+            total += value_func(composite, target).sum(axis=-1)
+        scores = total / len(sums)
+        return transform(scores) if transform is not None else scores
+
+
+def _sweep_init(sums, products):
+    global _sweep_data
+    _sweep_data = (sums, products)
+
+
+def _sweep_chunk(alphas, betas, objective, target):
+    return sweep_scores(alphas, betas, *_sweep_data, objective, target)
+
+
+class BatchCalculator:
+    """批量计算引擎：对 (N×6) 参数矩阵一次性执行求和/求积/综合计算"""
+
+    def __init__(self, data_mgr):
+        self.data_mgr = data_mgr
+
+    @staticmethod
+    def _as_matrix(params):
+        params = np.asarray(params, dtype=float)
+        if params.ndim != 2 or params.shape[1] == 0:
+            raise ValueError(f"参数矩阵形状应为 (N, k)，实际为 {params.shape}")
+        return params
+
+    @staticmethod
+    @METRICS.timed("calc_kernel_seconds", kernel="batch_sum")
+    def sum(params):
+        """逐列累加，累加顺序与标量 sum() 相同，结果逐位一致"""
+        params = BatchCalculator._as_matrix(params)
+        result = params[:, 0].copy()
+        for j in range(1, params.shape[1]):
+            result += params[:, j]
+        return result
+
+    @staticmethod
+    @METRICS.timed("calc_kernel_seconds", kernel="batch_product")
+    def product(params):
+        """逐列累乘，与标量循环求积结果逐位一致"""
+        params = BatchCalculator._as_matrix(params)
+        result = params[:, 0].copy()
+        for j in range(1, params.shape[1]):
+            result *= params[:, j]
+        return result
+
+    @staticmethod
+    @METRICS.timed("calc_kernel_seconds", kernel="batch_composite")
+    def composite(sums, products, alpha, beta):
+        """综合计算 α·和 + β·积，alpha/beta 可为标量或长度为 N 的向量"""
+        sums = np.asarray(sums, dtype=float)
+        products = np.asarray(products, dtype=float)
+        alpha = np.broadcast_to(np.asarray(alpha, dtype=float), sums.shape)
+        beta = np.broadcast_to(np.asarray(beta, dtype=float), sums.shape)
+        return (alpha * sums) + (beta * products), alpha, beta
+
+    @staticmethod
+    @METRICS.timed("calc_kernel_seconds", kernel="batch_sweep")
+    def sweep(sums, products, alphas, betas, objective, target=0.0, workers=SWEEP_WORKERS):
+        """参数扫描：sums 与 products 按位置配对，返回目标值网格 (len(alphas), len(betas))
+
+        计算量超过 SWEEP_PARALLEL_THRESHOLD 时按 α 分块交给进程池，样本数据只向每个进程传一次。
+        """
+        sums = np.asarray(sums, dtype=float)
+        products = np.asarray(products, dtype=float)
+        if sums.shape != products.shape or sums.ndim != 1 or not sums.size:
+            raise ValueError("求和与求积样本应为等长的非空一维数组")
+        alphas = np.asarray(alphas, dtype=float)
+        betas = np.asarray(betas, dtype=float)
+        if alphas.size * betas.size * sums.size < SWEEP_PARALLEL_THRESHOLD or workers == 1 or alphas.size < 2:
+            return sweep_scores(alphas, betas, sums, products, objective, target)
+
+        workers = workers or os.cpu_count() or 1
+        parts = np.array_split(alphas, min(alphas.size, workers * 4))
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_sweep_init,
+                                     initargs=(sums, products)) as pool:
+                chunks = list(pool.map(_sweep_chunk, parts, itertools.repeat(betas),
+                                       itertools.repeat(objective), itertools.repeat(target)))
+        except (OSError, BrokenProcessPool) as e:
+            print(f"WARN: 进程池不可用，改为单进程扫描：{e}")
+            return sweep_scores(alphas, betas, sums, products, objective, target)
+        return np.vstack(chunks)
+
+    @staticmethod
+    def best_point(scores, objective):
+        """返回最优网格点的下标 (i, j)，忽略 NaN；全部无效时返回 None"""
+        if np.isnan(scores).all():
+            return None
+        maximize = SWEEP_OBJECTIVES[objective][2]
+        flat = np.nanargmax(scores) if maximize else np.nanargmin(scores)
+        return np.unravel_index(flat, scores.shape)
+
+    def run_sum(self, params, save=True):
+        params = self._as_matrix(params)
+        results = self.sum(params)
+        if save:
+            self.data_mgr.save_records("参数求和", results, params)
+        return results
+
+    def run_product(self, params, save=True):
+        params = self._as_matrix(params)
+        results = self.product(params)
+        if save:
+            self.data_mgr.save_records("参数求积", results, params)
+        return results
+
+    def run_composite(self, params, alpha, beta, save=True):
+        """对每行参数计算和与积，再按对应的 α、β 组合"""
+        params = self._as_matrix(params)
+        results, alpha, beta = self.composite(self.sum(params), self.product(params), alpha, beta)
+        if save:
+            weights = [{"alpha": a, "beta": b} for a, b in zip(alpha.tolist(), beta.tolist())]
+            self.data_mgr.save_records("综合计算", results, weights)
+        return results
+
+    def run_formula(self, page_name, formula, columns, save=True):
+        """对整列参数一次向量化计算公式，columns 为 {变量名: 数组或标量}"""
+        values = {name: np.asarray(columns[name], dtype=float) for name in formula.variables if name in columns}
+        size = max((v.size for v in values.values()), default=1)
+        results = np.broadcast_to(formula.evaluate(values), (size,)).astype(float)
+        if save:
+            bad = np.flatnonzero(~np.isfinite(results))
+            if bad.size:
+                raise FormulaError(f"第 {bad[0] + 1} 行的计算结果不是有限数值")
+            names = formula.variables
+            matrix = np.column_stack([np.broadcast_to(values[name], (size,)) for name in names]) \
+                if names else np.empty((size, 0))
+            self.data_mgr.save_records(page_name, results, [dict(zip(names, row)) for row in matrix.tolist()])
+        return results
+
+
+class ResultCache:
+    """计算结果缓存：键为 (页面, 内核版本, 规范化参数哈希)
+
+    先查内存 LRU，未命中再按哈希索引查数据库中已保存的记录，都未命中才真正计算。
+    可在多个线程中同时使用：锁只保护内存 LRU 和计数，数据库查找和计算不持锁。
+    """
+
+    def __init__(self, data_mgr, capacity=MEMO_CACHE_SIZE):
+        self.data_mgr = data_mgr
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _remember(self, digest, result):
+        with self._lock:
+            self._entries[digest] = result
+            self._entries.move_to_end(digest)
+            if len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, page_name, params, func, version=None):
+        """返回 (结果, 缓存键, 是否命中)；未命中时调用 func(params) 计算，version 见 param_digest"""
+        digest = param_digest(page_name, params, version)
+        with self._lock:
+            result = self._entries.get(digest)
+            if result is not None:
+                self._entries.move_to_end(digest)
+                self.memory_hits += 1
+        if result is not None:
+            METRICS.inc("calc_cache_requests_total", result="memory_hit")
+            return result, digest, True
+
+        # 并发的相同请求可能各自查找或计算一次，结果相同，后写入的覆盖先写入的
+        result = self.data_mgr.find_result(digest)
+        if result is not None:
+            with self._lock:
+                self.db_hits += 1
+            METRICS.inc("calc_cache_requests_total", result="db_hit")
+            self._remember(digest, result)
+            return result, digest, True
+
+        with self._lock:
+            self.misses += 1
+        METRICS.inc("calc_cache_requests_total", result="miss")
+        with METRICS.timer("calc_kernel_seconds", kernel=page_name):
+            result = func(params)
+        self._remember(digest, result)
+        return result, digest, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        hits = self.memory_hits + self.db_hits
+        total = hits + self.misses
+        rate = hits / total * 100 if total else 0.0
+        return (f"命中：{hits} 次（内存 {self.memory_hits}，数据库 {self.db_hits}）\n"
+                f"未命中：{self.misses} 次\n"
+                f"命中率：{rate:.1f}%\n"
+                f"内存缓存：{len(self._entries)}/{self.capacity} 条")
+
+
+class QueryExecutor:
+    """后台查询执行器：在工作线程运行数据库查询，结果经 after() 轮询交回 Tk 线程"""
+
+    POLL_MS = 30
+
+    def __init__(self, root, data_mgr, workers=2):
+        self.root = root
+        self.data_mgr = data_mgr
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+        self._results = queue.Queue()
+        self._sequence = itertools.count(1)
+        self._latest = {}    # key -> 该 key 最新请求的序号
+        self._running = {}   # 序号 -> 正在执行它的线程
+        # 登记/注销正在执行的请求与按序号中断互斥，中断只会落在目标请求上，不会波及该线程接着执行的下一个请求
+        self._running_lock = threading.Lock()
+        self._pending = 0
+        self._poll_job = None
+        self._busy_callbacks = []
+        self.profiler = None  # ProfileCapture：分析进行中时对工作线程的调用单独采样
+
+    @property
+    def busy(self):
+        return self._pending > 0
+
+    def add_busy_callback(self, callback):
+        """注册忙碌状态回调 callback(busy)"""
+        self._busy_callbacks.append(callback)
+
+    def submit(self, func, *args, callback=None, error_callback=None, key=None):
+        """在工作线程执行 func(*args)，完成后在 Tk 线程调用 callback(结果) 或 error_callback(异常)
+
+        同一 key 的新请求会作废并中断旧请求，旧请求的结果不再回调。
+        """
+        seq = next(self._sequence)
+        if key is not None:
+            self.cancel(key)
+            self._latest[key] = seq
+        self._pending += 1
+        if self._pending == 1:
+            self._notify_busy()
+        self._pool.submit(self._run, key, seq, func, args, callback, error_callback)
+        if self._poll_job is None:
+            self._poll_job = self.root.after(self.POLL_MS, self._poll)
+        return seq
+
+    def cancel(self, key):
+        """作废 key 对应的请求，正在执行时中断其 SQL"""
+        seq = self._latest.pop(key, None)
+        if seq is None:
+            return
+        with self._running_lock:
+            ident = self._running.get(seq)
+            if ident is not None:
+                self.data_mgr.interrupt(ident)
+
+    def _is_stale(self, key, seq):
+        return key is not None and self._latest.get(key) != seq
+
+    def _run(self, key, seq, func, args, callback, error_callback):
+        if self._is_stale(key, seq):
+            self._results.put((key, seq, None, None, None))
+            return
+        with self._running_lock:
+            self._running[seq] = threading.get_ident()
+        try:
+            if self.profiler is not None and self.profiler.running:
+                outcome = (True, self.profiler.profile_call(func, *args))
+            else:
+                outcome = (True, func(*args))
+        except Exception as e:
+            outcome = (False, e)
+        finally:
+            with self._running_lock:
+                self._running.pop(seq, None)
+        self._results.put((key, seq, callback, error_callback, outcome))
+
+    def _poll(self):
+        self._poll_job = None
+        while True:
+            try:
+                key, seq, callback, error_callback, outcome = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._pending -= 1
+            if outcome is None or self._is_stale(key, seq):
+                continue
+            if key is not None:
+                del self._latest[key]
+            ok, value = outcome
+            try:
+                if ok:
+                    if callback is not None:
+                        callback(value)
+                elif error_callback is not None:
+                    error_callback(value)
+                else:
+                    print(f"ERROR: 后台查询失败：{value}")
+            except Exception:
+                print(f"ERROR: {traceback.format_exc()}")
+
+        if self._pending:
+            self._poll_job = self.root.after(self.POLL_MS, self._poll)
+        else:
+            self._notify_busy()
+
+    def _notify_busy(self):
+        for callback in self._busy_callbacks:
+            callback(self.busy)
+
+    def shutdown(self):
+        with self._running_lock:
+            for ident in self._running.values():
+                self.data_mgr.interrupt(ident)
+        self._latest.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
 
-    def get_available_timestamps(self):
-        """获取所有有效时间戳"""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT DISTINCT timestamp FROM calculations ORDER BY timestamp")
-        return [row[0] for row in cursor.fetchall()]
+class ProfileCapture:
+    """单次操作的 cProfile 分析：布防后从下一次鼠标或键盘操作开始，到后台查询全部完成时结束
+
+    界面线程由一个 Profile 连续采样，后台查询各自采样，结束时合并为一份结果。
+    """
+
+    CHECK_MS = 100
+    MAX_SECONDS = 60
+
+    def __init__(self, root, executor, on_done):
+        self.root = root
+        self.executor = executor
+        self.on_done = on_done  # on_done(统计文件路径, 报告文本)
+        self.state = "idle"     # idle / armed / running
+        self._profiler = None
+        self._worker_profiles = []
+        self._lock = threading.Lock()
+        self._started = 0.0
+        executor.profiler = self
+        for sequence in ("<ButtonPress>", "<KeyPress>"):
+            root.bind_all(sequence, self._start, add="+")
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    def arm(self):
+        if self.state == "idle":
+            self.state = "armed"
+
+    def _start(self, event=None):
+        if self.state != "armed":
+            return
+        self.state = "running"
+        self._worker_profiles = []
+        self._started = time.perf_counter()
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+        self.root.after(self.CHECK_MS, self._check_done)
+
+    def profile_call(self, func, *args):
+        """工作线程：采样一次调用"""
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args)
+        finally:
+            with self._lock:
+                self._worker_profiles.append(profiler)
+
+    def _check_done(self):
+        if self.executor.busy and time.perf_counter() - self._started < self.MAX_SECONDS:
+            self.root.after(self.CHECK_MS, self._check_done)
+            return
+        self._profiler.disable()
+        self.state = "idle"
+        stats = pstats.Stats(self._profiler)
+        with self._lock:
+            for profiler in self._worker_profiles:
+                stats.add(profiler)
+            self._worker_profiles = []
+        path = f"profile_{datetime.now():%Y%m%d_%H%M%S}.prof"
+        stats.dump_stats(path)
+        report = io.StringIO()
+        stats.stream = report
+        stats.sort_stats("cumulative").print_stats(30)
+        self.on_done(path, report.getvalue())
+
+
+def split_by_page(pages, *columns):
+    """按已排序的页面列切分各数组，返回 [(页面, 列1, 列2, ...)]"""
+    pages = np.array(pages, dtype=object)
+    bounds = np.flatnonzero(pages[1:] != pages[:-1]) + 1
+    starts = np.r_[0, bounds]
+    ends = np.r_[bounds, len(pages)]
+    return [(pages[s],) + tuple(column[s:e] for column in columns) for s, e in zip(starts, ends)]
+
+
+def minmax_downsample(x, y, buckets):
+    """按像素桶降采样：每个桶保留首、尾、最小、最大四个点，峰谷不会丢失
+
+    x 须已排序，点数不超过 4 * buckets 时原样返回。
+    """
+    n = len(x)
+    if n <= 4 * buckets:
+        return x, y
+    xs = x.astype('int64') if np.issubdtype(x.dtype, np.datetime64) else np.asarray(x, dtype=float)
+    span = xs[-1] - xs[0]
+    if span > 0:
+        bucket = ((xs - xs[0]) * (buckets / span)).astype(np.int64)
+    else:
+        bucket = np.arange(n) * buckets // n
+    np.minimum(bucket, buckets - 1, out=bucket)
+
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    # 桶内按 y 排序后，每段的第一个/最后一个即为该桶最小/最大值的位置
+    order = np.lexsort((y, bucket))
+    keep = np.unique(np.concatenate([starts, ends, order[starts], order[ends]]))
+    return x[keep], y[keep]
+
+
+def format_params(kind, blob, keys, legacy_json=None, *, limit=None):
+    """将记录的参数列转为显示用字符串，limit 限制长向量显示的个数（导出时不限制）
+
+    数值向量为逗号分隔的数值，具名数值参数为 name=value；其他参数为 JSON 文本，导入时可原样还原。
+    """
+    params = decode_params(kind, blob, keys, legacy_json)
+    if blob is None:
+        # 尚未迁移的旧记录按内容判断类型
+        kind = encode_params(params)[0]
+    if kind == PARAM_JSON:
+        return json.dumps(params, ensure_ascii=False)
+    if isinstance(params, dict):
+        return ", ".join(f"{k}={v}" for k, v in params.items())
+    if limit is not None and len(params) > limit:
+        return ", ".join(map(str, params[:limit])) + f", …（共 {len(params)} 个）"
+    return ", ".join(map(str, params))
+
+
+def parse_params_text(text):
+    """format_params 的逆运算：导出文件中的参数文本 → 具名参数 dict 或数值 list"""
+    text = str(text).strip() if text is not None else ""
+    if not text:
+        return []
+    if text[0] in "[{":
+        # 非数值参数（PARAM_JSON）导出为 JSON 文本
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            raise ValueError(f"参数无法解析：{text[:40]}") from None
+    parts = [part.strip() for part in text.split(",")]
+    if "=" not in parts[0]:
+        try:
+            return [float(part) for part in parts]
+        except ValueError:
+            raise ValueError(f"参数无法解析：{text[:40]}") from None
+    params = {}
+    for part in parts:
+        name, sep, value = part.partition("=")
+        if not sep:
+            raise ValueError(f"参数无法解析：{text[:40]}")
+        try:
+            params[name] = float(value)
+        except ValueError:
+            params[name] = value
+    return params
+
+
+class StreamingExporter:
+    """流式导出：按块读取游标并增量写入 CSV / Excel"""
+
+    HEADERS = ('时间戳', '页面', '结果', '参数')
+    EXCEL_MAX_ROWS = 1048576  # 单个工作表行数上限（含表头）
+    # 每块行数：openpyxl 逐行写入远慢于 csv，Excel 使用较小的块保证界面每步停顿很短
+    CHUNK_SIZES = {'csv': 5000, 'excel': 500}
+
+    def __init__(self, data_mgr, file_path, format_type, chunk_size=None):
+        chunk_size = chunk_size or self.CHUNK_SIZES.get(format_type, 1000)
+        self.data_mgr = data_mgr
+        self.file_path = file_path
+        self.format_type = format_type
+        self.total = None  # 由 run() 在工作线程中统计
+        self.written = 0
+        self.skipped = 0
+        self._chunks = data_mgr.iter_records(chunk_size)
+        self._file = None
+        self._workbook = None
+        self._sheet_rows = 0
+        if format_type == 'csv':
+            self._file = open(file_path, 'w', newline='', encoding='utf-8-sig')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(self.HEADERS)
+        else:
+            from openpyxl import Workbook
+            # 只写模式逐行落盘，不在内存中保留整个工作表
+            self._workbook = Workbook(write_only=True)
+            self._new_sheet()
+
+    def _new_sheet(self):
+        index = len(self._workbook.worksheets)
+        self._sheet = self._workbook.create_sheet("计算记录" if index == 0 else f"计算记录{index + 1}")
+        self._sheet.append(self.HEADERS)
+        self._sheet_rows = 1
+
+    def _format_chunk(self, records):
+        rows = []
+        for r in records:
+            try:
+                rows.append((format_timestamp(r[1]), r[2], r[3], format_params(*r[4:])))
+            except json.JSONDecodeError:
+                print(f"WARN: 参数解析失败，记录ID {r[0]}")
+                self.skipped += 1
+        return rows
+
+    def step(self):
+        """写入下一块记录，全部写完时保存文件并返回 False"""
+        records = next(self._chunks, None)
+        if records is None:
+            self._finish()
+            return False
+
+        rows = self._format_chunk(records)
+        if self._file is not None:
+            self._writer.writerows(rows)
+        else:
+            for row in rows:
+                if self._sheet_rows >= self.EXCEL_MAX_ROWS:
+                    self._new_sheet()
+                self._sheet.append(row)
+                self._sheet_rows += 1
+        self.written += len(rows)
+        return True
+
+    def run(self, progress=None):
+        """执行完整导出，可在工作线程中调用；progress(已写入, 总数) 返回 False 时取消
+
+        返回是否完成；没有数据时删除空文件并返回 False。
+        """
+        try:
+            with METRICS.timer("calc_export_seconds", format=self.format_type):
+                self.total = self.data_mgr.count_records()
+                if not self.total:
+                    self.cancel()
+                    return False
+                while self.step():
+                    if progress is not None and progress(self.written, self.total) is False:
+                        self.cancel()
+                        return False
+        except BaseException:
+            self.cancel()
+            raise
+        METRICS.inc("calc_export_rows_total", self.written, format=self.format_type)
+        return True
+
+    def _finish(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._workbook is not None:
+            self._workbook.save(self.file_path)
+            self._workbook = None
+
+    def cancel(self):
+        """中止导出并删除未完成的文件"""
+        self._chunks.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._workbook is not None:
+            # 结束只写工作表的临时文件，未保存的工作簿直接丢弃
+            for sheet in self._workbook.worksheets:
+                sheet.close()
+            self._workbook = None
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+
+class BulkImporter:
+    """流式导入 export_data 写出的 CSV / Excel：按块解析，每块一个事务批量写入"""
+
+    MAX_WARNINGS = 10  # 逐行打印的解析错误条数
+
+    def __init__(self, data_mgr, file_path, dedup=False, chunk_size=IMPORT_CHUNK_ROWS):
+        self.data_mgr = data_mgr
+        self.file_path = file_path
+        self.dedup = dedup
+        self.chunk_size = chunk_size
+        self.format_type = 'excel' if file_path.lower().endswith(('.xlsx', '.xlsm')) else 'csv'
+        self.total = None  # 进度总量：CSV 为文件字节数，Excel 为工作表行数（文件未记录尺寸时为 None）
+        self.done = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self._last_time = (None, None)
+
+    def _columns(self, header):
+        names = [str(name).strip() if name is not None else "" for name in header or ()]
+        missing = [name for name in StreamingExporter.HEADERS if name not in names]
+        if missing:
+            raise ValueError(f"文件缺少列：{'、'.join(missing)}")
+        return operator.itemgetter(*(names.index(name) for name in StreamingExporter.HEADERS))
+
+    def _csv_chunks(self):
+        with open(self.file_path, newline='', encoding='utf-8-sig') as f:
+            self.total = os.fstat(f.fileno()).st_size
+            reader = csv.reader(f)
+            columns = self._columns(next(reader, None))
+            while True:
+                chunk = list(itertools.islice(reader, self.chunk_size))
+                if not chunk:
+                    break
+                self.done = f.buffer.tell()
+                yield columns, chunk
+
+    def _excel_chunks(self):
+        from openpyxl import load_workbook
+        # 只读模式逐行读取，不把整个工作簿载入内存
+        workbook = load_workbook(self.file_path, read_only=True, data_only=True)
+        try:
+            sheets = [sheet for sheet in workbook.worksheets if sheet.title.startswith("计算记录")]
+            sheets = sheets or workbook.worksheets[:1]
+            sizes = [sheet.max_row for sheet in sheets]
+            self.total = None if None in sizes else sum(sizes)
+            for sheet in sheets:
+                rows = sheet.iter_rows(values_only=True)
+                columns = self._columns(next(rows, None))
+                self.done += 1
+                while True:
+                    chunk = list(itertools.islice(rows, self.chunk_size))
+                    if not chunk:
+                        break
+                    self.done += len(chunk)
+                    yield columns, chunk
+        finally:
+            workbook.close()
+
+    def _timestamp(self, value):
+        """返回 (UTC 微秒, 精度)；导出的秒精度时间走 fromisoformat 快速路径，同一秒的连续行复用上次结果"""
+        if value == self._last_time[0]:
+            return self._last_time[1]
+        if isinstance(value, str) and len(value) == 19:
+            parsed = int(datetime.fromisoformat(value).timestamp()) * 1_000_000, 1_000_000
+        else:
+            start = to_epoch_us(value)
+            if start is None:
+                raise ValueError("时间戳为空")
+            parsed = start, to_epoch_us(value, end=True) - start + 1
+        self._last_time = (value, parsed)
+        return parsed
+
+    def _parse_chunk(self, columns, chunk):
+        rows = []
+        for raw in chunk:
+            if not any(raw):
+                continue
+            try:
+                stamp, page_name, result, params = columns(raw)
+                if not page_name:
+                    raise ValueError("页面为空")
+                timestamp, precision = self._timestamp(stamp)
+                rows.append((timestamp, str(page_name), float(result), parse_params_text(params), precision))
+            except (ValueError, TypeError, IndexError) as e:
+                self.invalid += 1
+                if self.invalid <= self.MAX_WARNINGS:
+                    print(f"WARN: 跳过无法解析的行：{e}")
+        return rows
+
+    def run(self, progress=None):
+        """执行完整导入，可在工作线程中调用；progress(已处理, 总量) 返回 False 时在当前块之后停止
+
+        已写入的块保留，返回是否读完整个文件。
+        """
+        chunks = self._excel_chunks() if self.format_type == 'excel' else self._csv_chunks()
+        try:
+            with METRICS.timer("calc_import_seconds", format=self.format_type), \
+                    self.data_mgr.bulk_import(self.dedup) as insert:
+                for columns, chunk in chunks:
+                    rows = self._parse_chunk(columns, chunk)
+                    written = insert(rows)
+                    self.imported += written
+                    self.duplicates += len(rows) - written
+                    if progress is not None and progress(self.done, self.total) is False:
+                        return False
+        finally:
+            chunks.close()
+            METRICS.inc("calc_import_rows_total", self.imported, format=self.format_type)
+        return True
 
 
 class MainApplication(tk.Tk):
@@ -87,37 +2882,325 @@ class MainApplication(tk.Tk):
         super().__init__()
         self.title("工业数据分析系统 v2.0")
         self.geometry("1200x800")
-        self.data_mgr = DataManager()
+        STARTUP_TIMER.mark("创建主窗口")
+        self.data_mgr = DataManager(write_behind=WRITE_BEHIND_ENABLED)
+        self.batch = BatchCalculator(self.data_mgr)
+        self.result_cache = ResultCache(self.data_mgr)
+        self._metrics_job = None
+        self._diagnostics = None
+        self.query_executor = QueryExecutor(self, self.data_mgr)
+        self._refresh_scheduled = False
+        self._change_job = None
+        STARTUP_TIMER.mark("打开数据库")
         self._create_widgets()
         self._create_menu()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.profile_capture = ProfileCapture(self, self.query_executor, self._show_profile)
+        if METRICS.enabled:
+            self._metrics_job = self.after(METRICS_INTERVAL_MS, self._write_metrics)
+        STARTUP_TIMER.mark("创建界面")
+        self.after_idle(self._startup_done)
+        self._change_job = self.after(CHANGE_POLL_MS, self._poll_changes)
+        if self.data_mgr.migration_pending:
+            self.after(1000, self._migrate_step)
+        elif ARCHIVE_ON_STARTUP:
+            self.after(5000, lambda: self.archive_records(ARCHIVE_RETENTION_DAYS, quiet=True))
+
+    def _migrate_step(self):
+        """后台逐批迁移旧版参数存储，每批之间让出事件循环"""
+        try:
+            if self.data_mgr.migrate_step():
+                self.after(10, self._migrate_step)
+            else:
+                print("DEBUG: 参数存储迁移完成")
+        except sqlite3.Error as e:
+            print(f"ERROR: 参数存储迁移失败：{e}")
+
+    def _startup_done(self):
+        STARTUP_TIMER.mark("首次事件循环空闲")
+        print(STARTUP_TIMER.report())
+
+    def set_metrics_enabled(self, enabled):
+        """运行时开关指标记录，开启期间定期写出指标文件"""
+        METRICS.enabled = enabled
+        if enabled and self._metrics_job is None:
+            self._metrics_job = self.after(METRICS_INTERVAL_MS, self._write_metrics)
+        elif not enabled and self._metrics_job is not None:
+            self.after_cancel(self._metrics_job)
+            self._metrics_job = None
+
+    def _write_metrics(self):
+        try:
+            METRICS.write_file(METRICS_FILE)
+        except OSError as e:
+            print(f"ERROR: 写入指标文件失败：{e}")
+        self._metrics_job = self.after(METRICS_INTERVAL_MS, self._write_metrics)
+
+    def show_diagnostics(self):
+        if self._diagnostics is not None and self._diagnostics.winfo_exists():
+            self._diagnostics.lift()
+            return
+        self._diagnostics = DiagnosticsWindow(self)
+
+    def _show_profile(self, path, report):
+        window = tk.Toplevel(self)
+        window.title(f"操作分析 - {path}")
+        window.geometry("900x500")
+        text = tk.Text(window, wrap="none", font=("Consolas", 9))
+        scrollbar = ttk.Scrollbar(window, orient="vertical", command=text.yview)
+        text.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        text.pack(side="left", fill="both", expand=True)
+        text.insert("1.0", report)
+        text.configure(state="disabled")
+        print(f"DEBUG: 操作分析结果已保存至 {os.path.abspath(path)}")
+
+    def _on_close(self):
+        if METRICS.enabled:
+            try:
+                METRICS.write_file(METRICS_FILE)
+            except OSError as e:
+                print(f"ERROR: 写入指标文件失败：{e}")
+        if self._change_job is not None:
+            self.after_cancel(self._change_job)
+        self.query_executor.shutdown()
+        self.data_mgr.close()
+        self.destroy()
 
     def _create_widgets(self):
+        # 状态栏：后台查询进行时显示忙碌指示
+        status_bar = ttk.Frame(self)
+        status_bar.pack(side="bottom", fill="x")
+        self.status_var = tk.StringVar(value="就绪")
+        ttk.Label(status_bar, textvariable=self.status_var).pack(side="left", padx=5)
+        self.busy_bar = ttk.Progressbar(status_bar, mode="indeterminate", length=120)
+        self.query_executor.add_busy_callback(self._on_busy_changed)
+
         self.notebook = ttk.Notebook(self)
 
-        self.pages = {
-            "sum": CalculationPage(self.notebook, self, "参数求和", 6, self._sum_calculation),
-            "product": CalculationPage(self.notebook, self, "参数求积", 6, self._product_calculation),
-            "final": FinalCalculationPage(self.notebook, self),
-            "history": HistoryPage(self.notebook, self.data_mgr, self.refresh_time_range)
+        # 页面在首次选中时才构建，启动时只创建空容器
+        self._page_factories = {
+            "sum": lambda parent: CalculationPage(parent, self, "参数求和", 6, self._sum_calculation),
+            "product": lambda parent: CalculationPage(parent, self, "参数求积", 6, self._product_calculation),
+            "vector_sum": lambda parent: VectorCalculationPage(parent, self, "向量求和", vector_sum),
+            "vector_product": lambda parent: VectorCalculationPage(parent, self, "向量求积", vector_product,
+                                                                   describe_product),
+            "final": lambda parent: FinalCalculationPage(parent, self),
+            "history": lambda parent: HistoryPage(parent, self.data_mgr, self.refresh_time_range,
+                                                  self.query_executor)
         }
+        self.pages = {}
+        self._page_containers = {}
+
+        for key, text in [("sum", "求和计算"), ("product", "求积计算"), ("vector_sum", "向量求和"),
+                          ("vector_product", "向量求积"), ("final", "综合计算"), ("history", "历史分析")]:
+            container = ttk.Frame(self.notebook)
+            self.notebook.add(container, text=text)
+            self._page_containers[key] = container
 
-        for key, text in [("sum", "求和计算"), ("product", "求积计算"),
-                          ("final", "综合计算"), ("history", "历史分析")]:
-            self.notebook.add(self.pages[key], text=text)
+        # 自定义公式页面排在历史分析之前
+        self._formulas = {}
+        for title, expression in self.data_mgr.get_formulas():
+            try:
+                self._add_formula_page(title, compile_formula(expression))
+            except FormulaError as e:
+                print(f"WARN: 公式页面 {title} 无法加载：{e}")
 
+        self.notebook.bind("<<NotebookTabChanged>>", self._on_tab_changed)
         self.notebook.pack(expand=True, fill="both")
+        self.get_page("sum")
+
+    def _on_busy_changed(self, busy):
+        if busy:
+            self.status_var.set("正在查询...")
+            self.busy_bar.pack(side="right", padx=5, pady=2)
+            self.busy_bar.start(15)
+            self.config(cursor="watch")
+        else:
+            self.status_var.set("就绪")
+            self.busy_bar.stop()
+            self.busy_bar.pack_forget()
+            self.config(cursor="")
+
+    def get_page(self, key):
+        """返回页面，未构建时立即构建"""
+        if key not in self.pages:
+            page = STARTUP_TIMER.measure(f"构建页面 {key}", self._page_factories[key], self._page_containers[key])
+            page.pack(expand=True, fill="both")
+            self.pages[key] = page
+        return self.pages[key]
+
+    def page_titles(self):
+        """所有计算页面的名称，公式中与之同名的变量引用该页面的最新结果"""
+        return {"参数求和", "参数求积", "向量求和", "向量求积", "综合计算"} | set(self._formulas)
+
+    def _add_formula_page(self, title, formula):
+        key = f"formula:{title}"
+        self._formulas[title] = formula
+        self._page_factories[key] = lambda parent: FormulaPage(parent, self, title, formula)
+        container = ttk.Frame(self.notebook)
+        self.notebook.insert(self._page_containers["history"], container, text=title)
+        self._page_containers[key] = container
+        return container
+
+    def new_formula_page(self):
+        title = simpledialog.askstring("新建公式页", "页面名称：", parent=self)
+        if not title or not title.strip():
+            return
+        title = title.strip()
+        if title in self.page_titles():
+            messagebox.showerror("错误", f"页面“{title}”已存在")
+            return
+        expression = simpledialog.askstring(
+            "新建公式页", "公式（变量名与页面同名时引用该页面最新结果）：\n例如 alpha * 参数求和 + beta * 参数求积",
+            parent=self)
+        if not expression:
+            return
+        try:
+            formula = compile_formula(expression)
+        except FormulaError as e:
+            messagebox.showerror("公式错误", str(e))
+            return
+        self.data_mgr.save_formula(title, formula.source)
+        self.notebook.select(self._add_formula_page(title, formula))
+
+    def delete_formula_page(self):
+        selected = self.notebook.select()
+        for key, container in self._page_containers.items():
+            if str(container) == selected and key.startswith("formula:"):
+                title = key.split(":", 1)[1]
+                if not messagebox.askyesno("确认", f"删除公式页“{title}”？已保存的计算记录会保留。"):
+                    return
+                self.data_mgr.delete_formula(title)
+                self.notebook.forget(container)
+                container.destroy()
+                del self._page_containers[key], self._page_factories[key], self._formulas[title]
+                self.pages.pop(key, None)
+                return
+        messagebox.showinfo("提示", "请先切换到要删除的公式页")
+
+    def _on_tab_changed(self, event):
+        selected = self.notebook.select()
+        for key, container in self._page_containers.items():
+            if str(container) == selected:
+                self.get_page(key)
+                break
 
     def _create_menu(self):
         menubar = tk.Menu(self)
         file_menu = tk.Menu(menubar, tearoff=0)
         file_menu.add_command(label="导出CSV", command=lambda: self.export_data('csv'))
         file_menu.add_command(label="导出Excel", command=lambda: self.export_data('excel'))
+        file_menu.add_separator()
+        file_menu.add_command(label="导入CSV/Excel...", command=self.import_data)
         menubar.add_cascade(label="文件", menu=file_menu)
+        tools_menu = tk.Menu(menubar, tearoff=0)
+        tools_menu.add_command(label="新建公式页...", command=self.new_formula_page)
+        tools_menu.add_command(label="删除当前公式页", command=self.delete_formula_page)
+        tools_menu.add_separator()
+        tools_menu.add_command(label="重建汇总表", command=self.rebuild_rollups)
+        tools_menu.add_command(label="归档旧记录...", command=self.ask_archive)
+        tools_menu.add_command(label="压缩数据库...", command=self.compact_database)
+        menubar.add_cascade(label="工具", menu=tools_menu)
+        help_menu = tk.Menu(menubar, tearoff=0)
+        help_menu.add_command(label="启动耗时", command=self.show_startup_report)
+        help_menu.add_command(label="缓存统计", command=self.show_cache_stats)
+        help_menu.add_command(label="诊断", command=self.show_diagnostics)
+        menubar.add_cascade(label="帮助", menu=help_menu)
         self.config(menu=menubar)
 
+    def rebuild_rollups(self):
+        try:
+            self.data_mgr.rebuild_rollups()
+            messagebox.showinfo("成功", "汇总表已重建")
+        except (sqlite3.Error, ImportError) as e:
+            messagebox.showerror("错误", f"重建失败：{str(e)}")
+
+    def ask_archive(self):
+        days = simpledialog.askinteger("归档旧记录", "将多少天以前的记录移入归档？", parent=self,
+                                       initialvalue=ARCHIVE_RETENTION_DAYS, minvalue=1)
+        if days is not None:
+            self.archive_records(days)
+
+    def archive_records(self, retention_days, quiet=False):
+        """在后台线程归档旧记录，完成后分步回收数据库空间（旧库需先压缩一次）"""
+        def run():
+            return self.data_mgr.archive_old_records(retention_days), self.data_mgr.incremental_vacuum
+
+        def done(outcome):
+            count, incremental = outcome
+            print(f"DEBUG: 已归档 {count} 条记录")
+            if count:
+                if incremental:
+                    self.after(10, self._vacuum_step)
+                self.refresh_time_range()
+            if not quiet:
+                message = f"已将 {count} 条记录移入归档目录 {ARCHIVE_DIR}"
+                if count and not incremental:
+                    message += "\n\n数据库为旧版格式，释放的空间需执行一次“工具 → 压缩数据库...”后才能回收。"
+                messagebox.showinfo("归档完成", message)
+
+        def failed(error):
+            message = "归档需要安装 pyarrow" if isinstance(error, ImportError) else f"归档失败：{error}"
+            print(f"ERROR: {message}")
+            if not quiet:
+                messagebox.showerror("错误", message)
+
+        self.query_executor.submit(run, callback=done, error_callback=failed)
+
+    def compact_database(self):
+        """旧库一次性切换为增量回收模式：完整重写数据库文件，由用户确认后在后台执行"""
+        if self.data_mgr.incremental_vacuum:
+            messagebox.showinfo("压缩数据库", "数据库已是增量回收模式，归档释放的空间会自动回收，无需压缩")
+            return
+        size_mb = os.path.getsize(self.data_mgr.db_path) / 2 ** 20
+        if not messagebox.askyesno(
+                "压缩数据库",
+                f"将重写整个数据库文件（约 {size_mb:.0f} MB）并切换为增量回收模式，之后归档释放的空间会自动分步回收。\n\n"
+                "压缩期间无法保存计算结果，数据库较大时可能需要数分钟。是否继续？", parent=self):
+            return
+
+        def done(_):
+            messagebox.showinfo("压缩数据库", "数据库已压缩，之后归档释放的空间会自动回收")
+
+        def failed(error):
+            print(f"ERROR: 压缩数据库失败：{error}")
+            messagebox.showerror("错误", f"压缩数据库失败：{error}")
+
+        self.query_executor.submit(self.data_mgr.enable_incremental_vacuum, callback=done, error_callback=failed)
+
+    def _vacuum_step(self):
+        """每步回收少量空闲页，步骤之间让出事件循环"""
+        try:
+            if self.data_mgr.vacuum_step():
+                self.after(50, self._vacuum_step)
+        except sqlite3.Error as e:
+            print(f"ERROR: 回收数据库空间失败：{e}")
+
+    def import_data(self):
+        """从导出格式的 CSV / Excel 导入历史记录，在后台线程按块写入"""
+        file_path = filedialog.askopenfilename(
+            filetypes=[("CSV/Excel文件", "*.csv *.xlsx"), ("CSV文件", "*.csv"), ("Excel文件", "*.xlsx")])
+        if not file_path:
+            return
+        dedup = messagebox.askyesnocancel(
+            "导入", "是否跳过与已有记录重复的行？\n（页面、结果、参数相同且时间在同一秒内；去重导入较慢）", parent=self)
+        if dedup is None:
+            return
+        print(f"DEBUG: 导入文件 -> {file_path}，去重：{dedup}")
+        ImportProgressDialog(self, BulkImporter(self.data_mgr, file_path, dedup), self.query_executor)
+
+    def show_startup_report(self):
+        messagebox.showinfo("启动耗时", STARTUP_TIMER.report())
+
+    def show_cache_stats(self):
+        messagebox.showinfo("缓存统计", self.result_cache.stats())
+
+    @METRICS.timed("calc_kernel_seconds", kernel="sum")
     def _sum_calculation(self, params):
         return sum(params)
 
+    @METRICS.timed("calc_kernel_seconds", kernel="product")
     def _product_calculation(self, params):
         product = 1
         for num in params:
@@ -136,43 +3219,9 @@ class MainApplication(tk.Tk):
                 print("DEBUG: 用户取消导出")
                 return
 
-            # 获取数据
-            records = self.data_mgr.get_records()
-            print(f"DEBUG: 获取到 {len(records)} 条记录")
-
-            if not records:
-                messagebox.showwarning("警告", "数据库中没有可导出的数据")
-                return
-
-            # 转换数据
-            data = []
-            for r in records:
-                try:
-                    params = json.loads(r[4])
-                    param_str = ", ".join(f"{k}={v}" for k, v in params.items()) if isinstance(params,
-                                                                                               dict) else ", ".join(
-                        map(str, params))
-                    data.append({
-                        '时间戳': r[1],
-                        '页面': r[2],
-                        '结果': r[3],
-                        '参数': param_str
-                    })
-                except json.JSONDecodeError:
-                    print(f"WARN: 参数解析失败，记录ID {r[0]}")
-                    continue
-
-            df = pd.DataFrame(data)
-            print("DEBUG: 数据预览：\n", df.head())
-
-            # 写入文件
-            if format_type == 'csv':
-                df.to_csv(file_path, index=False, encoding='utf-8-sig')
-            else:
-                df.to_excel(file_path, index=False, engine='openpyxl')
-
-            print(f"DEBUG: 文件已保存，大小：{os.path.getsize(file_path)} 字节")
-            messagebox.showinfo("成功", f"数据已保存至：\n{file_path}")
+            # 在后台线程按块流式写入，进度窗口定时刷新
+            exporter = StreamingExporter(self.data_mgr, file_path, format_type)
+            ExportProgressDialog(self, exporter, self.query_executor)
 
         except PermissionError:
             messagebox.showerror("错误", "文件被其他程序占用，请关闭后重试")
@@ -207,16 +3256,33 @@ class MainApplication(tk.Tk):
     #     except Exception as e:
     #         messagebox.showerror("导出失败", f"错误信息：{str(e)}")
 
-    def _parse_params(self, param_json):
-        params = json.loads(param_json)
-        if isinstance(params, dict):
-            return ", ".join(f"{k}={v}" for k, v in params.items())
-        return ", ".join(map(str, params))
+    def _parse_params(self, *param_columns):
+        return format_params(*param_columns)
+
+    def refresh_time_range(self):
+        """保存或删除之后立即检查变更，订阅的界面按变更增量更新"""
+        if self.data_mgr.write_behind:
+            # 写回模式下合并刷新请求，等后台线程提交后再读取，避免界面线程等待磁盘
+            if not self._refresh_scheduled:
+                self._refresh_scheduled = True
+                self.after(WRITE_BEHIND_INTERVAL_MS, self._deferred_refresh)
+            return
+        self._dispatch_changes()
+
+    def _deferred_refresh(self):
+        self._refresh_scheduled = False
+        self._dispatch_changes()
+
+    def _dispatch_changes(self):
+        try:
+            self.data_mgr.poll_changes()
+        except sqlite3.Error as e:
+            print(f"ERROR: 检查数据变更失败：{e}")
 
-    def refresh_time_range(self):
-        """全局刷新时间范围"""
-        if hasattr(self.pages['history'], 'update_time_range'):
-            self.pages['history'].update_time_range()
+    def _poll_changes(self):
+        """定时检查变更，其他进程写入或删除的记录也由此通知各界面"""
+        self._dispatch_changes()
+        self._change_job = self.after(CHANGE_POLL_MS, self._poll_changes)
 
 
 class CalculationPage(ttk.Frame):
@@ -250,11 +3316,12 @@ class CalculationPage(ttk.Frame):
     def _execute(self):
         try:
             params = [float(ent.get()) for ent in self.entries]
-            result = self.calc_func(params)
-            self.result_var.set(f"计算结果：{result:.4f}")
+            result, digest, cached = self.controller.result_cache.get_or_compute(
+                self.page_title, params, self.calc_func)
+            self.result_var.set(f"计算结果：{result:.4f}" + ("（缓存）" if cached else ""))
 
             if self.save_var.get():
-                self.controller.data_mgr.save_record(self.page_title, result, params)
+                self.controller.data_mgr.save_record(self.page_title, result, params, digest)
                 self.controller.refresh_time_range()
         except ValueError:
             messagebox.showerror("输入错误", "请检查所有参数为有效数字")
@@ -263,12 +3330,193 @@ class CalculationPage(ttk.Frame):
         HistoryDialog(self, self.page_title, self.controller.refresh_time_range)
 
 
+class VectorCalculationPage(ttk.Frame):
+    """任意长度向量的计算页面：从剪贴板粘贴或从文件载入，不为每个数值创建输入框"""
+
+    PREVIEW_COUNT = 5
+
+    def __init__(self, parent, controller, title, calc_func, describe_overflow=None):
+        super().__init__(parent)
+        self.controller = controller
+        self.page_title = title
+        self.calc_func = calc_func
+        self.describe_overflow = describe_overflow  # 结果超出 float 范围时给出描述
+        self.values = None
+        self._create_interface()
+
+    def _create_interface(self):
+        input_frame = ttk.Frame(self)
+        input_frame.pack(pady=10)
+        ttk.Button(input_frame, text="从剪贴板粘贴", command=self._paste).pack(side=tk.LEFT, padx=5)
+        ttk.Button(input_frame, text="从文件载入", command=self._load_file).pack(side=tk.LEFT, padx=5)
+        ttk.Button(input_frame, text="清空", command=lambda: self._set_values(None)).pack(side=tk.LEFT, padx=5)
+
+        self.summary_var = tk.StringVar(value="尚未载入数据（数值以空白、逗号或分号分隔）")
+        ttk.Label(self, textvariable=self.summary_var, wraplength=600).pack(pady=5)
+
+        control_frame = ttk.Frame(self)
+        control_frame.pack(pady=10)
+        self.save_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(control_frame, text="自动保存", variable=self.save_var).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="执行计算", command=self._execute).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="历史记录", command=self.show_history).pack(side=tk.LEFT, padx=5)
+
+        self.result_var = tk.StringVar(value="等待计算...")
+        ttk.Label(self, textvariable=self.result_var).pack()
+
+    def _paste(self):
+        try:
+            text = self.clipboard_get()
+        except tk.TclError:
+            messagebox.showwarning("警告", "剪贴板中没有文本")
+            return
+        self._parse(text)
+
+    def _load_file(self):
+        file_path = filedialog.askopenfilename(filetypes=[("文本文件", "*.txt *.csv"), ("所有文件", "*.*")])
+        if not file_path:
+            return
+        try:
+            with open(file_path, encoding='utf-8-sig') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror("错误", f"读取文件失败：{str(e)}")
+            return
+        self._parse(text)
+
+    def _parse(self, text):
+        # 大量数值的解析放到后台线程
+        self.summary_var.set("正在解析...")
+        self.controller.query_executor.submit(parse_vector, text, callback=self._set_values,
+                                              error_callback=self._parse_failed)
+
+    def _parse_failed(self, error):
+        self.summary_var.set("解析失败")
+        messagebox.showerror("输入错误", str(error))
+
+    def _set_values(self, values):
+        self.values = values
+        if values is None:
+            self.summary_var.set("尚未载入数据（数值以空白、逗号或分号分隔）")
+            return
+        preview = ", ".join(f"{v:g}" for v in values[:self.PREVIEW_COUNT])
+        if len(values) > self.PREVIEW_COUNT:
+            preview += f", …, {values[-1]:g}"
+        self.summary_var.set(f"已载入 {len(values)} 个数值：{preview}")
+
+    def _execute(self):
+        if self.values is None:
+            messagebox.showwarning("警告", "请先粘贴或载入数据")
+            return
+        result, digest, cached = self.controller.result_cache.get_or_compute(
+            self.page_title, self.values, self.calc_func)
+        if math.isnan(result):
+            messagebox.showerror("计算错误", "数据中包含非数值（NaN）")
+            return
+        text = f"计算结果：{result:.10g}"
+        if self.describe_overflow is not None and (math.isinf(result) or result == 0):
+            text += f"（精确数量级：{self.describe_overflow(self.values)}）"
+        self.result_var.set(text + ("（缓存）" if cached else ""))
+
+        if self.save_var.get():
+            self.controller.data_mgr.save_record(self.page_title, result, self.values, digest)
+            self.controller.refresh_time_range()
+
+    def show_history(self):
+        HistoryDialog(self, self.page_title, self.controller.refresh_time_range)
+
+
+class LatestResults:
+    """若干页面的最新结果，供引用前序结果的页面在 Tk 线程直接读取
+
+    由变更订阅维护：新记录直接比较，删除的恰是当前结果时才重新查询；查询都在后台线程执行。
+    """
+
+    def __init__(self, controller, pages, on_change=None):
+        self.data_mgr = controller.data_mgr
+        self.executor = controller.query_executor
+        self.pages = tuple(pages)
+        self.on_change = on_change
+        self.loaded = not self.pages
+        self._latest = dict.fromkeys(self.pages)  # 页面 -> (时间戳, ID, 结果)
+        self.data_mgr.subscribe(self._on_changes)
+        self._reload(self.pages, initial=True)
+
+    def get(self, page_name):
+        """页面的最新结果，没有记录时返回 None
+
+        写回模式下刚保存、尚未提交的记录也计入。先查缓冲再检查变更：此时已不在缓冲中的记录一定已提交，
+        这次检查即可读到，不会漏掉刚保存的结果。
+        """
+        pending = self.data_mgr.pending_result(page_name)
+        try:
+            self.data_mgr.poll_changes()
+        except sqlite3.Error as e:
+            print(f"ERROR: 检查数据变更失败：{e}")
+        latest = self._latest.get(page_name)
+        if pending is not None and (latest is None or pending[0] >= latest[0]):
+            return pending[1]
+        return None if latest is None else latest[2]
+
+    def close(self):
+        self.data_mgr.unsubscribe(self._on_changes)
+
+    def _reload(self, pages, initial=False):
+        if pages:
+            self.executor.submit(self._query, pages, callback=functools.partial(self._loaded, initial=initial))
+
+    def _query(self, pages):
+        """工作线程：逐个页面读取最新一条记录"""
+        latest = {}
+        for page_name in pages:
+            records = self.data_mgr.get_records(page_filter=page_name, limit=1)
+            latest[page_name] = (records[0][1], records[0][0], records[0][3]) if records else None
+        return latest
+
+    def _loaded(self, latest, initial=False):
+        # 查询期间到达的新记录可能比查询结果更新，取两者中较新的
+        for page_name, record in latest.items():
+            current = self._latest[page_name]
+            if current is None or (record is not None and record[:2] > current[:2]):
+                self._latest[page_name] = record
+        if initial:
+            self.loaded = True
+        if self.on_change is not None:
+            self.on_change()
+
+    def _on_changes(self, inserted, deleted, reset):
+        stale = set(self.pages) if reset else set()
+        for record_id, page_name, _ in deleted:
+            latest = self._latest.get(page_name)
+            if latest is not None and latest[1] == record_id:
+                stale.add(page_name)
+        for page_name in stale:
+            self._latest[page_name] = None
+        changed = bool(stale)
+        for r in inserted:
+            if r[2] in self._latest:
+                latest = self._latest[r[2]]
+                if latest is None or (r[1], r[0]) > latest[:2]:
+                    self._latest[r[2]] = (r[1], r[0], r[3])
+                    changed = True
+        self._reload(tuple(stale))
+        if changed and self.on_change is not None:
+            self.on_change()
+
+
 class FinalCalculationPage(ttk.Frame):
+    INPUT_PAGES = ("参数求和", "参数求积")
+
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
         self._create_interface()
 
+        # 前序结果随变更订阅更新，计算时与界面显示同源
+        self.latest = LatestResults(controller, self.INPUT_PAGES, on_change=self._show_inputs)
+        self._show_inputs()
+        self.bind("<Destroy>", self._on_destroy)
+
     def _create_interface(self):
         input_frame = ttk.Frame(self)
         input_frame.pack(pady=10)
@@ -287,27 +3535,56 @@ class FinalCalculationPage(ttk.Frame):
         ttk.Checkbutton(control_frame, text="自动保存", variable=self.save_var).pack(side=tk.LEFT, padx=5)
         ttk.Button(control_frame, text="计算", command=self._execute).pack(side=tk.LEFT, padx=5)
         ttk.Button(control_frame, text="历史", command=self.show_history).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="参数扫描...", command=lambda: SweepDialog(self, self.controller)).pack(
+            side=tk.LEFT, padx=5)
 
         self.result_var = tk.StringVar(value="等待计算...")
         ttk.Label(self, textvariable=self.result_var).pack()
+        self.inputs_var = tk.StringVar()
+        ttk.Label(self, textvariable=self.inputs_var, foreground="gray").pack(pady=5)
+
+    def _show_inputs(self):
+        if not self.latest.loaded:
+            self.inputs_var.set("正在读取前序结果...")
+            return
+        texts = []
+        for page_name in self.INPUT_PAGES:
+            value = self.latest.get(page_name)
+            texts.append(f"{page_name[2:]} {'—' if value is None else f'{value:.4f}'}")
+        self.inputs_var.set("当前前序结果：" + "，".join(texts))
+
+    def _on_destroy(self, event):
+        if event.widget is self:
+            self.latest.close()
+
+    def set_weights(self, alpha, beta):
+        """填入权重系数（参数扫描的最优值）"""
+        for entry, value in ((self.alpha_ent, alpha), (self.beta_ent, beta)):
+            entry.delete(0, tk.END)
+            entry.insert(0, f"{value:.6g}")
 
     def _execute(self):
         try:
             alpha = float(self.alpha_ent.get())
             beta = float(self.beta_ent.get())
 
-            sum_data = self.controller.data_mgr.get_records(page_filter="参数求和", limit=1)
-            product_data = self.controller.data_mgr.get_records(page_filter="参数求积", limit=1)
-
-            if not sum_data or not product_data:
+            # 与界面显示的前序结果同源，由变更订阅保持最新，无需在 Tk 线程查询
+            if not self.latest.loaded:
+                messagebox.showwarning("警告", "正在读取前序结果，请稍候")
+                return
+            sum_value, product_value = (self.latest.get(page_name) for page_name in self.INPUT_PAGES)
+            if sum_value is None or product_value is None:
                 messagebox.showwarning("警告", "请先完成前序计算")
                 return
 
-            result = (alpha * sum_data[0][3]) + (beta * product_data[0][3])
-            self.result_var.set(f"综合结果：{result:.4f}")
+            # 缓存键包含当前的求和、求积结果，前序结果变化后不会误用旧值
+            inputs = {"alpha": alpha, "beta": beta, "sum": sum_value, "product": product_value}
+            result, digest, cached = self.controller.result_cache.get_or_compute(
+                "综合计算", inputs, lambda p: (p["alpha"] * p["sum"]) + (p["beta"] * p["product"]))
+            self.result_var.set(f"综合结果：{result:.4f}" + ("（缓存）" if cached else ""))
 
             if self.save_var.get():
-                self.controller.data_mgr.save_record("综合计算", result, {"alpha": alpha, "beta": beta})
+                self.controller.data_mgr.save_record("综合计算", result, {"alpha": alpha, "beta": beta}, digest)
                 self.controller.refresh_time_range()
         except ValueError:
             messagebox.showerror("输入错误", "请输入有效数值")
@@ -316,69 +3593,479 @@ class FinalCalculationPage(ttk.Frame):
         HistoryDialog(self, "综合计算", self.controller.refresh_time_range)
 
 
+class SweepDialog(tk.Toplevel):
+    """α/β 参数扫描：在最近的求和、求积结果上评估整个网格，显示热力图和最优组合
+
+    扫描只保存一条汇总记录（最优目标值和扫描设置），不逐点保存。
+    """
+
+    MAX_STEPS = 2000
+
+    def __init__(self, page, controller):
+        super().__init__(page)
+        self.title("参数扫描")
+        self.page = page
+        self.controller = controller
+        self.best = None
+        self._create_interface()
+
+    def _create_interface(self):
+        form = ttk.Frame(self)
+        form.pack(padx=10, pady=10)
+        self.entries = {}
+        for row, (name, defaults) in enumerate([("α", ("0", "1", "51")), ("β", ("0", "1", "51"))]):
+            for col, (label, default) in enumerate(zip(("起始", "结束", "步数"), defaults)):
+                ttk.Label(form, text=f"{name} {label}:").grid(row=row, column=col * 2, padx=5, pady=3)
+                entry = ttk.Entry(form, width=10)
+                entry.insert(0, default)
+                entry.grid(row=row, column=col * 2 + 1, padx=5, pady=3)
+                self.entries[name, label] = entry
+
+        ttk.Label(form, text="样本数:").grid(row=2, column=0, padx=5, pady=3)
+        self.samples_ent = ttk.Entry(form, width=10)
+        self.samples_ent.insert(0, "1000")
+        self.samples_ent.grid(row=2, column=1, padx=5, pady=3)
+        ttk.Label(form, text="目标:").grid(row=2, column=2, padx=5, pady=3)
+        self.objective_combo = ttk.Combobox(form, width=16, state="readonly", values=list(SWEEP_OBJECTIVES))
+        self.objective_combo.current(0)
+        self.objective_combo.grid(row=2, column=3, padx=5, pady=3)
+        ttk.Label(form, text="目标值:").grid(row=2, column=4, padx=5, pady=3)
+        self.target_ent = ttk.Entry(form, width=10)
+        self.target_ent.insert(0, "0")
+        self.target_ent.grid(row=2, column=5, padx=5, pady=3)
+
+        control_frame = ttk.Frame(self)
+        control_frame.pack(pady=5)
+        self.save_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(control_frame, text="保存汇总记录", variable=self.save_var).pack(side=tk.LEFT, padx=5)
+        self.run_btn = ttk.Button(control_frame, text="开始扫描", command=self._run)
+        self.run_btn.pack(side=tk.LEFT, padx=5)
+        self.apply_btn = ttk.Button(control_frame, text="应用最优值", command=self._apply, state=tk.DISABLED)
+        self.apply_btn.pack(side=tk.LEFT, padx=5)
+
+        self.status_var = tk.StringVar(value="样本为最近 N 条求和与求积结果，按时间顺序配对")
+        ttk.Label(self, textvariable=self.status_var).pack(pady=5)
+
+        Figure, FigureCanvasTkAgg = load_matplotlib()
+        self.figure = Figure(figsize=(6, 4.5), dpi=100)
+        self.canvas = FigureCanvasTkAgg(self.figure, self)
+        self.canvas.get_tk_widget().pack(expand=True, fill=tk.BOTH)
+
+    def _read_settings(self):
+        """读取并校验扫描设置，有误时抛出带提示信息的 ValueError"""
+        try:
+            settings = {name: (float(self.entries[name, "起始"].get()), float(self.entries[name, "结束"].get()),
+                               int(self.entries[name, "步数"].get())) for name in ("α", "β")}
+            samples = int(self.samples_ent.get())
+            target = float(self.target_ent.get())
+        except ValueError:
+            raise ValueError("请输入有效数值") from None
+        for name, (_, _, steps) in settings.items():
+            if not 1 <= steps <= self.MAX_STEPS:
+                raise ValueError(f"{name} 步数应在 1 到 {self.MAX_STEPS} 之间")
+        if samples < 1:
+            raise ValueError("样本数应为正整数")
+        return settings, samples, self.objective_combo.get(), target
+
+    def _run(self):
+        try:
+            settings, samples, objective, target = self._read_settings()
+        except ValueError as e:
+            messagebox.showerror("输入错误", str(e), parent=self)
+            return
+        self.run_btn.config(state=tk.DISABLED)
+        self.status_var.set("正在扫描...")
+        self.controller.query_executor.submit(self._compute, settings, samples, objective, target,
+                                              callback=self._show, error_callback=self._failed)
+
+    def _compute(self, settings, samples, objective, target):
+        """工作线程：读取样本并计算目标值网格"""
+        data_mgr = self.controller.data_mgr
+        sums = data_mgr.get_result_array("参数求和", samples)
+        products = data_mgr.get_result_array("参数求积", samples)
+        count = min(len(sums), len(products))
+        if not count:
+            raise ValueError("请先完成求和与求积计算")
+        sums, products = sums[len(sums) - count:], products[len(products) - count:]
+        alphas = np.linspace(*settings["α"])
+        betas = np.linspace(*settings["β"])
+        start = time.perf_counter()
+        scores = self.controller.batch.sweep(sums, products, alphas, betas, objective, target)
+        return settings, objective, target, count, alphas, betas, scores, time.perf_counter() - start
+
+    def _failed(self, error):
+        self.run_btn.config(state=tk.NORMAL)
+        self.status_var.set("扫描失败")
+        messagebox.showerror("错误", str(error), parent=self)
+
+    def _show(self, outcome):
+        settings, objective, target, count, alphas, betas, scores, elapsed = outcome
+        self.run_btn.config(state=tk.NORMAL)
+        best = self.controller.batch.best_point(scores, objective)
+        self._draw(alphas, betas, scores, best, objective)
+        if best is None:
+            self.status_var.set("所有网格点的结果均无效")
+            return
+        i, j = best
+        self.best = (float(alphas[i]), float(betas[j]))
+        score = float(scores[i, j])
+        self.apply_btn.config(state=tk.NORMAL)
+        self.status_var.set(f"{scores.size} 个网格点 × {count} 个样本，用时 {elapsed:.2f} 秒；"
+                            f"最优 α={self.best[0]:.6g}，β={self.best[1]:.6g}，{objective}={score:.6g}")
+
+        if self.save_var.get() and math.isfinite(score):
+            summary = {"objective": objective, "target": target, "samples": count,
+                       "alpha_range": list(settings["α"]), "beta_range": list(settings["β"]),
+                       "best_alpha": self.best[0], "best_beta": self.best[1]}
+            self.controller.data_mgr.save_record("参数扫描", score, summary)
+            self.controller.refresh_time_range()
+
+    def _draw(self, alphas, betas, scores, best, objective):
+        self.figure.clear()
+        ax = self.figure.add_subplot(111)
+        image = ax.imshow(scores, origin='lower', aspect='auto', interpolation='nearest',
+                          extent=(betas[0], betas[-1], alphas[0], alphas[-1]))
+        self.figure.colorbar(image, ax=ax, label=objective)
+        if best is not None:
+            ax.plot(betas[best[1]], alphas[best[0]], marker='*', color='red', markersize=12)
+        ax.set_xlabel("β")
+        ax.set_ylabel("α")
+        self.figure.tight_layout()
+        self.canvas.draw_idle()
+
+    def _apply(self):
+        if self.best is not None:
+            self.page.set_weights(*self.best)
+
+
+class FormulaPage(ttk.Frame):
+    """自定义公式页面：与页面同名的变量取该页面的最新结果，其余变量各有一个输入框"""
+
+    def __init__(self, parent, controller, title, formula):
+        super().__init__(parent)
+        self.controller = controller
+        self.page_title = title
+        self.formula = formula
+        self._create_interface()
+        # 引用页面的最新结果由变更订阅维护，计算时不在 Tk 线程查询
+        self.latest = LatestResults(controller, self.references)
+        self.bind("<Destroy>", self._on_destroy)
+
+    def _on_destroy(self, event):
+        if event.widget is self:
+            self.latest.close()
+
+    def _create_interface(self):
+        page_titles = self.controller.page_titles()
+        self.references = [name for name in self.formula.variables if name in page_titles]
+        inputs = [name for name in self.formula.variables if name not in page_titles]
+
+        ttk.Label(self, text=f"公式：{self.formula.source}").grid(row=0, column=0, columnspan=4, pady=5)
+        self.entries = {}
+        for i, name in enumerate(inputs):
+            row = i // 2 + 1
+            col = (i % 2) * 2
+            ttk.Label(self, text=f"{name}:").grid(row=row, column=col, padx=5, pady=5)
+            entry = ttk.Entry(self)
+            entry.grid(row=row, column=col + 1, padx=5, pady=5)
+            self.entries[name] = entry
+
+        row = (len(inputs) + 1) // 2 + 1
+        if self.references:
+            ttk.Label(self, text="引用最新结果：" + "、".join(self.references)).grid(
+                row=row, column=0, columnspan=4)
+            row += 1
+
+        control_frame = ttk.Frame(self)
+        control_frame.grid(row=row, column=0, columnspan=4, pady=10)
+        self.save_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(control_frame, text="自动保存", variable=self.save_var).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="执行计算", command=self._execute).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="历史记录", command=self.show_history).pack(side=tk.LEFT, padx=5)
+
+        self.result_var = tk.StringVar(value="等待计算...")
+        ttk.Label(self, textvariable=self.result_var).grid(row=row + 1, column=0, columnspan=4)
+
+    def _execute(self):
+        try:
+            values = {name: float(entry.get()) for name, entry in self.entries.items()}
+        except ValueError:
+            messagebox.showerror("输入错误", "请检查所有参数为有效数字")
+            return
+        if not self.latest.loaded:
+            messagebox.showwarning("警告", "正在读取引用的结果，请稍候")
+            return
+        for name in self.references:
+            value = self.latest.get(name)
+            if value is None:
+                messagebox.showwarning("警告", f"请先完成“{name}”计算")
+                return
+            values[name] = value
+
+        try:
+            # 缓存键包含公式指纹和引用的结果，公式或前序结果变化后不会误用旧值
+            result, digest, cached = self.controller.result_cache.get_or_compute(
+                self.page_title, values, self.formula.evaluate, version=self.formula.fingerprint)
+        except FormulaError as e:
+            messagebox.showerror("计算错误", str(e))
+            return
+        self.result_var.set(f"计算结果：{result:.4f}" + ("（缓存）" if cached else ""))
+
+        if self.save_var.get():
+            self.controller.data_mgr.save_record(self.page_title, result, values, digest)
+            self.controller.refresh_time_range()
+
+    def show_history(self):
+        HistoryDialog(self, self.page_title, self.controller.refresh_time_range)
+
+
 class HistoryPage(ttk.Frame):
-    def __init__(self, parent, data_mgr, refresh_callback):
+    MARKER_MAX_POINTS = 200  # 点数较少时才绘制标记点
+    LIVE_INTERVAL_MS = 250   # 实时模式重绘频率上限：期间由变更订阅送来的新记录合并为一次重绘
+    LIVE_MAX_FACTOR = 8      # 实时曲线点数超过绘图宽度的该倍数时重新降采样
+    # 快速选择：(名称, 从最新记录往前的秒数)，None 表示全部记录
+    QUICK_RANGES = (
+        ("全部", None),
+        ("最近1小时", 3600),
+        ("最近24小时", 86400),
+        ("最近7天", 7 * 86400),
+        ("最近30天", 30 * 86400),
+    )
+    # 统计摘要面板的列：(字段, 列标题)
+    SUMMARY_COLUMNS = (
+        ('count', "条数"), ('mean', "均值"), ('std', "标准差"), ('min', "最小"), ('p5', "P5"), ('p50', "中位数"),
+        ('p95', "P95"), ('max', "最大"), ('first', "首值"), ('last', "末值"), ('change', "变化"),
+        ('mean_abs_delta', "平均|Δ|"), ('max_abs_delta', "最大|Δ|"),
+    )
+
+    def __init__(self, parent, data_mgr, refresh_callback, executor):
         super().__init__(parent)
         self.data_mgr = data_mgr
         self.refresh_callback = refresh_callback
+        self.executor = executor
+        self._chart_key = f"history-chart-{id(self)}"
+        self._live_lines = {}
+        self._live_last_id = None  # 实时基线截止的记录 id，基线加载中为 None
+        self._live_pending = []    # 待追加的新记录 (页面, 时间戳, id, 结果)
+        self._live_job = None
+        self._bounds = (None, None)
         self._create_interface()
         self.update_time_range()
+        data_mgr.subscribe(self._on_changes)
+        self.bind("<Destroy>", self._on_destroy)
 
     def _create_interface(self):
         # 时间选择组件
         time_frame = ttk.Frame(self)
         time_frame.pack(pady=10, fill=tk.X)
 
+        # 起止时间可直接输入，下拉列表只提供有记录的日期
         ttk.Label(time_frame, text="起始时间:").grid(row=0, column=0, padx=5)
-        self.start_combo = ttk.Combobox(time_frame, width=20, state="readonly")
+        self.start_combo = ttk.Combobox(time_frame, width=20)
         self.start_combo.grid(row=0, column=1, padx=5)
 
         ttk.Label(time_frame, text="结束时间:").grid(row=0, column=2, padx=5)
-        self.end_combo = ttk.Combobox(time_frame, width=20, state="readonly")
+        self.end_combo = ttk.Combobox(time_frame, width=20)
         self.end_combo.grid(row=0, column=3, padx=5)
 
-        ttk.Button(time_frame, text="筛选", command=self._update_chart).grid(row=0, column=4, padx=10)
-        ttk.Button(time_frame, text="刷新", command=self.update_time_range).grid(row=0, column=5, padx=5)
+        ttk.Label(time_frame, text="快速选择:").grid(row=0, column=4, padx=5)
+        self.quick_combo = ttk.Combobox(time_frame, width=10, state="readonly",
+                                        values=[name for name, _ in self.QUICK_RANGES])
+        self.quick_combo.grid(row=0, column=5, padx=5)
+        self.quick_combo.bind("<<ComboboxSelected>>", self._apply_quick_range)
+
+        ttk.Button(time_frame, text="筛选", command=self._update_chart).grid(row=0, column=6, padx=10)
+        ttk.Button(time_frame, text="刷新", command=self.update_time_range).grid(row=0, column=7, padx=5)
+        self.live_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(time_frame, text="实时", variable=self.live_var,
+                        command=self._toggle_live).grid(row=0, column=8, padx=5)
+
+        # 分析选项：滑动均值 / ±1σ 带叠加在曲线上，统计摘要显示在图表下方，均由数据库计算
+        analysis_frame = ttk.Frame(self)
+        analysis_frame.pack(fill=tk.X, padx=5)
+        self.rolling_mean_var = tk.BooleanVar(value=False)
+        self.rolling_band_var = tk.BooleanVar(value=False)
+        self.summary_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(analysis_frame, text="滑动均值", variable=self.rolling_mean_var,
+                        command=self._update_chart).pack(side="left", padx=5)
+        ttk.Checkbutton(analysis_frame, text="±1σ 带", variable=self.rolling_band_var,
+                        command=self._update_chart).pack(side="left", padx=5)
+        ttk.Label(analysis_frame, text="窗口(条):").pack(side="left", padx=(10, 2))
+        self.window_var = tk.StringVar(value=str(ROLLING_WINDOW))
+        ttk.Spinbox(analysis_frame, from_=2, to=100000, textvariable=self.window_var, width=7).pack(side="left")
+        ttk.Checkbutton(analysis_frame, text="统计摘要", variable=self.summary_var,
+                        command=self._toggle_summary).pack(side="left", padx=15)
 
         # 图表区域
-        self.figure = plt.Figure(figsize=(10, 5), dpi=100)
+        Figure, FigureCanvasTkAgg = load_matplotlib()
+        self.figure = Figure(figsize=(10, 5), dpi=100)
         self.ax = self.figure.add_subplot(111)
         self.canvas = FigureCanvasTkAgg(self.figure, self)
         self.canvas.get_tk_widget().pack(expand=True, fill=tk.BOTH)
 
+        columns = ("页面",) + tuple(title for _, title in self.SUMMARY_COLUMNS)
+        self.summary_tree = ttk.Treeview(self, columns=columns, show="headings", height=4)
+        for col in columns:
+            self.summary_tree.heading(col, text=col)
+            self.summary_tree.column(col, width=90 if col == "页面" else 70, anchor="w" if col == "页面" else "e")
+
     def update_time_range(self):
-        """更新时间选择范围"""
-        timestamps = self.data_mgr.get_available_timestamps()
-        if timestamps:
-            self.start_combo['values'] = timestamps
-            self.end_combo['values'] = timestamps
-            self.start_combo.set(timestamps[0])
-            self.end_combo.set(timestamps[-1])
+        """重置时间选择范围：起止时间取 MIN/MAX，下拉日期取自按天汇总表，均与记录总数无关"""
+        days = [datetime.fromtimestamp(day // 1_000_000).strftime("%Y-%m-%d")
+                for day in self.data_mgr.get_record_days()]
+        self.start_combo['values'] = days
+        self.end_combo['values'] = days
+        self._bounds = self.data_mgr.get_time_bounds()
+        low, high = self._bounds
+        self.start_combo.set(format_timestamp(low) if low is not None else "")
+        self.end_combo.set(format_timestamp(high) if high is not None else "")
+
+    def extend_time_range(self, bounds=None, stamps=()):
+        """增量更新起止时间：起止时间原本指向边界记录时随之移动，stamps 所在的日期加入下拉列表
+
+        bounds 为空时读取 MIN/MAX（O(log n)），stamps 为空时只加入最新记录的日期。
+        """
+        old_low, old_high = self._bounds
+        low, high = self._bounds = bounds if bounds is not None else self.data_mgr.get_time_bounds()
+        if high is None:
+            return
+        if old_high is None or self.end_combo.get() in ("", format_timestamp(old_high)):
+            self.end_combo.set(format_timestamp(high))
+        if old_low is None or self.start_combo.get() in ("", format_timestamp(old_low)):
+            self.start_combo.set(format_timestamp(low))
+
+        days = list(self.start_combo['values'])
+        new_days = {datetime.fromtimestamp(us // 1_000_000).strftime("%Y-%m-%d") for us in (stamps or [high])}
+        new_days -= set(days)
+        if new_days:
+            days = sorted(days + list(new_days))
+            self.start_combo['values'] = days
+            self.end_combo['values'] = days
+
+    def _on_changes(self, inserted, deleted, reset):
+        """变更订阅：新记录直接扩展起止范围；删除的恰是边界记录时才重新读取 MIN/MAX"""
+        if reset:
+            self.update_time_range()
+            if self.live_var.get():
+                self._draw_live_base()
+            return
+        if self.live_var.get():
+            self._queue_live(inserted)
+        low, high = self._bounds
+        if any(timestamp in (low, high) for _, _, timestamp in deleted):
+            low, high = self.data_mgr.get_time_bounds()
+        stamps = [r[1] for r in inserted]
+        if stamps:
+            low = min(stamps) if low is None else min(low, min(stamps))
+            high = max(stamps) if high is None else max(high, max(stamps))
+        if (low, high) != self._bounds or stamps:
+            self.extend_time_range((low, high), stamps)
+
+    def _on_destroy(self, event):
+        if event.widget is self:
+            self.data_mgr.unsubscribe(self._on_changes)
+
+    def _apply_quick_range(self, event=None):
+        span = dict(self.QUICK_RANGES)[self.quick_combo.get()]
+        low, high = self._bounds = self.data_mgr.get_time_bounds()
+        if high is None:
+            return
+        if span is not None:
+            low = max(low, high - span * 1_000_000)
+        self.start_combo.set(format_timestamp(low))
+        self.end_combo.set(format_timestamp(high))
+        self._update_chart()
+
+    def _time_range(self):
+        """读取并校验输入的起止时间，格式有误时提示并返回 None"""
+        start_time, end_time = self.start_combo.get().strip(), self.end_combo.get().strip()
+        try:
+            to_epoch_us(start_time)
+            to_epoch_us(end_time, end=True)
+        except ValueError:
+            messagebox.showerror("输入错误", "时间格式应为 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS")
+            return None
+        return start_time, end_time
+
+    def _toggle_summary(self):
+        if self.summary_var.get():
+            self.summary_tree.pack(side=tk.BOTTOM, fill=tk.X, before=self.canvas.get_tk_widget())
+            self._update_chart()
         else:
-            self.start_combo.set("")
-            self.end_combo.set("")
+            self.summary_tree.pack_forget()
+
+    def _rolling_window(self):
+        """读取滑动窗口条数，未勾选叠加项时返回 None"""
+        if not (self.rolling_mean_var.get() or self.rolling_band_var.get()):
+            return None
+        try:
+            return max(int(self.window_var.get()), 2)
+        except ValueError:
+            self.window_var.set(str(ROLLING_WINDOW))
+            return ROLLING_WINDOW
 
     def _update_chart(self):
+        if self.live_var.get():
+            self._draw_live_base()
+            return
+        time_range = self._time_range()
+        if time_range is None:
+            return
+        # 查询和降采样在后台线程进行，重复点击时作废尚未完成的旧查询
+        buckets = self._plot_width_pixels()
+        self.executor.submit(self._load_chart_data, *time_range, buckets, self._rolling_window(),
+                             self.summary_var.get(),
+                             callback=self._draw_chart, error_callback=self._chart_error, key=self._chart_key)
+
+    @METRICS.timed("calc_chart_seconds", stage="prepare")
+    def _load_chart_data(self, start_time, end_time, buckets, window=None, summary=False):
+        """工作线程：读取图表数据，返回 (汇总粒度, 序列, 滑动统计序列, 统计摘要)"""
+        # 滑动统计与摘要在数据库内计算，只取回绘图所需的点和每页一行摘要
+        overlays = self.data_mgr.get_rolling_series(start_time, end_time, window, buckets) if window else []
+        stats = self.data_mgr.get_summary_stats(start_time, end_time) if summary else None
+        # 时间跨度大到每像素超过一分钟时直接读汇总表，画均值线和最小/最大值带
+        granularity = self.data_mgr.choose_rollup(start_time, end_time, buckets)
+        if granularity:
+            return granularity, self.data_mgr.get_rollup_series(granularity, start_time, end_time), overlays, stats
+        # 降采样到绘图区宽度，绘制开销只与屏幕分辨率有关
+        series = [(name,) + minmax_downsample(x, y, buckets)
+                  for name, x, y in self.data_mgr.get_series(start_time, end_time)]
+        return None, series, overlays, stats
+
+    def _chart_error(self, error):
+        messagebox.showerror("错误", f"图表生成失败：{str(error)}")
+
+    @METRICS.timed("calc_chart_seconds", stage="render")
+    def _draw_chart(self, data):
+        granularity, series, overlays, stats = data
         self.ax.clear()
+        if stats is not None:
+            self._show_summary(stats)
         try:
-            start_time = self.start_combo.get()
-            end_time = self.end_combo.get()
-
-            records = self.data_mgr.get_records(start_time, end_time)
-            if not records:
+            if not series:
+                self.canvas.draw_idle()
                 messagebox.showinfo("提示", "选定时间段无数据")
                 return
 
-            data = {}
-            for r in records:
-                key = r[2]
-                if key not in data:
-                    data[key] = {'x': [], 'y': []}
-                data[key]['x'].append(datetime.strptime(r[1], "%Y-%m-%d %H:%M:%S"))
-                data[key]['y'].append(r[3])
+            colors = {}
+            if granularity:
+                for name, x, mean, low, high in series:
+                    line, = self.ax.plot(x, mean, linestyle='-', label=name)
+                    self.ax.fill_between(x, low, high, color=line.get_color(), alpha=0.2, linewidth=0)
+                    colors[name] = line.get_color()
+            else:
+                for name, x, y in series:
+                    marker = 'o' if len(x) <= self.MARKER_MAX_POINTS else None
+                    line, = self.ax.plot(x, y, marker=marker, linestyle='-', label=name)
+                    colors[name] = line.get_color()
 
-            for name, values in data.items():
-                self.ax.plot(values['x'], values['y'], marker='o', linestyle='-', label=name)
+            # 滑动统计与所属页面同色：均值画虚线，±1σ 画浅色带
+            for name, x, mean, std in overlays:
+                color = colors.get(name)
+                if self.rolling_mean_var.get():
+                    self.ax.plot(x, mean, linestyle='--', linewidth=1.5, color=color, label=f"{name} 滑动均值")
+                if self.rolling_band_var.get():
+                    self.ax.fill_between(x, mean - std, mean + std, color=color, alpha=0.15, linewidth=0)
 
             self.ax.set_title("历史数据趋势分析", fontsize=14)
             self.ax.set_xlabel("时间", fontsize=12)
@@ -389,75 +4076,507 @@ class HistoryPage(ttk.Frame):
         except Exception as e:
             messagebox.showerror("错误", f"图表生成失败：{str(e)}")
 
+    def _show_summary(self, stats):
+        self.summary_tree.delete(*self.summary_tree.get_children())
+        for name, values in stats.items():
+            cells = []
+            for key, _ in self.SUMMARY_COLUMNS:
+                value = values.get(key)
+                cells.append("" if value is None else str(value) if key == 'count' else f"{value:.4g}")
+            self.summary_tree.insert("", "end", values=[name] + cells)
+
+    def _toggle_live(self):
+        if self.live_var.get():
+            self._draw_live_base()
+            return
+        self.executor.cancel(self._chart_key)
+        if self._live_job is not None:
+            self.after_cancel(self._live_job)
+            self._live_job = None
+        self._live_pending = []
+
+    def _draw_live_base(self):
+        """实时模式：从起始时间绘制到最新记录，保留曲线对象供后续追加"""
+        if self._live_job is not None:
+            self.after_cancel(self._live_job)
+            self._live_job = None
+        # 基线读取之前已提交的记录都包含在基线内，之后的由变更订阅送来
+        self._live_last_id = None
+        self._live_pending = []
+        time_range = self._time_range()
+        if time_range is None:
+            self.live_var.set(False)
+            return
+        self.executor.submit(self._load_live_base, time_range[0], self._plot_width_pixels(),
+                             callback=self._draw_live_lines, error_callback=self._chart_error, key=self._chart_key)
+
+    @METRICS.timed("calc_chart_seconds", stage="live_prepare")
+    def _load_live_base(self, start_time, buckets):
+        """工作线程：先取最大 id 再按 id 截止读取，之后的记录全部由变更订阅追加，不重不漏"""
+        last_id = self.data_mgr.max_record_id()
+        series = self.data_mgr.get_series(start_time, None, until_id=last_id)
+        return last_id, [(name,) + minmax_downsample(x, y, buckets) for name, x, y in series]
+
+    @METRICS.timed("calc_chart_seconds", stage="live_render")
+    def _draw_live_lines(self, data):
+        if not self.live_var.get():
+            return
+        self._live_last_id, series = data
+        self.ax.clear()
+        self._live_lines = {}
+        try:
+            for name, x, y in series:
+                self._add_live_line(name, x, y)
+
+            self.ax.set_title("历史数据趋势分析（实时）", fontsize=14)
+            self.ax.set_xlabel("时间", fontsize=12)
+            self.ax.set_ylabel("结果值", fontsize=12)
+            if self._live_lines:
+                self.ax.legend()
+            self.figure.autofmt_xdate()
+            self.canvas.draw()
+        except Exception as e:
+            messagebox.showerror("错误", f"图表生成失败：{str(e)}")
+        self._schedule_live()
+
+    def _add_live_line(self, name, x, y):
+        line, = self.ax.plot(x, y, linestyle='-', label=name)
+        self._live_lines[name] = [line, x, y]
+
+    def _queue_live(self, inserted):
+        """实时模式的新记录来自变更订阅，不查询数据库"""
+        self._live_pending.extend((r[2], r[1], r[0], r[3]) for r in inserted)
+        self._schedule_live()
+
+    def _schedule_live(self):
+        if self._live_pending and self._live_job is None and self._live_last_id is not None:
+            self._live_job = self.after(self.LIVE_INTERVAL_MS, self._append_live)
+
+    @METRICS.timed("calc_chart_seconds", stage="live_poll")
+    def _append_live(self):
+        """追加上次绘制之后新增的记录；一个周期内的多次保存合并为一次重绘"""
+        self._live_job = None
+        # 基线已包含 id 不大于截止 id 的记录
+        rows = sorted({row[2]: row for row in self._live_pending if row[2] > self._live_last_id}.values())
+        self._live_pending = []
+        if not rows or not self.live_var.get() or not self.winfo_exists():
+            return
+        self._live_last_id = max(row[2] for row in rows)
+        pages, timestamps, _, results = zip(*rows)
+        series = split_by_page(pages, to_local_datetime64(timestamps), np.array(results, dtype=float))
+        buckets = self._plot_width_pixels()
+        new_line = False
+        for name, x, y in series:
+            if name not in self._live_lines:
+                self._add_live_line(name, x, y)
+                new_line = True
+                continue
+            entry = self._live_lines[name]
+            entry[1] = np.concatenate([entry[1], x])
+            entry[2] = np.concatenate([entry[2], y])
+            if len(entry[1]) > self.LIVE_MAX_FACTOR * buckets:
+                entry[1], entry[2] = minmax_downsample(entry[1], entry[2], buckets)
+            entry[0].set_data(entry[1], entry[2])
+        if new_line:
+            self.ax.legend()
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.canvas.draw_idle()
+
+    def _plot_width_pixels(self):
+        """绘图区的像素宽度，控件尚未布局时按图表默认尺寸估算"""
+        width = self.canvas.get_tk_widget().winfo_width()
+        if width <= 1:
+            width = self.figure.get_figwidth() * self.figure.dpi
+        return max(100, int(width * self.ax.get_position().width))
+
 
 class HistoryDialog(tk.Toplevel):
+    PAGE_SIZE = 200        # 每次从数据库读取的记录数
+    PREFETCH_RATIO = 0.8   # 滚动到已加载内容的该比例处时预取下一页
+    PARAM_DISPLAY_LIMIT = 20  # 长向量只显示前若干个参数
+
     def __init__(self, parent, page_name, refresh_callback):
         super().__init__(parent)
         self.title(f"{page_name} - 历史记录")
         self.geometry("800x500")
         self.data_mgr = parent.controller.data_mgr
+        self.executor = parent.controller.query_executor
+        self._query_key = f"history-dialog-{id(self)}"
         self.page_name = page_name
         self.refresh_callback = refresh_callback
+        self._cursor = None
+        self._exhausted = False
+        self._loading = False
+        self._filters = (None, None)  # (参数值范围, 结果范围)
+        self._keys = {}  # 表格项 -> (时间戳, ID)，即记录在表格中的排序键
         self._create_widgets()
+        self.data_mgr.subscribe(self._on_changes)
+        self.bind("<Destroy>", self._on_destroy)
 
     def _create_widgets(self):
+        # 筛选栏：参数值范围和结果范围，上下限留空表示不限
+        filter_frame = ttk.Frame(self)
+        filter_frame.pack(side="top", fill="x", padx=5, pady=5)
+        ttk.Label(filter_frame, text="参数").pack(side="left")
+        self.param_name_var = tk.StringVar()
+        self.param_name_box = ttk.Combobox(filter_frame, textvariable=self.param_name_var, width=8)
+        self.param_name_box.pack(side="left", padx=2)
+        self.param_vars = self._range_entries(filter_frame)
+        ttk.Label(filter_frame, text="结果").pack(side="left", padx=(10, 0))
+        self.result_vars = self._range_entries(filter_frame)
+        ttk.Button(filter_frame, text="筛选", command=self._apply_filter).pack(side="left", padx=(10, 2))
+        ttk.Button(filter_frame, text="清除", command=self._clear_filter).pack(side="left", padx=2)
+        self.executor.submit(self.data_mgr.param_names, self.page_name, callback=self._set_param_names)
+
         # 表格组件
         columns = ("ID", "时间", "参数", "结果")
-        self.tree = ttk.Treeview(self, columns=columns, show="headings", selectmode="browse")
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", selectmode="extended")
 
         for col in columns:
             self.tree.heading(col, text=col)
             self.tree.column(col, width=100 if col == "ID" else 200)
 
-        # 滚动条
-        scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
+        # 滚动条：滚动接近已加载内容末尾时按需加载下一页
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_tree_scroll)
+        self.status_var = tk.StringVar()
 
         # 右键菜单
         self.context_menu = tk.Menu(self, tearoff=0)
-        self.context_menu.add_command(label="删除记录", command=self._delete_selected)
+        self.context_menu.add_command(label="删除选中记录", command=self._delete_selected)
 
         # 布局
+        ttk.Label(self, textvariable=self.status_var, anchor="w").pack(side="bottom", fill="x")
         self.tree.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
+        self.scrollbar.pack(side="right", fill="y")
 
         # 事件绑定
         self.tree.bind("<Button-3>", self._show_context_menu)
         self._load_data()
 
+    @staticmethod
+    def _range_entries(parent):
+        low, high = tk.StringVar(), tk.StringVar()
+        ttk.Entry(parent, textvariable=low, width=8).pack(side="left", padx=2)
+        ttk.Label(parent, text="～").pack(side="left")
+        ttk.Entry(parent, textvariable=high, width=8).pack(side="left", padx=2)
+        return low, high
+
+    def _set_param_names(self, names):
+        if self.winfo_exists():
+            self.param_name_box['values'] = names
+            if names and not self.param_name_var.get():
+                self.param_name_var.set(names[0])
+
+    @staticmethod
+    def _read_range(variables):
+        return tuple(float(var.get()) if var.get().strip() else None for var in variables)
+
+    def _apply_filter(self):
+        try:
+            param_range = self._read_range(self.param_vars)
+            result_range = self._read_range(self.result_vars)
+            name = self.param_name_var.get().strip()
+            param_filters = {param_filter_name(name): param_range} if name and param_range != (None, None) else None
+        except ValueError as e:
+            messagebox.showerror("错误", f"筛选条件无效：{e}", parent=self)
+            return
+        self._filters = (param_filters, result_range if result_range != (None, None) else None)
+        self._load_data()
+
+    def _clear_filter(self):
+        for var in self.param_vars + self.result_vars:
+            var.set("")
+        self._filters = (None, None)
+        self._load_data()
+
     def _load_data(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        """清空表格并从最新记录重新加载第一页"""
+        self.tree.delete(*self.tree.get_children())
+        self._keys.clear()
+        self._cursor = None
+        self._exhausted = False
+        self._loading = False
+        self._load_more()
 
-        records = self.data_mgr.get_records(page_filter=self.page_name)
-        for r in records:
-            params = json.loads(r[4])
-            param_str = ", ".join(f"{k}={v}" for k, v in params.items()) if isinstance(params, dict) else ", ".join(
-                map(str, params))
-            self.tree.insert("", "end", values=(r[0], r[1], param_str, f"{r[3]:.4f}"))
+    def _load_more(self):
+        """在后台读取下一页记录，完成后追加到表格"""
+        if self._loading or self._exhausted:
+            return
+        self._loading = True
+        self.status_var.set("正在加载...")
+        # 重新加载时新请求会作废仍在进行的旧请求
+        self.executor.submit(self._fetch_page, self._cursor, self._filters,
+                             callback=self._show_page, error_callback=self._load_failed, key=self._query_key)
+
+    def _format_record(self, r):
+        return (r[0], format_timestamp(r[1]), format_params(*r[4:], limit=self.PARAM_DISPLAY_LIMIT), f"{r[3]:.4f}")
+
+    @METRICS.timed("calc_treeview_seconds", stage="fetch")
+    def _fetch_page(self, cursor, filters):
+        """工作线程：读取一页记录并格式化，返回 (表格行, 排序键, 下一页游标)"""
+        records = self.data_mgr.get_records_page(self.page_name, cursor, self.PAGE_SIZE, *filters)
+        rows = [self._format_record(r) for r in records]
+        keys = [(r[1], r[0]) for r in records]
+        return rows, keys, (keys[-1] if keys else cursor)
+
+    def _load_failed(self, error):
+        self._loading = False
+        if self.winfo_exists():
+            self.status_var.set(f"加载失败：{error}")
+
+    @METRICS.timed("calc_treeview_seconds", stage="insert")
+    def _show_page(self, page):
+        self._loading = False
+        if not self.winfo_exists():
+            return
+        rows, keys, self._cursor = page
+        for row, key in zip(rows, keys):
+            # 变更通知可能已先插入了同一条记录
+            if not self.tree.exists(str(key[1])):
+                self._keys[self.tree.insert("", "end", iid=str(key[1]), values=row)] = key
+        self._exhausted = len(rows) < self.PAGE_SIZE
+        self._show_status()
+
+    def _show_status(self):
+        loaded = len(self._keys)
+        filtered = "符合筛选条件的记录" if self._filters != (None, None) else ""
+        self.status_var.set(f"已加载{filtered} {loaded} 条" + ("（全部）" if self._exhausted else "，向下滚动加载更多"))
+
+    def _on_changes(self, inserted, deleted, reset):
+        """变更订阅：只增删受影响的表格项，不重新加载已读取的页"""
+        if reset:
+            self._load_data()
+            return
+        removed = [str(record_id) for record_id, _, _ in deleted if str(record_id) in self._keys]
+        for iid in removed:
+            del self._keys[iid]
+        if removed:
+            self.tree.delete(*removed)
+
+        matches = self.data_mgr.record_filter(*self._filters)
+        added = 0
+        for r in inserted:
+            if r[2] != self.page_name or str(r[0]) in self._keys or (matches is not None and not matches(r)):
+                continue
+            key = (r[1], r[0])
+            # 比已加载的最后一条更旧的记录留给下一页读取
+            if not self._exhausted and self._cursor is not None and key < self._cursor:
+                continue
+            items = self.tree.get_children()
+            index = 0
+            if items and key < self._keys[items[0]]:
+                index = len(items)
+                for i, item in enumerate(items):
+                    if self._keys[item] < key:
+                        index = i
+                        break
+            self._keys[self.tree.insert("", index, iid=str(r[0]), values=self._format_record(r))] = key
+            added += 1
+        if removed or added:
+            self._show_status()
+
+    def _on_destroy(self, event):
+        if event.widget is self:
+            self.data_mgr.unsubscribe(self._on_changes)
+
+    def _on_tree_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if float(last) >= self.PREFETCH_RATIO and not self._exhausted:
+            self.after_idle(self._maybe_load_more)
+
+    def _maybe_load_more(self):
+        # 空闲时再次确认位置，避免重复排队的回调连续加载多页
+        if self.tree.winfo_exists() and self.tree.yview()[1] >= self.PREFETCH_RATIO:
+            self._load_more()
 
     def _show_context_menu(self, event):
         item = self.tree.identify_row(event.y)
         if item:
-            self.tree.selection_set(item)
+            # 在已选中的多条记录上右键时保留整个选择
+            if item not in self.tree.selection():
+                self.tree.selection_set(item)
             self.context_menu.post(event.x_root, event.y_root)
 
     def _delete_selected(self):
         selected = self.tree.selection()
-        if not selected or not messagebox.askyesno("确认", "确定要删除该记录吗？"):
+        if not selected or not messagebox.askyesno("确认", f"确定要删除选中的 {len(selected)} 条记录吗？"):
             return
 
         try:
-            record_id = self.tree.item(selected[0])['values'][0]
-            self.data_mgr.delete_record(record_id)
-            self._load_data()
+            self.data_mgr.delete_records([self._keys[item][1] for item in selected])
+            # 先在本地移除，随后的变更通知中已不存在的表格项会被跳过
+            for item in selected:
+                del self._keys[item]
+            self.tree.delete(*selected)
+            self._show_status()
             self.refresh_callback()
-            messagebox.showinfo("成功", "记录已删除")
+            messagebox.showinfo("成功", f"已删除 {len(selected)} 条记录")
         except Exception as e:
             messagebox.showerror("错误", f"删除失败：{str(e)}")
 
 
+class ExportProgressDialog(tk.Toplevel):
+    """导出进度窗口：导出在后台线程进行，窗口定时刷新进度，可随时取消"""
+
+    REFRESH_MS = 100
+
+    def __init__(self, parent, exporter, executor):
+        super().__init__(parent)
+        self.title("正在导出")
+        self.resizable(False, False)
+        self.transient(parent)
+        self.exporter = exporter
+        self._cancelled = False
+
+        self.status_var = tk.StringVar(value="准备导出...")
+        ttk.Label(self, textvariable=self.status_var, width=40).pack(padx=10, pady=(10, 5))
+        self.progress = ttk.Progressbar(self, length=300)
+        self.progress.pack(padx=10, pady=5)
+        ttk.Button(self, text="取消", command=self._cancel).pack(pady=(5, 10))
+        self.protocol("WM_DELETE_WINDOW", self._cancel)
+        executor.submit(exporter.run, self._keep_going, callback=self._finished, error_callback=self._failed)
+        self.after(self.REFRESH_MS, self._refresh)
+
+    def _keep_going(self, written, total):
+        # 工作线程每写完一块调用一次，返回 False 即取消
+        return not self._cancelled
+
+    def _refresh(self):
+        if self._cancelled or not self.winfo_exists():
+            return
+        total = self.exporter.total
+        if total:
+            self.progress['maximum'] = total
+            self.progress['value'] = self.exporter.written
+            self.status_var.set(f"已导出 {self.exporter.written} / {total} 条")
+        self.after(self.REFRESH_MS, self._refresh)
+
+    def _finished(self, completed):
+        if self._cancelled:
+            print("DEBUG: 用户取消导出")
+            return
+        self.destroy()
+        if not completed:
+            messagebox.showwarning("警告", "数据库中没有可导出的数据")
+            return
+        file_path = self.exporter.file_path
+        print(f"DEBUG: 文件已保存，大小：{os.path.getsize(file_path)} 字节")
+        messagebox.showinfo("成功", f"数据已保存至：\n{file_path}")
+
+    def _failed(self, error):
+        if self.winfo_exists():
+            self.destroy()
+        if isinstance(error, PermissionError):
+            messagebox.showerror("错误", "文件被其他程序占用，请关闭后重试")
+        else:
+            messagebox.showerror("错误", f"导出失败：{str(error)}")
+
+    def _cancel(self):
+        # 只设置标志，由工作线程在下一块写完后删除未完成的文件
+        self._cancelled = True
+        self.destroy()
+
+
+class ImportProgressDialog(ExportProgressDialog):
+    """导入进度窗口：取消时已写入的块保留，结束后刷新历史页"""
+
+    def __init__(self, parent, importer, executor):
+        super().__init__(parent, importer, executor)
+        self.title("正在导入")
+        self.status_var.set("准备导入...")
+
+    def _refresh(self):
+        if self._cancelled or not self.winfo_exists():
+            return
+        total = self.exporter.total
+        if total:
+            self.progress['maximum'] = total
+            self.progress['value'] = min(self.exporter.done, total)
+        self.status_var.set(f"已导入 {self.exporter.imported} 条")
+        self.after(self.REFRESH_MS, self._refresh)
+
+    def _finished(self, completed):
+        importer = self.exporter
+        print(f"DEBUG: 导入 {importer.imported} 条，跳过重复 {importer.duplicates} 条，无法解析 {importer.invalid} 条")
+        self.master.refresh_time_range()
+        if self._cancelled:
+            print("DEBUG: 用户取消导入")
+            return
+        self.destroy()
+        message = f"已导入 {importer.imported} 条记录"
+        if importer.duplicates:
+            message += f"，跳过重复 {importer.duplicates} 条"
+        if importer.invalid:
+            message += f"，{importer.invalid} 行无法解析已跳过"
+        messagebox.showinfo("导入完成", message)
+
+    def _failed(self, error):
+        self.master.refresh_time_range()
+        if self.winfo_exists():
+            self.destroy()
+        messagebox.showerror("错误", f"导入失败：{str(error)}\n已写入 {self.exporter.imported} 条记录")
+
+
+class DiagnosticsWindow(tk.Toplevel):
+    """诊断窗口：开关运行指标，查看计数器和延迟直方图摘要，分析下一次操作"""
+
+    REFRESH_MS = 1000
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.title("诊断")
+        self.geometry("820x420")
+        self.app = app
+
+        control_frame = ttk.Frame(self)
+        control_frame.pack(fill="x", padx=5, pady=5)
+        self.enabled_var = tk.BooleanVar(value=METRICS.enabled)
+        ttk.Checkbutton(control_frame, text="记录运行指标", variable=self.enabled_var,
+                        command=lambda: app.set_metrics_enabled(self.enabled_var.get())).pack(side="left", padx=5)
+        ttk.Button(control_frame, text="重置", command=METRICS.reset).pack(side="left", padx=5)
+        ttk.Button(control_frame, text="分析下一次操作", command=self._arm_profile).pack(side="left", padx=5)
+        self.status_var = tk.StringVar()
+        ttk.Label(control_frame, textvariable=self.status_var).pack(side="left", padx=10)
+
+        columns = ("指标", "标签", "次数", "平均(ms)", "P95(ms)", "最大(ms)")
+        self.tree = ttk.Treeview(self, columns=columns, show="headings")
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=200 if col in ("指标", "标签") else 80,
+                             anchor="w" if col in ("指标", "标签") else "e")
+        scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        ttk.Label(self, text=f"指标文件：{os.path.abspath(METRICS_FILE)}（每 {METRICS_INTERVAL_MS // 1000} 秒写入）",
+                  anchor="w").pack(side="bottom", fill="x", padx=5)
+        self.tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        self._refresh()
+
+    def _arm_profile(self):
+        self.app.profile_capture.arm()
+
+    def _refresh(self):
+        if not self.winfo_exists():
+            return
+        self.tree.delete(*self.tree.get_children())
+        for name, labels, count, avg, p95, peak in METRICS.snapshot():
+            timings = ("", "", "") if avg is None else (f"{avg:.2f}", f"{p95:.2f}", f"{peak:.2f}")
+            self.tree.insert("", "end", values=(name, labels, count) + timings)
+
+        state = self.app.profile_capture.state
+        if state == "armed":
+            self.status_var.set("等待操作：下一次点击或按键将被分析")
+        elif state == "running":
+            self.status_var.set("正在分析...")
+        else:
+            self.status_var.set("指标记录中" if METRICS.enabled else "指标记录已关闭")
+        self.after(self.REFRESH_MS, self._refresh)
+
+
 if __name__ == "__main__":
+    STARTUP_TIMER.mark("加载程序模块")
     app = MainApplication()
     app.mainloop()
 
@@ -0,0 +1,337 @@
+"""DataManager 与历史视图的基准测试
+
+用合成的历史数据在不同规模下测量写入吞吐、筛选查询延迟、导出耗时与内存、图表数据准备耗时，
+结果写入 JSON，可与上一版本的结果对比找出退化项。
+
+    python benchmark.py --rows 10000 1000000 --output bench.json
+    python benchmark.py --rows 10000 --baseline bench_old.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+
+import DecisionMaking as dm
+
+# 页面构成：(页面, 占比)，与现场操作记录的比例大致相同
+PAGE_MIX = (("参数求和", 0.45), ("参数求积", 0.40), ("综合计算", 0.15))
+NUM_PARAMS = 6
+GENERATE_CHUNK = 50_000
+CHART_BUCKETS = 800          # 图表绘图区宽度（像素）
+EXCEL_MAX_ROWS = 100_000     # 超过该规模跳过 Excel 导出（openpyxl 逐行写入太慢）
+EXPORT_MEMORY_CHUNKS = 20    # 内存测量只导出前若干块，流式导出的内存占用在稳定后不再增长
+REGRESSION_RATIO = 1.2       # 与基线相比变慢超过该倍数视为退化
+
+
+def generate_history(data_mgr, rows, seed=0, days=365):
+    """生成 rows 条合成记录并写入 data_mgr，返回写入耗时（秒）
+
+    时间戳集中在白天工作时段、按时间排序；求和参数为两位小数，求积参数在 1 附近避免溢出；
+    综合计算使用此前最近一次求和、求积的结果和随机权重。
+    """
+    rng = np.random.default_rng(seed)
+    day_us = 86400 * 1_000_000
+    first_day = dm.rollup_bucket(dm.now_epoch_us(), 86400) - (days - 1) * day_us
+    seconds = np.clip(rng.normal(13.5 * 3600, 3 * 3600, rows), 0, 86399).astype(np.int64)
+    timestamps = np.sort(first_day + rng.integers(0, days, rows) * day_us
+                         + seconds * 1_000_000 + rng.integers(0, 1_000_000, rows))
+
+    names = [name for name, _ in PAGE_MIX]
+    pages = rng.choice(len(PAGE_MIX), rows, p=[share for _, share in PAGE_MIX])
+    sum_params = np.round(rng.normal(50, 20, (rows, NUM_PARAMS)), 2)
+    product_params = np.round(rng.lognormal(0, 0.3, (rows, NUM_PARAMS)), 2)
+    weights = np.round(rng.uniform(0, 1, (rows, 2)), 2)
+
+    # 综合计算取此前最近一次求和/求积的结果（前向填充）
+    sums = sum_params.sum(axis=1)
+    products = product_params.prod(axis=1)
+    index = np.arange(rows)
+    last_sum = sums[np.maximum.accumulate(np.where(pages == 0, index, 0))]
+    last_product = products[np.maximum.accumulate(np.where(pages == 1, index, 0))]
+    composite = weights[:, 0] * last_sum + weights[:, 1] * last_product
+
+    t0 = time.perf_counter()
+    for start in range(0, rows, GENERATE_CHUNK):
+        batch = []
+        for i in range(start, min(start + GENERATE_CHUNK, rows)):
+            page = names[pages[i]]
+            if pages[i] == 0:
+                params, result = sum_params[i].tolist(), sums[i]
+            elif pages[i] == 1:
+                params, result = product_params[i].tolist(), products[i]
+            else:
+                params, result = {"alpha": weights[i, 0], "beta": weights[i, 1]}, composite[i]
+            digest = dm.param_digest(page, params)
+            batch.append(data_mgr._encode_row(int(timestamps[i]), page, result, params, digest))
+        with data_mgr._write() as conn:
+            data_mgr._insert_rows(conn, batch)
+    return time.perf_counter() - t0
+
+
+def timed(func, repeat):
+    """重复调用 func，返回耗时统计（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples = np.array(samples)
+    return {
+        "repeat": repeat,
+        "min_ms": round(float(samples.min()), 3),
+        "median_ms": round(float(np.median(samples)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "max_ms": round(float(samples.max()), 3),
+    }
+
+
+def bench_insert(db_path, samples):
+    """写入吞吐：逐条提交、写回缓冲、单事务批量写入；测试记录写完后删除"""
+    results = {}
+    params = [1.5, 2.5, 3.5, 4.5, 5.5, 6.5]
+
+    def run(name, write_behind, save):
+        data_mgr = dm.DataManager(db_path, write_behind=write_behind)
+        before = data_mgr.max_record_id()
+        t0 = time.perf_counter()
+        save(data_mgr)
+        data_mgr.flush()
+        elapsed = time.perf_counter() - t0
+        with data_mgr._write() as conn:
+            conn.execute("DELETE FROM calculations WHERE id > ?", (before,))
+        data_mgr.close()
+        results[name] = {"rows": samples, "seconds": round(elapsed, 4),
+                         "rows_per_s": round(samples / elapsed, 1)}
+
+    def save_each(data_mgr):
+        for i in range(samples):
+            data_mgr.save_record("参数求和", float(i), params)
+
+    run("save_record", False, save_each)
+    run("save_record_write_behind", True, save_each)
+    run("save_records_batch", False,
+        lambda data_mgr: data_mgr.save_records("参数求和", np.arange(samples, dtype=float), [params] * samples))
+    return results
+
+
+def bench_queries(data_mgr, repeat):
+    """筛选查询延迟"""
+    low, high = data_mgr.get_time_bounds()
+    last_day = high - 86400 * 1_000_000
+    last_week = high - 7 * 86400 * 1_000_000
+    deep = None
+    for _ in range(50):
+        page = data_mgr.get_records_page("参数求和", deep, 200)
+        if not page:
+            break
+        deep = (page[-1][1], page[-1][0])
+
+    return {
+        "latest_per_page": timed(lambda: [data_mgr.get_records(page_filter=name, limit=1)
+                                          for name, _ in PAGE_MIX], repeat),
+        "records_last_day": timed(lambda: data_mgr.get_records(last_day, high), repeat),
+        "records_page_last_day": timed(lambda: data_mgr.get_records(last_day, high, "参数求和"), repeat),
+        "keyset_first_page": timed(lambda: data_mgr.get_records_page("参数求和", None, 200), repeat),
+        "keyset_page_50": timed(lambda: data_mgr.get_records_page("参数求和", deep, 200), repeat),
+        "count_records": timed(lambda: data_mgr.count_records("参数求和"), repeat),
+        "time_bounds": timed(data_mgr.get_time_bounds, repeat),
+        "record_days": timed(data_mgr.get_record_days, repeat),
+        "param_arrays_last_week": timed(lambda: data_mgr.get_param_arrays("参数求和", last_week, high), repeat),
+    }
+
+
+def bench_export(data_mgr, work_dir, rows):
+    """导出耗时与峰值内存（tracemalloc）"""
+    results = {}
+    formats = ['csv'] + (['excel'] if rows <= EXCEL_MAX_ROWS else [])
+    for format_type in formats:
+        path = os.path.join(work_dir, "export.csv" if format_type == 'csv' else "export.xlsx")
+        t0 = time.perf_counter()
+        dm.StreamingExporter(data_mgr, path, format_type).run()
+        elapsed = time.perf_counter() - t0
+        size = os.path.getsize(path)
+        os.remove(path)
+
+        tracemalloc.start()
+        exporter = dm.StreamingExporter(data_mgr, path, format_type)
+        for _ in range(EXPORT_MEMORY_CHUNKS):
+            if not exporter.step():
+                break
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        exporter.cancel()
+
+        results[format_type] = {"seconds": round(elapsed, 4), "rows_per_s": round(rows / elapsed, 1),
+                                "file_bytes": size, "peak_memory_mb": round(peak / 2 ** 20, 2)}
+    return results
+
+
+def bench_chart(data_mgr, repeat):
+    """历史图表数据准备（HistoryPage._load_chart_data：汇总表或降采样后的原始记录）"""
+    page = SimpleNamespace(data_mgr=data_mgr)
+    load = dm.HistoryPage._load_chart_data
+    low, high = data_mgr.get_time_bounds()
+    results = {}
+    for name, span in (("all", None), ("last_7_days", 7 * 86400), ("last_day", 86400), ("last_hour", 3600)):
+        start = low if span is None else max(low, high - span * 1_000_000)
+        granularity, series, _, _ = load(page, start, high, CHART_BUCKETS)
+        results[name] = dict(timed(lambda start=start: load(page, start, high, CHART_BUCKETS), repeat),
+                             granularity=granularity or "raw",
+                             points=int(sum(len(s[1]) for s in series)))
+    return results
+
+
+def check_legacy_upgrade(work_dir):
+    """回归检查：最初版本建立的数据库（文本时间戳、JSON 参数、无汇总表与归档表）能直接打开并完成迁移"""
+    db_path = os.path.join(work_dir, "legacy.db")
+    records = [("2024-01-02 09:30:00", "参数求和", 6.0, [1.0, 2.0, 3.0]),
+               ("2024-01-02 10:00:00", "参数求积", 6.0, [1.0, 2.0, 3.0]),
+               ("2024-01-03 14:15:00", "综合计算", 6.0, {"alpha": 0.5, "beta": 0.5})]
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("""
+            CREATE TABLE calculations(
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME NOT NULL,
+                page TEXT NOT NULL,
+                result REAL NOT NULL,
+                parameters TEXT NOT NULL
+            )""")
+        conn.execute("CREATE INDEX idx_timestamp ON calculations(timestamp)")
+        conn.executemany("INSERT INTO calculations (timestamp, page, result, parameters) VALUES (?, ?, ?, ?)",
+                         [(ts, page, result, json.dumps(params)) for ts, page, result, params in records])
+    conn.close()
+
+    data_mgr = dm.DataManager(db_path)
+    try:
+        data_mgr.migrate()
+        upgraded = data_mgr.get_records()
+        if data_mgr.migration_pending or len(upgraded) != len(records):
+            raise RuntimeError(f"旧版数据库迁移不完整：{len(upgraded)} / {len(records)} 条")
+        for (_, page, _, params), r in zip(reversed(records), upgraded):
+            if r[2] != page or dm.decode_params(*r[4:]) != params:
+                raise RuntimeError(f"旧版记录 {r[0]} 迁移后不一致")
+    finally:
+        data_mgr.close()
+
+
+def run_size(rows, args, work_dir):
+    db_path = args.db or os.path.join(work_dir, f"bench_{rows}.db")
+    data_mgr = dm.DataManager(db_path)
+    existing = data_mgr.count_records()
+    result = {"rows": rows}
+    if existing != rows:
+        if existing:
+            data_mgr.close()
+            os.remove(db_path)
+            data_mgr = dm.DataManager(db_path)
+        print(f"生成 {rows} 条记录...")
+        elapsed = generate_history(data_mgr, rows, args.seed)
+        result["generate"] = {"seconds": round(elapsed, 2), "rows_per_s": round(rows / elapsed, 1)}
+    result["db_bytes"] = os.path.getsize(db_path)
+
+    print(f"[{rows}] 查询")
+    result["queries"] = bench_queries(data_mgr, args.repeat)
+    print(f"[{rows}] 图表")
+    result["chart"] = bench_chart(data_mgr, args.repeat)
+    print(f"[{rows}] 导出")
+    result["export"] = bench_export(data_mgr, work_dir, rows)
+    data_mgr.close()
+    print(f"[{rows}] 写入")
+    result["insert"] = bench_insert(db_path, args.insert_samples)
+    return result
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+    }
+
+
+def iter_metrics(result, path=()):
+    """遍历结果中可比较的指标，产出 (路径, 耗时)；吞吐量取倒数，同样越小越好"""
+    for key, value in result.items():
+        if isinstance(value, dict):
+            yield from iter_metrics(value, path + (key,))
+        elif key == "median_ms":
+            yield path + (key,), value
+        elif key == "rows_per_s" and value:
+            yield path + (key,), 1 / value
+
+
+def compare(results, baseline_path):
+    """与基线结果对比，返回退化项 [(指标, 变慢倍数)]"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    old = {(str(size["rows"]),) + path: value
+           for size in baseline["sizes"] for path, value in iter_metrics(size)}
+    regressions = []
+    for size in results["sizes"]:
+        for path, value in iter_metrics(size):
+            key = (str(size["rows"]),) + path
+            if key[1] == "generate" or key not in old or not old[key]:
+                continue
+            ratio = value / old[key]
+            if ratio > REGRESSION_RATIO:
+                regressions.append((" / ".join(key), ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DataManager 与历史视图基准测试")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000], help="数据规模，可给多个")
+    parser.add_argument("--repeat", type=int, default=20, help="每个查询重复次数")
+    parser.add_argument("--insert-samples", type=int, default=2000, help="写入测试的记录数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="复用的数据库文件（单一规模时使用，记录数不符时重新生成）")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="对比的历史结果 JSON")
+    args = parser.parse_args()
+    if args.db and len(args.rows) > 1:
+        parser.error("--db 只能与单一规模一起使用")
+
+    work_dir = tempfile.mkdtemp(prefix="calc_bench_")
+    try:
+        print("检查旧版数据库升级...")
+        check_legacy_upgrade(work_dir)
+        results = {"meta": metadata(args), "sizes": [run_size(rows, args, work_dir) for rows in args.rows]}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline)
+        for name, ratio in regressions:
+            print(f"退化：{name} 变慢 {ratio:.2f} 倍")
+        if regressions:
+            sys.exit(1)
+        print("与基线相比无退化")
+
+
+if __name__ == "__main__":
+    main()
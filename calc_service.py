@@ -0,0 +1,514 @@
+"""计算内核与历史记录的本地 HTTP/JSON 服务
+
+只依赖标准库 asyncio，供 MES 等本机程序调用：
+
+    python calc_service.py --port 8765
+
+    POST /compute          {"page": "参数求和", "params": [1, 2, 3, 4, 5, 6], "save": true}
+    POST /compute/batch    {"page": "参数求积", "params": [[...], [...]], "save": true}
+    GET  /history?page=参数求和&limit=100&cursor=...
+    GET  /export?format=csv&page=参数求和
+    GET  /health、GET /metrics
+
+读查询在固定大小的线程池中执行，每个线程持有自己的只读连接；所有写入由唯一的写入线程提交，
+同一时间窗口内到达的保存请求合并为一个事务，提交后才返回响应。
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import DecisionMaking as dm
+
+HOST = "127.0.0.1"
+PORT = 8765
+READ_POOL_SIZE = 4          # 读线程数，即只读连接数
+MAX_CONNECTIONS = 512       # 同时处理的连接数，超出的连接在 accept 队列中等待
+IDLE_TIMEOUT = 15           # keep-alive 连接的空闲超时（秒）
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 8 * 1024 * 1024
+MAX_BATCH_ROWS = 10_000
+HISTORY_MAX_LIMIT = 1000
+WRITE_BATCH_WINDOW_MS = 5   # 合并写入的等待窗口
+WRITE_BATCH_MAX = 500       # 单个事务最多合并的记录数
+EXPORT_CHUNK_SIZE = 5000
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _kernel_sum(params):
+    return sum(params)
+
+
+def _kernel_product(params):
+    result = 1.0
+    for value in params:
+        result *= value
+    return result
+
+
+# 固定页面的单条计算内核，与界面中的计算逻辑一致
+KERNELS = {
+    "参数求和": (_kernel_sum, dm.BatchCalculator.sum),
+    "参数求积": (_kernel_product, dm.BatchCalculator.product),
+    "向量求和": (dm.vector_sum, None),
+    "向量求积": (dm.vector_product, None),
+}
+FIXED_PARAM_COUNT = 6
+
+
+class WriteBatcher:
+    """合并写入：收集时间窗口内的保存请求，在唯一的写入线程中一个事务提交"""
+
+    def __init__(self, data_mgr, writer):
+        self.data_mgr = data_mgr
+        self.writer = writer
+        self.batches = 0
+        self.records = 0
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def save(self, entries):
+        """entries 为 [(页面, 结果, 参数, 参数哈希)]，提交后返回"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((entries, future))
+        await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            count = len(pending[0][0])
+            deadline = loop.time() + WRITE_BATCH_WINDOW_MS / 1000
+            while count < WRITE_BATCH_MAX:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                count += len(item[0])
+
+            entries = [entry for batch, _ in pending for entry in batch]
+            try:
+                await loop.run_in_executor(self.writer, self.data_mgr.save_batch, entries)
+            except Exception as e:
+                print(f"ERROR: 合并写入失败：{e}")
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.records += len(entries)
+            for _, future in pending:
+                if not future.done():
+                    future.set_result(None)
+
+    async def close(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class CalcService:
+    """HTTP 服务：解析请求、分发到读线程池或写入线程"""
+
+    def __init__(self, db_path=dm.DB_PATH, read_workers=READ_POOL_SIZE):
+        self.db_path = db_path
+        self.read_workers = read_workers
+        self.readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="service-read")
+        # 所有写入都在这一个线程中提交，读查询在 readers 中执行
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="service-write")
+        self.data_mgr = None
+        self.cache = None
+        self.batcher = None
+        self._export_slots = None
+        self._connection_slots = None
+        self._server = None
+        self.routes = {
+            ("GET", "/health"): self.health,
+            ("GET", "/metrics"): self.metrics,
+            ("POST", "/compute"): self.compute,
+            ("POST", "/compute/batch"): self.compute_batch,
+            ("GET", "/history"): self.history,
+        }
+
+    def _open(self):
+        # 每个读线程各占一个只读连接，另留一个给写入线程中的读取
+        data_mgr = dm.DataManager(self.db_path, readers=self.read_workers + 1)
+        data_mgr.migrate()
+        return data_mgr
+
+    async def start(self, host=HOST, port=PORT):
+        loop = asyncio.get_running_loop()
+        self.data_mgr = await loop.run_in_executor(self.writer, self._open)
+        self.cache = dm.ResultCache(self.data_mgr)
+        self.batcher = WriteBatcher(self.data_mgr, self.writer)
+        self._export_slots = asyncio.Semaphore(1)
+        self._connection_slots = asyncio.Semaphore(MAX_CONNECTIONS)
+        self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_HEADER_BYTES,
+                                                  backlog=MAX_CONNECTIONS)
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self.batcher is not None:
+            await self.batcher.close()
+        if self.data_mgr is not None:
+            await asyncio.get_running_loop().run_in_executor(self.writer, self.data_mgr.close)
+        self.readers.shutdown()
+        self.writer.shutdown()
+
+    async def _read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.readers, func, *args)
+
+    # ---- HTTP ----
+
+    async def _handle(self, reader, writer):
+        async with self._connection_slots:
+            try:
+                while await self._serve_one(reader, writer):
+                    pass
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+
+    async def _serve_one(self, reader, writer):
+        """处理一个请求，返回连接是否保持"""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return False
+        except asyncio.LimitOverrunError:
+            await self._send_json(writer, 431, {"error": "请求头过大"}, False)
+            return False
+
+        start = time.perf_counter()
+        try:
+            request_line, *header_lines = head.decode('latin-1').split("\r\n")
+            method, target, version = request_line.split(" ", 2)
+            headers = {}
+            for line in header_lines:
+                if line:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            await self._send_json(writer, 400, {"error": "请求格式错误"}, False)
+            return False
+        if length > MAX_BODY_BYTES:
+            await self._send_json(writer, 413, {"error": "请求体过大"}, False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" and (version == "HTTP/1.1" or connection == "keep-alive")
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        route = url.path.rstrip("/") or "/"
+
+        status = 200
+        try:
+            if route == "/export" and method == "GET":
+                await self.export(writer, query)
+                return False
+            handler = self.routes.get((method, route))
+            if handler is None:
+                known = any(path == route for _, path in self.routes)
+                raise HTTPError(405 if known else 404, "不支持的请求方法" if known else "路径不存在")
+            payload = await handler(query, self._parse_json(body) if method == "POST" else None)
+        except HTTPError as e:
+            status, payload = e.status, {"error": str(e)}
+        except (ValueError, TypeError, KeyError) as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception as e:
+            print(f"ERROR: 处理请求 {method} {route} 失败：{e}")
+            status, payload = 500, {"error": "服务器内部错误"}
+        finally:
+            dm.METRICS.inc("calc_http_requests_total", route=route, status=str(status))
+            dm.METRICS.observe("calc_http_seconds", time.perf_counter() - start, route=route)
+        await self._send_json(writer, status, payload, keep_alive)
+        return keep_alive
+
+    @staticmethod
+    def _parse_json(body):
+        try:
+            data = json.loads(body or b"{}")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise HTTPError(400, "请求体不是有效的 JSON") from None
+        if not isinstance(data, dict):
+            raise HTTPError(400, "请求体应为 JSON 对象")
+        return data
+
+    @staticmethod
+    async def _send_json(writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    # ---- 接口 ----
+
+    async def health(self, query, body):
+        return {"status": "ok", "database": self.db_path, "write_batches": self.batcher.batches,
+                "records_written": self.batcher.records, "cache": self.cache.stats()}
+
+    async def metrics(self, query, body):
+        return {"enabled": dm.METRICS.enabled, "prometheus": dm.METRICS.to_prometheus()}
+
+    def _formulas(self):
+        return dict(self.data_mgr.get_formulas())
+
+    def _formula(self, page):
+        expression = self._formulas().get(page)
+        if expression is None:
+            raise HTTPError(404, f"未知页面：{page}")
+        try:
+            return dm.compile_formula(expression)
+        except dm.FormulaError as e:
+            raise HTTPError(500, f"公式页面“{page}”无法编译：{e}") from None
+
+    def _latest_result(self, page):
+        latest = self.data_mgr.get_records(page_filter=page, limit=1)
+        if not latest:
+            raise HTTPError(400, f"请先完成“{page}”计算")
+        return latest[0][3]
+
+    def _compute_one(self, page, params):
+        """读线程：计算单条请求，返回 (结果, 保存的参数, 参数哈希, 是否命中缓存)"""
+        version = None
+        if page in KERNELS:
+            func = KERNELS[page][0]
+            if not isinstance(params, list) or not params:
+                raise ValueError("params 应为非空数值数组")
+            params = [float(v) for v in params]
+            if page in ("参数求和", "参数求积") and len(params) != FIXED_PARAM_COUNT:
+                raise ValueError(f"{page} 需要 {FIXED_PARAM_COUNT} 个参数")
+            stored = params
+        elif page == "综合计算":
+            if not isinstance(params, dict):
+                raise ValueError("params 应为 {\"alpha\": ..., \"beta\": ...}")
+            stored = {"alpha": float(params["alpha"]), "beta": float(params["beta"])}
+            # 与界面一致：缓存键包含当前的求和、求积结果
+            params = dict(stored, sum=self._latest_result("参数求和"), product=self._latest_result("参数求积"))
+
+            def func(p):
+                return (p["alpha"] * p["sum"]) + (p["beta"] * p["product"])
+        else:
+            formula = self._formula(page)
+            values = {name: float(v) for name, v in (params or {}).items()} if isinstance(params, dict) else None
+            if values is None:
+                raise ValueError("公式页面的 params 应为 {变量名: 数值}")
+            for name in formula.variables:
+                if name not in values and name in self._page_titles():
+                    values[name] = self._latest_result(name)
+            params = stored = values
+            func, version = formula.evaluate, formula.fingerprint
+
+        # ResultCache 只在读写内存 LRU 时加锁，各读线程的数据库查找和计算并行进行
+        result, digest, cached = self.cache.get_or_compute(page, params, func, version=version)
+        if not math.isfinite(result):
+            raise ValueError("计算结果不是有限数值")
+        return result, stored, digest, cached
+
+    def _page_titles(self):
+        return {"参数求和", "参数求积", "向量求和", "向量求积", "综合计算"} | set(self._formulas())
+
+    async def compute(self, query, body):
+        page = body.get("page")
+        if not isinstance(page, str):
+            raise ValueError("缺少 page")
+        try:
+            result, stored, digest, cached = await self._read(self._compute_one, page, body.get("params"))
+        except dm.FormulaError as e:
+            raise HTTPError(400, str(e)) from None
+        saved = bool(body.get("save", True))
+        if saved:
+            await self.batcher.save([(page, result, stored, digest)])
+        return {"page": page, "result": result, "cached": cached, "saved": saved}
+
+    def _compute_matrix(self, page, body):
+        """读线程：批量计算，返回 (结果数组, 每行保存的参数)"""
+        params = body.get("params")
+        if not isinstance(params, list) or not params:
+            raise ValueError("params 应为非空数组")
+        if len(params) > MAX_BATCH_ROWS:
+            raise ValueError(f"单次最多计算 {MAX_BATCH_ROWS} 行")
+        if page in ("参数求和", "参数求积"):
+            matrix = np.asarray(params, dtype=float)
+            if matrix.ndim != 2 or matrix.shape[1] != FIXED_PARAM_COUNT:
+                raise ValueError(f"params 应为 N×{FIXED_PARAM_COUNT} 数值矩阵")
+            return KERNELS[page][1](matrix), matrix.tolist()
+        if page in ("向量求和", "向量求积"):
+            func = KERNELS[page][0]
+            vectors = [np.asarray(row, dtype=float) for row in params]
+            return np.array([func(v) for v in vectors]), [v.tolist() for v in vectors]
+        if page == "综合计算":
+            matrix = np.asarray(params, dtype=float)
+            if matrix.ndim != 2 or matrix.shape[1] != FIXED_PARAM_COUNT:
+                raise ValueError(f"params 应为 N×{FIXED_PARAM_COUNT} 数值矩阵")
+            results, alpha, beta = dm.BatchCalculator.composite(
+                dm.BatchCalculator.sum(matrix), dm.BatchCalculator.product(matrix),
+                np.asarray(body.get("alpha", 1.0), dtype=float), np.asarray(body.get("beta", 1.0), dtype=float))
+            return results, [{"alpha": a, "beta": b} for a, b in zip(alpha.tolist(), beta.tolist())]
+
+        formula = self._formula(page)
+        if not all(isinstance(row, dict) for row in params):
+            raise ValueError("公式页面的 params 应为 [{变量名: 数值}, ...]")
+        columns = {name: np.array([float(row[name]) for row in params]) for name in formula.variables}
+        results = np.broadcast_to(formula.evaluate(columns), (len(params),)).astype(float)
+        return results, [dict(zip(formula.variables, values)) for values in zip(*columns.values())] \
+            if formula.variables else [{} for _ in params]
+
+    async def compute_batch(self, query, body):
+        page = body.get("page")
+        if not isinstance(page, str):
+            raise ValueError("缺少 page")
+        try:
+            results, stored = await self._read(self._compute_matrix, page, body)
+        except dm.FormulaError as e:
+            raise HTTPError(400, str(e)) from None
+        saved = bool(body.get("save", True))
+        if saved:
+            bad = np.flatnonzero(~np.isfinite(results))
+            if bad.size:
+                raise ValueError(f"第 {bad[0] + 1} 行的计算结果不是有限数值")
+            await self.batcher.save([(page, result, params, None) for result, params in zip(results.tolist(), stored)])
+        return {"page": page, "results": [r if math.isfinite(r) else None for r in results.tolist()],
+                "saved": saved}
+
+    @staticmethod
+    def _parse_cursor(text):
+        try:
+            timestamp, record_id = text.split(":")
+            return int(timestamp), int(record_id)
+        except ValueError:
+            raise HTTPError(400, "cursor 格式错误") from None
+
+    async def history(self, query, body):
+        """键集分页：返回的 next_cursor 传回 cursor 参数即取下一页"""
+        limit = min(int(query.get("limit", 100)), HISTORY_MAX_LIMIT)
+        if limit < 1:
+            raise ValueError("limit 应为正整数")
+        after = self._parse_cursor(query["cursor"]) if query.get("cursor") else None
+        rows = await self._read(self.data_mgr.get_records_page, query.get("page"), after, limit)
+        records = [{"id": r[0], "timestamp": r[1], "time": dm.format_timestamp(r[1]), "page": r[2],
+                    "result": r[3], "params": dm.decode_params(*r[4:])} for r in rows]
+        next_cursor = f"{rows[-1][1]}:{rows[-1][0]}" if len(rows) == limit else None
+        return {"records": records, "next_cursor": next_cursor}
+
+    async def export(self, writer, query):
+        """分块流式导出 CSV 或 JSON Lines：读线程逐块读取，经有界队列交给连接写出，内存占用与表大小无关"""
+        format_type = query.get("format", "csv")
+        if format_type not in ("csv", "jsonl"):
+            raise HTTPError(400, "format 应为 csv 或 jsonl")
+        page = query.get("page")
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(maxsize=4)
+        cancelled = threading.Event()
+
+        def produce():
+            try:
+                for records in self.data_mgr.iter_records(EXPORT_CHUNK_SIZE, page):
+                    if format_type == "csv":
+                        buffer = io.StringIO()
+                        csv.writer(buffer).writerows(
+                            (dm.format_timestamp(r[1]), r[2], r[3], dm.format_params(*r[4:])) for r in records)
+                        text = buffer.getvalue()
+                    else:
+                        text = "".join(json.dumps({"id": r[0], "timestamp": r[1], "page": r[2], "result": r[3],
+                                                   "params": dm.decode_params(*r[4:])}, ensure_ascii=False) + "\n"
+                                       for r in records)
+                    asyncio.run_coroutine_threadsafe(chunks.put(text.encode('utf-8')), loop).result()
+                    if cancelled.is_set():
+                        break
+            finally:
+                asyncio.run_coroutine_threadsafe(chunks.put(None), loop).result()
+
+        content_type = "text/csv" if format_type == "csv" else "application/x-ndjson"
+        async with self._export_slots:
+            writer.write((f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}; charset=utf-8\r\n"
+                          f"Content-Disposition: attachment; filename=calc_history.{format_type}\r\n"
+                          "Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n").encode('latin-1'))
+            if format_type == "csv":
+                header = io.StringIO()
+                csv.writer(header).writerow(dm.StreamingExporter.HEADERS)
+                self._write_chunk(writer, header.getvalue().encode('utf-8-sig'))
+            done = loop.run_in_executor(self.readers, produce)
+            data = b""
+            try:
+                while (data := await chunks.get()) is not None:
+                    if data:
+                        self._write_chunk(writer, data)
+                        await writer.drain()
+                await done
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+            except Exception as e:
+                # 响应头已发出，不再写结束块，客户端据此判断导出不完整
+                print(f"WARN: 导出中断：{e}")
+            finally:
+                # 通知读线程停止，并取走剩余的块让它结束
+                cancelled.set()
+                while data is not None:
+                    data = await chunks.get()
+                await asyncio.gather(done, return_exceptions=True)
+
+    @staticmethod
+    def _write_chunk(writer, data):
+        writer.write(f"{len(data):x}\r\n".encode('latin-1') + data + b"\r\n")
+
+
+async def serve(db_path, host, port, read_workers):
+    service = CalcService(db_path, read_workers)
+    server = await service.start(host, port)
+    print(f"DEBUG: 计算服务已启动 http://{host}:{port}（数据库 {db_path}，读线程 {read_workers}）")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="计算内核与历史记录的本地 HTTP 服务")
+    parser.add_argument("--db", default=dm.DB_PATH)
+    parser.add_argument("--host", default=HOST, help="默认只监听本机")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--read-workers", type=int, default=READ_POOL_SIZE)
+    parser.add_argument("--metrics", action="store_true", help="启用运行指标（GET /metrics）")
+    args = parser.parse_args()
+    dm.METRICS.enabled = args.metrics
+    try:
+        asyncio.run(serve(args.db, args.host, args.port, args.read_workers))
+    except KeyboardInterrupt:
+        print("DEBUG: 计算服务已停止")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""计算服务的本机压力测试
+
+启动 calc_service.py 后运行，默认 200 个并发客户端各自通过 keep-alive 连接发送请求，
+按比例混合单条计算、批量计算和历史分页查询，输出各类请求的吞吐和延迟分位数。
+
+    python calc_service.py --db load.db
+    python load_test.py --clients 200 --requests 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from urllib.parse import quote
+
+import numpy as np
+
+# 请求构成：(类型, 占比)
+REQUEST_MIX = (("compute", 0.70), ("history", 0.25), ("batch", 0.05))
+BATCH_ROWS = 100
+
+
+class Client:
+    """单个 keep-alive 连接上的最小 HTTP/1.1 客户端"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else b""
+        self.writer.write((f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                           "Content-Type: application/json\r\n"
+                           f"Content-Length: {len(body)}\r\n\r\n").encode('latin-1') + body)
+        await self.writer.drain()
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status = int(head.split(b" ", 2)[1])
+        length = 0
+        close = False
+        for line in head.decode('latin-1').split("\r\n")[1:]:
+            name, _, value = line.partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+            elif name.lower() == "connection" and value.strip().lower() == "close":
+                close = True
+        data = await self.reader.readexactly(length)
+        if close:
+            await self.close()
+        return status, json.loads(data) if data else None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def make_request(kind, rng, save):
+    if kind == "compute":
+        if rng.random() < 0.5:
+            params = [round(rng.uniform(0, 100), 2) for _ in range(6)]
+            return "POST", "/compute", {"page": "参数求和", "params": params, "save": save}
+        params = [round(rng.uniform(0.5, 1.5), 2) for _ in range(6)]
+        return "POST", "/compute", {"page": "参数求积", "params": params, "save": save}
+    if kind == "batch":
+        params = [[round(rng.uniform(0, 100), 2) for _ in range(6)] for _ in range(BATCH_ROWS)]
+        return "POST", "/compute/batch", {"page": "参数求和", "params": params, "save": save}
+    return "GET", f"/history?page={quote('参数求和')}&limit=50", None
+
+
+async def run_client(host, port, requests, seed, save, latencies, errors):
+    rng = random.Random(seed)
+    kinds = [kind for kind, _ in REQUEST_MIX]
+    weights = [share for _, share in REQUEST_MIX]
+    client = Client(host, port)
+    try:
+        for _ in range(requests):
+            kind = rng.choices(kinds, weights)[0]
+            method, path, payload = make_request(kind, rng, save)
+            start = time.perf_counter()
+            try:
+                status, _ = await client.request(method, path, payload)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                errors.append(f"{kind}: {e}")
+                await client.close()
+                continue
+            latencies[kind].append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(f"{kind}: HTTP {status}")
+    finally:
+        await client.close()
+
+
+async def run(args):
+    latencies = {kind: [] for kind, _ in REQUEST_MIX}
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(args.host, args.port, args.requests, args.seed + i, not args.no_save,
+                                      latencies, errors) for i in range(args.clients)))
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"{args.clients} 个客户端，共 {total} 个请求，用时 {elapsed:.2f} 秒，吞吐 {total / elapsed:.0f} 请求/秒")
+    print(f"{'类型':<10}{'数量':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'最大(ms)':>10}")
+    worst_p99 = 0.0
+    for kind, values in latencies.items():
+        if not values:
+            continue
+        p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+        worst_p99 = max(worst_p99, p99)
+        print(f"{kind:<10}{len(values):>8}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{max(values) * 1000:>10.1f}")
+    if errors:
+        print(f"错误 {len(errors)} 个，例如：{errors[0]}")
+    return not errors and (args.max_p99 is None or worst_p99 <= args.max_p99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="计算服务压力测试")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--clients", type=int, default=200, help="并发客户端数")
+    parser.add_argument("--requests", type=int, default=50, help="每个客户端的请求数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-save", action="store_true", help="计算请求不保存记录")
+    parser.add_argument("--max-p99", type=float, help="任一类请求的 p99 延迟（毫秒）超过该值时以失败退出")
+    args = parser.parse_args()
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()